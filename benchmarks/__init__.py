@@ -0,0 +1 @@
+"""Benchmarks of the target-parquet sink pipeline on synthetic Singer streams."""
@@ -0,0 +1,349 @@
+"""Run the benchmarks of the sink pipeline and compare them with a baseline.
+
+Usage:
+    python -m benchmarks.run                      # every scenario, compared with the baseline
+    python -m benchmarks.run -s wide -s nested    # some scenarios
+    python -m benchmarks.run --config '{"fast_ingest": true}'
+    python -m benchmarks.run --save-baseline      # store the results as the new baseline
+
+Each scenario reports the time of the pipeline stages (parsing the messages,
+flattening the records, converting them to Arrow, accumulating the batches and
+writing the parquet files) as reported by the metrics of the sinks of a target
+run, then the records/sec, input MB/sec, output bytes and peak RSS of a whole
+`TargetParquet` run in a separate process.
+The time to import the target in a new interpreter is measured too, and the
+remote backends and heavy modules it loads lazily must not be imported.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout, suppress
+from io import StringIO
+from pathlib import Path
+
+from benchmarks.streams import SCENARIOS, Scenario, generate_messages
+from target_parquet.utils.ingest import loads
+from target_parquet.utils.metrics import Metric, MetricType
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+# Stages timed by the metrics of the sinks, after parsing the messages
+STAGE_METRICS = {
+    "flatten": Metric.FLATTEN_DURATION,
+    "to_arrow": Metric.CAST_DURATION,
+    "accumulate": Metric.TABLE_BUILD_DURATION,
+    "write": Metric.ENCODE_DURATION,
+}
+IMPORT_BENCHMARK = "import"
+# Only imported when the destination or settings using them are
+LAZY_MODULES = ("azure.identity", "pyarrowfs_adlgen2", "pyarrow.compute")
+
+
+def _reset_peak_rss() -> None:
+    # The peak RSS of a new process starts from the one of its parent on Linux
+    with suppress(OSError):
+        Path("/proc/self/clear_refs").write_text("5")
+
+
+def _peak_rss_mb() -> float:
+    with suppress(OSError):
+        status = Path("/proc/self/status").read_text()
+        return int(re.search(r"VmHWM:\s+(\d+) kB", status).group(1)) / 1024
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in KB on Linux and in bytes on macOS
+    return peak_rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def _directory_size(path: str) -> int:
+    return sum(file.stat().st_size for file in Path(path).rglob("*") if file.is_file())
+
+
+def run_stages(
+    scenario: Scenario,
+    num_records: int,
+    batch_size: int,
+    output_dir: str,
+    config: dict | None = None,
+) -> dict[str, float]:
+    """Time each stage of the pipeline on the records of a scenario, in seconds.
+
+    The messages are parsed the way the target parses them, then a `TargetParquet`
+    processes them in the current process, and the other stages take the time its
+    sinks report in their metrics.
+    """
+    from target_parquet.target import TargetParquet
+
+    target = TargetParquet(
+        config={
+            "destination_path": output_dir,
+            "max_batch_size": batch_size,
+            **scenario.config,
+            **(config or {}),
+        }
+    )
+    lines = list(generate_messages(scenario, num_records))
+    parse = loads if target.config.get("fast_ingest") else target.deserialize_json
+    start = time.perf_counter()
+    for line in lines:
+        parse(line)
+    stages = {"parse": time.perf_counter() - start}
+
+    # The state messages are written to stdout
+    with Path(os.devnull).open("w") as output, redirect_stdout(output):
+        target.listen(StringIO("\n".join(lines) + "\n"))
+    timers = target.metrics.totals(MetricType.TIMER)
+    return stages | {
+        stage: timers.get(metric, 0.0) for stage, metric in STAGE_METRICS.items()
+    }
+
+
+def run_target(input_path: str, config: dict) -> dict[str, float]:
+    """Run the target on an input file, in the current process."""
+    from target_parquet.target import TargetParquet
+
+    _reset_peak_rss()
+    target = TargetParquet(config=config)
+    start = time.perf_counter()
+    # The state messages are written to stdout
+    devnull = Path(os.devnull)
+    with Path(input_path).open() as file_input, devnull.open(
+        "w"
+    ) as output, redirect_stdout(output):
+        target.listen(file_input)
+    return {"seconds": time.perf_counter() - start, "peak_rss_mb": _peak_rss_mb()}
+
+
+def measure_import_time(module: str = "target_parquet.target", repeat: int = 5) -> dict:
+    """Return the fastest import time of a module in a new interpreter.
+
+    Also returns the modules of `LAZY_MODULES` loaded by the import.
+    """
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps([seconds, [m for m in {LAZY_MODULES!r} if m in sys.modules]]))"
+    )
+    seconds = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", code],  # noqa: S603
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        import_seconds, lazy_modules = json.loads(output.splitlines()[-1])
+        seconds.append(import_seconds)
+    return {"seconds": min(seconds), "lazy_modules": lazy_modules}
+
+
+def run_scenario(
+    scenario: Scenario,
+    num_records: int | None = None,
+    batch_size: int = 10_000,
+    config: dict | None = None,
+    *,
+    run_whole_target: bool = True,
+) -> dict:
+    """Run the benchmarks of a scenario and return their results."""
+    num_records = num_records or scenario.num_records
+    results: dict[str, t.Any] = {"records": num_records}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results["stages"] = run_stages(
+            scenario,
+            num_records,
+            batch_size,
+            os.path.join(tmp_dir, "stages"),
+            config,
+        )
+        if not run_whole_target:
+            return results
+
+        input_path = os.path.join(tmp_dir, "input.jsonl")
+        with Path(input_path).open("w") as file_input:
+            for line in generate_messages(scenario, num_records):
+                file_input.write(line + "\n")
+        output_dir = os.path.join(tmp_dir, "target")
+        target_config = {
+            "destination_path": output_dir,
+            "max_batch_size": batch_size,
+            **scenario.config,
+            **(config or {}),
+        }
+        # A new process, so the peak RSS is the one of the target only
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            target_results = executor.submit(
+                run_target, input_path, target_config
+            ).result()
+
+        seconds = target_results["seconds"]
+        results["target"] = {
+            "seconds": seconds,
+            "records_per_second": num_records / seconds,
+            "input_mb_per_second": Path(input_path).stat().st_size
+            / 1024
+            / 1024
+            / seconds,
+            "output_bytes": _directory_size(output_dir),
+            "peak_rss_mb": target_results["peak_rss_mb"],
+        }
+    return results
+
+
+def compare_with_baseline(
+    results: dict[str, dict], baseline: dict[str, dict], tolerance: float
+) -> list[str]:
+    """Return the regressions of the results compared with the baseline.
+
+    A stage or the whole target is slower, or the peak RSS is higher, by more than
+    `tolerance` (e.g. 0.25 for 25%). Scenarios run with another number of records
+    than the baseline are not compared. The import of the target is slower, or
+    loads one of `LAZY_MODULES`.
+    """
+    regressions = []
+    for name, scenario_results in results.items():
+        expected = baseline.get(name)
+        if name == IMPORT_BENCHMARK:
+            regressions += [
+                f"{name}: {module} is not imported lazily"
+                for module in scenario_results["lazy_modules"]
+            ]
+            measures = [
+                (
+                    "seconds",
+                    scenario_results["seconds"],
+                    (expected or {}).get("seconds"),
+                )
+            ]
+        elif not expected or expected["records"] != scenario_results["records"]:
+            continue
+        else:
+            measures = [
+                (f"stage {stage}", seconds, expected["stages"].get(stage))
+                for stage, seconds in scenario_results["stages"].items()
+            ]
+        if "target" in scenario_results and "target" in expected:
+            measures += [
+                (
+                    f"target {key}",
+                    scenario_results["target"][key],
+                    expected["target"][key],
+                )
+                for key in ("seconds", "peak_rss_mb")
+            ]
+        regressions += [
+            f"{name}: {measure} {value:.3f} > {expected_value:.3f} (+{value / expected_value - 1:.0%})"
+            for measure, value, expected_value in measures
+            if expected_value and value > expected_value * (1 + tolerance)
+        ]
+    return regressions
+
+
+def _format_results(name: str, results: dict) -> str:
+    stages = " | ".join(
+        f"{stage} {seconds:.3f}s" for stage, seconds in results["stages"].items()
+    )
+    lines = [f"{name} ({results['records']} records)", f"  stages: {stages}"]
+    if target := results.get("target"):
+        lines.append(
+            f"  target: {target['seconds']:.2f}s | {target['records_per_second']:.0f} records/s "
+            f"| {target['input_mb_per_second']:.2f} MB/s | {target['output_bytes']} output bytes "
+            f"| peak RSS {target['peak_rss_mb']:.0f} MB"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-s",
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="Scenarios to run, all by default.",
+    )
+    parser.add_argument(
+        "--records", type=int, help="Number of records, the scenario default otherwise."
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=10_000, help="Records per batch."
+    )
+    parser.add_argument(
+        "--config", type=json.loads, default={}, help="Extra target config, as JSON."
+    )
+    parser.add_argument(
+        "--stages-only", action="store_true", help="Don't run the whole target."
+    )
+    parser.add_argument(
+        "--baseline", type=Path, default=BASELINE_PATH, help="Baseline results."
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as the baseline.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed regression, 0.25 for 25%%.",
+    )
+    parser.add_argument(
+        "--output", type=Path, help="Write the results to this JSON file."
+    )
+    args = parser.parse_args(argv)
+
+    # Pay the lazy initializations of pyarrow before timing anything
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run_stages(SCENARIOS["narrow"], 100, args.batch_size, tmp_dir)
+
+    results = {IMPORT_BENCHMARK: measure_import_time()}
+    import_seconds = results[IMPORT_BENCHMARK]["seconds"]
+    print(f"import target_parquet.target: {import_seconds:.3f}s", flush=True)  # noqa: T201
+    for name in args.scenario or SCENARIOS:
+        results[name] = run_scenario(
+            SCENARIOS[name],
+            num_records=args.records,
+            batch_size=args.batch_size,
+            config=args.config,
+            run_whole_target=not args.stages_only,
+        )
+        print(_format_results(name, results[name]), flush=True)  # noqa: T201
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        baseline = (
+            json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        )
+        args.baseline.write_text(json.dumps(baseline | results, indent=2) + "\n")
+        return 0
+    if args.baseline.exists():
+        regressions = compare_with_baseline(
+            results, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")  # noqa: T201
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Synthetic Singer streams for the benchmarks."""
+
+from __future__ import annotations
+
+import json
+import random
+import typing as t
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+COLUMN_TYPES = ["string", "integer", "number", "boolean", "date-time"]
+START_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """Shape of the synthetic streams of a benchmark."""
+
+    name: str
+    description: str
+    num_records: int = 50_000
+    num_streams: int = 1
+    num_columns: int = 10
+    depth: int = 0  # Levels of objects the columns are nested in
+    partitions: int = 0  # Distinct values of the "partition" column
+
+    @property
+    def config(self) -> dict:
+        """Target config of the scenario."""
+        return {"partition_cols": "partition"} if self.partitions else {}
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in [
+        Scenario("narrow", "5 flat columns", num_columns=5),
+        Scenario("wide", "200 flat columns", num_records=10_000, num_columns=200),
+        Scenario(
+            "nested",
+            "20 columns nested in 5 levels of objects",
+            num_columns=20,
+            depth=5,
+        ),
+        Scenario("partitioned", "10 columns and 100 partitions", partitions=100),
+        Scenario(
+            "many_streams", "30 interleaved streams of 10 columns", num_streams=30
+        ),
+    ]
+}
+
+
+def _column_schema(column_type: str) -> dict:
+    if column_type == "date-time":
+        return {"type": ["string", "null"], "format": "date-time"}
+    return {"type": [column_type, "null"]}
+
+
+def stream_schema(scenario: Scenario) -> dict:
+    """Return the JSON schema of the streams of a scenario."""
+    properties = {
+        f"col_{i}": _column_schema(COLUMN_TYPES[i % len(COLUMN_TYPES)])
+        for i in range(scenario.num_columns)
+    }
+    for level in reversed(range(scenario.depth)):
+        properties = {
+            f"level_{level}": {"type": ["object", "null"], "properties": properties}
+        }
+    properties = {"id": {"type": "integer"}, **properties}
+    if scenario.partitions:
+        properties["partition"] = {"type": "string"}
+    return {"type": "object", "properties": properties}
+
+
+def _column_value(column_type: str, rng: random.Random) -> t.Any:  # noqa: ANN401
+    if column_type == "string":
+        return f"value-{rng.randrange(1_000_000)}"
+    if column_type == "integer":
+        return rng.randrange(1_000_000)
+    if column_type == "number":
+        return round(rng.uniform(0, 1000), 2)
+    if column_type == "boolean":
+        return rng.random() < 0.5  # noqa: PLR2004
+    return (START_DATE + timedelta(seconds=rng.randrange(10_000_000))).isoformat()
+
+
+def stream_record(scenario: Scenario, record_id: int, rng: random.Random) -> dict:
+    """Return a record of the streams of a scenario."""
+    record = {
+        f"col_{i}": _column_value(COLUMN_TYPES[i % len(COLUMN_TYPES)], rng)
+        for i in range(scenario.num_columns)
+    }
+    for level in reversed(range(scenario.depth)):
+        record = {f"level_{level}": record}
+    record = {"id": record_id, **record}
+    if scenario.partitions:
+        record["partition"] = f"p{record_id % scenario.partitions}"
+    return record
+
+
+def stream_names(scenario: Scenario) -> list[str]:
+    """Return the names of the streams of a scenario."""
+    return [f"{scenario.name}_{i}" for i in range(scenario.num_streams)]
+
+
+def generate_messages(
+    scenario: Scenario,
+    num_records: int | None = None,
+    seed: int = 0,
+    state_interval: int = 10_000,
+) -> t.Iterator[str]:
+    """Yield the Singer messages of a scenario, as lines without line breaks.
+
+    The records are spread over the streams in turn, and a STATE message follows
+    every `state_interval` records.
+    """
+    rng = random.Random(seed)
+    names = stream_names(scenario)
+    schema = stream_schema(scenario)
+    for name in names:
+        yield json.dumps(
+            {
+                "type": "SCHEMA",
+                "stream": name,
+                "schema": schema,
+                "key_properties": ["id"],
+            }
+        )
+    for record_id in range(num_records or scenario.num_records):
+        yield json.dumps(
+            {
+                "type": "RECORD",
+                "stream": names[record_id % len(names)],
+                "record": stream_record(scenario, record_id, rng),
+            }
+        )
+        if (record_id + 1) % state_interval == 0:
+            yield json.dumps({"type": "STATE", "value": {"records": record_id + 1}})
@@ -2,34 +2,84 @@
 
 from __future__ import annotations
 
+import copy
 import os
+import typing as t
+from collections import deque
 from datetime import datetime, timezone
+from functools import partial
 
-from singer_sdk.helpers._flattening import flatten_schema, flatten_record
+import pyarrow as pa
+from singer_sdk.helpers._flattening import flatten_record, flatten_schema
 from singer_sdk.sinks import BatchSink
 
+from target_parquet.utils import bytes_to_mb, convert_size_to_bytes, deep_sizeof
+from target_parquet.utils.flattening import flatten_schema_columns, get_leaf_schema
+from target_parquet.utils.metrics import Metric, MetricType
 from target_parquet.utils.parquet import (
-    concat_tables,
+    CompressionRatioEstimator,
+    ConstantColumn,
+    PartitionedParquetWriter,
+    RecordBatchAccumulator,
+    RecordBatchBuilder,
+    RollingParquetWriter,
+    codec_writer_options,
     flatten_schema_to_pyarrow_schema,
-    get_pyarrow_table_size,
+    merge_schemas,
+    parquet_writer_options,
+    select_compression,
+    sort_table,
     write_parquet_file,
 )
+from target_parquet.utils.schema_cache import SchemaArtifacts, schema_cache_key
+
+if t.TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from singer_sdk.sinks.core import BaseJSONSchemaValidator
+
+    from target_parquet.target import TargetParquet
+    from target_parquet.utils.background import BackgroundWriter
+
+
+def _finish_batch(batch_builder: RecordBatchBuilder) -> tuple[pa.RecordBatch, dict]:
+    """Convert the records of a builder, with the durations of the conversion."""
+    batch = batch_builder.finish()
+    return batch, batch_builder.durations
 
 
 class ParquetSink(BatchSink):
     """parquet target sink class."""
 
     flatten_max_level = 100  # Max level of nesting to flatten
+    default_target_file_size = 256  # MB, size of the files written in streaming mode
+    encoding_settings = (
+        "compression_level",
+        "use_dictionary",
+        "column_encoding",
+        "write_statistics",
+        "write_page_index",
+        "data_page_size",
+    )
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.pyarrow_df = None
-        self.destination_path = os.path.join(
-            self.config.get("destination_path", "output"), self.stream_name
-        )
-        self.files_saved = 0
+    def __init__(self, target: TargetParquet, *args, **kwargs):
+        self.schema_cache = target.schema_cache  # Used by get_validator
+        super().__init__(target, *args, **kwargs)
+        self.background_writer = target.background_writer
+        self.encoding_pool = target.encoding_pool
+        self.pending_batches: deque[Future] = deque()
+        self.metrics = target.metrics
+        self.metric_tags = {"stream": self.stream_name}
+        self.files_saved = target.files_saved
+        self.record_size = 0  # Bytes of a buffered record, sampled once per batch
         self.destination_type = self.config.get("destination_type")
-        self.azure_account = self.config.get("azure_account")
+        self.filesystem_cache = target.filesystem_cache
+        self.filesystem, self.destination_path = self.filesystem_cache.resolve(
+            os.path.join(
+                self.config.get("destination_path", "output"), self.stream_name
+            ),
+            self.destination_type,
+        )
         # Extra fields
         self.extra_values = (
             dict([kv.split("=") for kv in self.config["extra_fields"].split(",")])
@@ -43,11 +93,14 @@ class ParquetSink(BatchSink):
                 self.extra_values_types[field_name] = {"type": [_type]}
 
         # Create pyarrow schema
-        self.flatten_schema = flatten_schema(
-            self.schema, max_level=self.flatten_max_level
+        (
+            self.flatten_schema,
+            self.flattened_columns,
+            self.pyarrow_schema,
+        ) = self.get_schema_artifacts()
+        self.record_batches = RecordBatchAccumulator(
+            self.pyarrow_schema, spill_dir=self.config.get("spill_dir")
         )
-        self.flatten_schema.get("properties", {}).update(self.extra_values_types)
-        self.pyarrow_schema = flatten_schema_to_pyarrow_schema(self.flatten_schema)
 
         self.partition_cols = (
             self.config["partition_cols"].split(",")
@@ -56,6 +109,298 @@ class ParquetSink(BatchSink):
         )
 
         self.validation()
+        self.extra_columns = {
+            name: ConstantColumn(value, self.pyarrow_schema.field(name))
+            for name, value in self.extra_values.items()
+        }
+
+        # Output sizes, in encoded bytes
+        self.compression_ratio = CompressionRatioEstimator()
+        self.target_file_size = (
+            convert_size_to_bytes(f"{self.config['target_file_size']}M")
+            if self.config.get("target_file_size")
+            else None
+        )
+        self.row_group_size = (
+            convert_size_to_bytes(f"{self.config['row_group_size']}M")
+            if self.config.get("row_group_size")
+            else None
+        )
+        self.streaming_write = self.config.get("streaming_write", False)
+        self.sort_keys = self.get_sort_keys()
+        self.zorder = self.config.get("zorder", False)
+        self.compression_method = self.config.get("compression_method", "gzip")
+        self.writer_options = self.get_writer_options()
+        # With the auto compression, the writer is created once the codec is chosen
+        self.parquet_writer = (
+            None if self.compression_method == "auto" else self.get_parquet_writer()
+        )
+
+    def get_parquet_writer(
+        self,
+    ) -> RollingParquetWriter | PartitionedParquetWriter | None:
+        """Return the writer keeping parquet files open between writes.
+
+        Used for every batch in streaming mode, and for the accumulated tables
+        with partition_cols so each partition is appended to a few large files.
+        """
+        if not self.streaming_write and not self.partition_cols:
+            return None
+        writer_kwargs = {
+            "basename_template": lambda: self.basename_template,
+            "filesystem": self.filesystem,
+            "compression_method": self.compression_method,
+            "max_file_size": self.target_file_size
+            or (
+                convert_size_to_bytes(f"{self.default_target_file_size}M")
+                if self.streaming_write
+                else None
+            ),
+            "row_group_size": self.row_group_size,
+            "compression_ratio": self.compression_ratio,
+            "buffer_size": convert_size_to_bytes(f"{self.config['upload_chunk_size']}M")
+            if self.config.get("upload_chunk_size")
+            else None,
+            "file_callback": self._on_file_closed,
+            "writer_options": self.writer_options,
+        }
+        if self.partition_cols:
+            return PartitionedParquetWriter(
+                self.destination_path,
+                self.pyarrow_schema,
+                self.partition_cols,
+                max_open_partitions=self.config.get("max_open_partitions", 100),
+                idle_timeout=self.config.get("partition_idle_timeout"),
+                **writer_kwargs,
+            )
+        return RollingParquetWriter(
+            self.destination_path, self.pyarrow_schema, **writer_kwargs
+        )
+
+    def get_sort_keys(self) -> list[tuple[str, str]]:
+        """Return the (column, order) keys of sort_by, for the columns of the stream.
+
+        The columns missing from the stream are ignored, so one sort_by can list
+        the columns of several streams.
+        """
+        sort_keys = []
+        for key in (self.config.get("sort_by") or "").split(","):
+            name, _, order = key.strip().partition(":")
+            if name in self.pyarrow_schema.names:
+                sort_keys.append((name, order or "ascending"))
+        assert all(
+            order in ("ascending", "descending") for _, order in sort_keys
+        ), "sort_by orders must be ascending or descending"
+        return sort_keys
+
+    def choose_compression(self, batch: pa.RecordBatch) -> None:
+        """Choose the codec of the stream by trial-encoding its first batch.
+
+        Args:
+            batch: First converted batch of the stream.
+        """
+        self.compression_method = select_compression(
+            batch,
+            bandwidth=convert_size_to_bytes(
+                f"{self.config.get('auto_compression_bandwidth', 100)}M"
+            ),
+            writer_options=self.writer_options,
+        )
+        self.writer_options = codec_writer_options(
+            self.compression_method, self.writer_options
+        )
+        self.logger.info(
+            f"Compressing {self.stream_name} with {self.compression_method}."
+        )
+        self.parquet_writer = self.get_parquet_writer()
+
+    def get_writer_options(self) -> dict[str, t.Any]:
+        """Return the encoding options of the parquet files of the stream.
+
+        The encoding settings of the config are overridden by the ones of the
+        stream in stream_encoding_options.
+        """
+        settings = {key: self.config.get(key) for key in self.encoding_settings}
+        settings.update(
+            (self.config.get("stream_encoding_options") or {}).get(self.stream_name, {})
+        )
+        use_dictionary, write_statistics = (
+            settings[key].split(",")
+            if isinstance(settings[key], str)
+            else settings[key]
+            for key in ("use_dictionary", "write_statistics")
+        )
+        column_encoding = settings["column_encoding"]
+        assert column_encoding in (None, "auto") or isinstance(
+            column_encoding, dict
+        ), "column_encoding must be auto or an encoding per column"
+        if use_dictionary and isinstance(column_encoding, dict):
+            assert not set(use_dictionary) & set(
+                column_encoding
+            ), "use_dictionary and column_encoding must not have the same columns"
+        return parquet_writer_options(
+            self.pyarrow_schema,
+            compression_level=settings["compression_level"],
+            use_dictionary=use_dictionary,
+            column_encoding=column_encoding,
+            write_statistics=write_statistics,
+            write_page_index=settings["write_page_index"] or False,
+            data_page_size=convert_size_to_bytes(f"{settings['data_page_size']}K")
+            if settings["data_page_size"]
+            else None,
+        )
+
+    def get_validator(self) -> BaseJSONSchemaValidator | None:
+        """Return the record validator, shared by the sinks of the same schema.
+
+        Checking a large schema against the JSON Schema metaschema takes longer
+        than compiling it, so it is done once per schema.
+        """
+        if not self.validate_schema:
+            return None
+        key = schema_cache_key(
+            self.schema, validate_formats=self.validate_field_string_format
+        )
+        return self.schema_cache.get_validator(key, super().get_validator)
+
+    def get_schema_artifacts(self) -> SchemaArtifacts:
+        """Return the flattened schema, columns and pyarrow schema of the stream.
+
+        They are compiled once per JSON schema and flattening options, then reused
+        from the schema cache of the target (and `schema_cache_dir` in later runs).
+        """
+        key = schema_cache_key(
+            self.schema,
+            flatten_max_level=self.flatten_max_level,
+            native_types=self.config.get("native_types", False),
+            extra_fields=sorted(self.extra_values),
+            extra_fields_types=self.extra_values_types,
+        )
+        artifacts = self.schema_cache.get(key)
+        if artifacts is None:
+            self.flatten_schema = self.get_flatten_schema()
+            self.flattened_columns = self.get_flattened_columns()
+            artifacts = SchemaArtifacts(
+                self.flatten_schema, self.flattened_columns, self.get_pyarrow_schema()
+            )
+            self.schema_cache.put(key, artifacts)
+        return artifacts
+
+    def get_flatten_schema(self) -> dict:
+        """Return the flattened schema of the records, with the extra fields."""
+        schema = flatten_schema(self.schema, max_level=self.flatten_max_level)
+        schema.get("properties", {}).update(self.extra_values_types)
+        return schema
+
+    def update_schema(self, schema: dict) -> bool:
+        """Evolve the sink to a new schema of the stream, keeping its buffered data.
+
+        The pyarrow schema becomes the merge of the current one and the one of the
+        new schema: new columns are added, removed ones are kept (filled with nulls)
+        and types are widened (e.g. integer to number). The batches accumulated
+        with the previous schema are promoted when they are written, and the open
+        files are kept when the merged schema is the current one.
+        The records of the current batch must be drained first.
+
+        Args:
+            schema: New JSON schema of the stream.
+
+        Returns:
+            False, leaving the sink unchanged, when the schemas are incompatible.
+        """
+        previous = (
+            self.original_schema,
+            self.schema,
+            self.flatten_schema,
+            self.flattened_columns,
+        )
+        self.original_schema = copy.deepcopy(schema)
+        self.schema = schema
+        if self.include_sdc_metadata_properties:
+            self._add_sdc_metadata_to_schema()
+        else:
+            self._remove_sdc_metadata_from_schema()
+        (
+            self.flatten_schema,
+            self.flattened_columns,
+            new_schema,
+        ) = self.get_schema_artifacts()
+        pyarrow_schema = merge_schemas(self.pyarrow_schema, new_schema)
+        if pyarrow_schema is None:
+            (
+                self.original_schema,
+                self.schema,
+                self.flatten_schema,
+                self.flattened_columns,
+            ) = previous
+            return False
+
+        self._validator = self.get_validator()
+        if pyarrow_schema != self.pyarrow_schema:
+            # The converted batches and pending writes have the previous schema
+            self.collect_batches(wait=True)
+            self.pyarrow_schema = pyarrow_schema
+            self.record_batches.set_schema(pyarrow_schema)
+            self.writer_options = self.get_writer_options()
+            if self.compression_method != "auto":
+                self.writer_options = codec_writer_options(
+                    self.compression_method, self.writer_options
+                )
+            self.sort_keys = self.get_sort_keys()
+            if self.parquet_writer:
+                # A parquet file has a single schema
+                if self.background_writer:
+                    self.background_writer.wait()
+                self.parquet_writer.close()
+                self.parquet_writer = self.get_parquet_writer()
+        return True
+
+    def get_flattened_columns(self) -> dict | None:
+        """Return the key paths of the flattened columns in the records.
+
+        The records are then flattened for a whole batch at once, instead of one by
+        one with `flatten_record`, which stays the fallback when the compiled columns
+        don't match the flattened schema.
+        """
+        columns = flatten_schema_columns(self.schema, max_level=self.flatten_max_level)
+        expected = set(self.flatten_schema.get("properties", {})) - set(
+            self.extra_values
+        )
+        if set(columns) - set(self.extra_values) != expected:
+            self.logger.warning(
+                f"Flattening the records of {self.stream_name} one by one."
+            )
+            return None
+        return columns
+
+    def get_pyarrow_schema(self) -> pa.Schema:
+        """Return the pyarrow schema of the flattened records.
+
+        With native_types, the columns are mapped from the schemas of the values
+        they are extracted from, which keep the items and properties of the arrays
+        and objects that `flatten_schema` turns into strings. These values are then
+        stored as lists and structs instead of JSON strings.
+        """
+        native_types = self.config.get("native_types", False)
+        if not native_types or self.flattened_columns is None:
+            return flatten_schema_to_pyarrow_schema(
+                self.flatten_schema, native_types=native_types
+            )
+        properties = {
+            name: get_leaf_schema(self.schema, self.flattened_columns[name].path)
+            if name in self.flattened_columns and name not in self.extra_values_types
+            else field_schema
+            for name, field_schema in self.flatten_schema.get("properties", {}).items()
+        }
+        pyarrow_schema = flatten_schema_to_pyarrow_schema(
+            {**self.flatten_schema, "properties": properties}, native_types=True
+        )
+        for field in pyarrow_schema:
+            if pa.types.is_nested(field.type) and field.name in self.flattened_columns:
+                self.flattened_columns[field.name] = self.flattened_columns[
+                    field.name
+                ]._replace(serialize=False, native=True)
+        return pyarrow_schema
 
     @property
     def basename_template(self) -> str:
@@ -63,9 +408,9 @@ class ParquetSink(BatchSink):
         timestamp = datetime.fromtimestamp(
             self.sync_started_at / 1000, tz=timezone.utc
         ).strftime("%Y%m%d_%H%M%S")
-        basename_template = f"{self.stream_name}-{timestamp}-{self.files_saved}-{{i}}"
-        self.files_saved += 1
-        return basename_template
+        file_number = self.files_saved[self.stream_name]
+        self.files_saved[self.stream_name] += 1
+        return f"{self.stream_name}-{timestamp}-{file_number}-{{i}}"
 
     def validation(self) -> None:
         """Extra fields and Partition Cols validation."""
@@ -90,6 +435,18 @@ class ParquetSink(BatchSink):
         """
         return self.config.get("max_batch_size", 10000)
 
+    def start_batch(self, context: dict) -> None:
+        """Start a new batch with an empty builder.
+
+        Args:
+            context: Stream partition or context dictionary.
+        """
+        context["batch_builder"] = RecordBatchBuilder(
+            self.pyarrow_schema,
+            columns=self.flattened_columns,
+            constants=self.extra_columns,
+        )
+
     def process_record(self, record: dict, context: dict) -> None:
         """Process the record.
 
@@ -97,15 +454,40 @@ class ParquetSink(BatchSink):
             record: Individual record in the stream.
             context: Stream partition or context dictionary.
         """
-        record_flatten = (
-            flatten_record(
+        if self.flattened_columns is None:
+            record = flatten_record(
                 record,
                 flattened_schema=self.flatten_schema,
                 max_level=self.flatten_max_level,
             )
-            | self.extra_values
+        if not context["batch_builder"].num_rows:
+            self.record_size = deep_sizeof(record)
+        context["batch_builder"].append(record)
+
+    @property
+    def buffered_record_bytes(self) -> int:
+        """Estimated memory of the records waiting in the current batch."""
+        batch_builder = (self._pending_batch or {}).get("batch_builder")
+        return batch_builder.num_rows * self.record_size if batch_builder else 0
+
+    @property
+    def buffered_bytes(self) -> int:
+        """Estimated memory of the records and batches the sink holds until a write."""
+        return (
+            self.buffered_record_bytes
+            + self.record_batches.buffered_bytes
+            + (self.parquet_writer.buffered_bytes if self.parquet_writer else 0)
         )
-        super().process_record(record_flatten, context)
+
+    def flush_buffers(self) -> None:
+        """Write the batches and row groups the sink holds in memory.
+
+        The records of the current batch must be drained first.
+        """
+        self.collect_batches(wait=True)
+        self.write_file()
+        if self.parquet_writer:
+            self.parquet_writer.flush()
 
     def process_batch(self, context: dict) -> None:
         """Write out any prepped records and return once fully written.
@@ -113,37 +495,167 @@ class ParquetSink(BatchSink):
         Args:
             context: Stream partition or context dictionary.
         """
+        batch_builder = context.pop("batch_builder", None)
+        if batch_builder is None:
+            return
         self.logger.info(
-            f'Processing batch for {self.stream_name} with {len(context["records"])} records.'
+            f"Processing batch for {self.stream_name} with {batch_builder.num_rows} records."
         )
-        self.pyarrow_df = concat_tables(
-            context.get("records", []), self.pyarrow_df, self.pyarrow_schema
+        if self.encoding_pool:
+            # The records are converted in a worker process, and the converted
+            # batches are collected in order once they are ready
+            future = self.encoding_pool.submit(_finish_batch, batch_builder, nbytes=1)
+            self.pending_batches.append(future)
+            self.record_queue_depth("encoding", self.encoding_pool, future)
+            self.collect_batches()
+        else:
+            self.add_batch(*_finish_batch(batch_builder))
+        self.metrics.flush()
+
+    def collect_batches(self, *, wait: bool = False) -> None:
+        """Add the batches converted by the encoding processes, in order.
+
+        Args:
+            wait: Wait for the batches still being converted.
+        """
+        while self.pending_batches and (wait or self.pending_batches[0].done()):
+            self.add_batch(*self.pending_batches.popleft().result())
+
+    def add_batch(
+        self, batch: pa.RecordBatch, durations: dict[str, float] | None = None
+    ) -> None:
+        """Write a converted batch, or accumulate it until a file is written.
+
+        Args:
+            batch: Converted records of a batch.
+            durations: Seconds spent flattening and converting the records.
+        """
+        for stage, metric in (
+            ("flatten", Metric.FLATTEN_DURATION),
+            ("cast", Metric.CAST_DURATION),
+        ):
+            if durations and stage in durations:
+                self.metrics.record(
+                    MetricType.TIMER, metric, durations[stage], self.metric_tags
+                )
+        if self.compression_method == "auto":
+            self.choose_compression(batch)
+        if self.streaming_write:
+            with self.metrics.timer(Metric.ENCODE_DURATION, self.metric_tags):
+                self.parquet_writer.write(batch)
+            self.logger.info(
+                f"Parquet file size: {self.parquet_writer.bytes_written} bytes"
+            )
+            return
+        with self.metrics.timer(Metric.TABLE_BUILD_DURATION, self.metric_tags):
+            self.record_batches.append(batch)
+        estimated_file_size = self.compression_ratio.estimate(
+            self.record_batches.nbytes
         )
         self.logger.info(
-            f"Pyarrow table size: {self.pyarrow_df.nbytes} | ({len(self.pyarrow_df)} rows)"
+            f"Pyarrow table size: {self.record_batches.nbytes} | ({len(self.record_batches)} rows) "
+            f"| estimated file size: {estimated_file_size}"
         )
-        del context["records"]
         if (
-            get_pyarrow_table_size(self.pyarrow_df)
+            bytes_to_mb(self.record_batches.nbytes)
             > self.config["max_pyarrow_table_size"]
-        ):
+        ) or (self.target_file_size and estimated_file_size >= self.target_file_size):
             self.write_file()
 
     def write_file(self) -> None:
         """Write a local file."""
-        if self.pyarrow_df is not None:
-            write_parquet_file(
-                self.pyarrow_df,
-                self.destination_path,
-                destination_type=self.destination_type,
-                azure_account=self.azure_account,
-                compression_method=self.config.get("compression", "gzip"),
+        if not self.record_batches:
+            return
+        nbytes = self.record_batches.nbytes
+        with self.metrics.timer(Metric.TABLE_BUILD_DURATION, self.metric_tags):
+            table = self.record_batches.pop_table()
+        if self.parquet_writer:
+            # Partitions are appended to the files kept open by the writer,
+            # which learns the compression ratio itself
+            write = self.parquet_writer.write
+        else:
+            write = partial(
+                write_parquet_file,
+                path=self.destination_path,
+                compression_method=self.compression_method,
                 basename_template=self.basename_template,
                 partition_cols=self.partition_cols,
+                row_group_size=self.compression_ratio.rows_per_row_group(
+                    table, self.row_group_size
+                )
+                if self.row_group_size
+                else None,
+                filesystem=self.filesystem,
+                file_callback=self._on_file_closed,
+                writer_options=self.writer_options,
             )
-            self.pyarrow_df = None
+        write = partial(self._write_table, write, table)
+        if self.background_writer:
+            future = self.background_writer.submit(write, nbytes=nbytes)
+            future.add_done_callback(partial(self._on_file_written, nbytes))
+            self.record_queue_depth("write", self.background_writer, future)
+        else:
+            self.compression_ratio.update(nbytes, write() or 0)
+
+    def _write_table(
+        self, write: t.Callable[[pa.Table], int | None], table: pa.Table
+    ) -> int | None:
+        """Sort the table by sort_by, then write it (in a background thread with async_write)."""
+        if self.sort_keys:
+            # The rows are copied in their new order, a spilled table is loaded in memory
+            with self.metrics.timer(Metric.SORT_DURATION, self.metric_tags):
+                table = sort_table(table, self.sort_keys, zorder=self.zorder)
+        with self.metrics.timer(Metric.ENCODE_DURATION, self.metric_tags):
+            return write(table)
+
+    def _on_file_closed(self, path: str, num_rows: int, num_bytes: int) -> None:
+        """Record the size of a written parquet file."""
+        self.logger.debug(f"Wrote {path} ({num_rows} rows, {num_bytes} bytes)")
+        self.metrics.record(
+            MetricType.COUNTER, Metric.BYTES_WRITTEN, num_bytes, self.metric_tags
+        )
+        self.metrics.record(
+            MetricType.COUNTER, Metric.FILES_WRITTEN, 1, self.metric_tags
+        )
+        self.metrics.record(
+            MetricType.HISTOGRAM, Metric.ROWS_PER_FILE, num_rows, self.metric_tags
+        )
+
+    def record_queue_depth(
+        self, queue: str, pool: BackgroundWriter, future: Future | None = None
+    ) -> None:
+        """Record the number of jobs waiting in a background pool.
+
+        With the `future` of a submitted job, the depth is recorded again once the
+        job is done, so the gauge follows the queue as it drains.
+        """
+        self.metrics.record(
+            MetricType.GAUGE,
+            Metric.QUEUE_DEPTH,
+            pool.queue_depth,
+            {**self.metric_tags, "queue": queue},
+        )
+        if future is not None:
+            future.add_done_callback(lambda _: self.record_queue_depth(queue, pool))
+
+    def _on_file_written(self, in_memory_bytes: int, future: Future) -> None:
+        """Learn the compression ratio from a background write."""
+        if not future.cancelled() and future.exception() is None:
+            self.compression_ratio.update(in_memory_bytes, future.result() or 0)
 
     def clean_up(self) -> None:
         """Perform any clean up actions required at end of a stream."""
+        self.collect_batches(wait=True)
         self.write_file()
+        if self.background_writer:
+            self.background_writer.wait()
+        # Recorded once drained, the done jobs record their depths in any order
+        if self.encoding_pool:
+            self.record_queue_depth("encoding", self.encoding_pool)
+        if self.background_writer:
+            self.record_queue_depth("write", self.background_writer)
+        if self.parquet_writer:
+            self.parquet_writer.close()
+        self.filesystem_cache.wait()
+        self.metrics.flush()
         super().clean_up()
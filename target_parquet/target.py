@@ -2,12 +2,28 @@
 
 from __future__ import annotations
 
+import typing as t
+from collections import Counter, defaultdict
+
+import pyarrow as pa
 from singer_sdk import typing as th
+from singer_sdk.io_base import SingerMessageType
 from singer_sdk.target_base import Target
 
 from target_parquet.sinks import (
     ParquetSink,
 )
+from target_parquet.utils import convert_size_to_bytes
+from target_parquet.utils.background import BackgroundWriter
+from target_parquet.utils.filesystem import FileSystemCache
+from target_parquet.utils.ingest import (
+    has_number_constraints,
+    loads,
+    parses_floats,
+    read_lines,
+)
+from target_parquet.utils.metrics import MetricsRecorder
+from target_parquet.utils.schema_cache import SchemaCache
 
 
 class TargetParquet(Target):
@@ -19,15 +35,124 @@ class TargetParquet(Target):
         th.Property(
             "destination_path",
             th.StringType,
-            description="Destination Path",
+            description="Destination Path. It can be a local path or an URI of a supported filesystem "
+            "(e.g. s3://bucket/prefix, gs://bucket/prefix, abfs://container/prefix).",
+        ),
+        th.Property(
+            "destination_type",
+            th.StringType,
+            description="Filesystem of destination_path when it isn't an URI (e.g. local, azure).",
+        ),
+        th.Property(
+            "azure_account",
+            th.StringType,
+            description="Azure storage account name for the azure destination.",
+        ),
+        th.Property(
+            "filesystem_options",
+            th.ObjectType(),
+            description="Extra arguments of the pyarrow S3FileSystem or GcsFileSystem "
+            "(e.g. region, endpoint_override, scheme).",
+        ),
+        th.Property(
+            "upload_concurrency",
+            th.IntegerType,
+            description="Number of pyarrow IO threads, used to upload the parts of a file "
+            "concurrently to the remote filesystems.",
+        ),
+        th.Property(
+            "upload_chunk_size",
+            th.IntegerType,
+            description="Size in MB of the chunks written to the destination filesystem by the "
+            "streaming and partitioned writers.",
+        ),
+        th.Property(
+            "staging_dir",
+            th.StringType,
+            description="Local spool directory for remote destinations. Files are encoded there at disk "
+            "speed, then uploaded concurrently with retries and deleted once uploaded. "
+            "Files left by an interrupted run are uploaded on the next one. Targets running at "
+            "the same time can share it, each one spooling to its own locked subdirectory.",
+        ),
+        th.Property(
+            "staging_upload_workers",
+            th.IntegerType,
+            description="Number of threads uploading the staged files.",
+            default=4,
+        ),
+        th.Property(
+            "staging_upload_retries",
+            th.IntegerType,
+            description="Number of retries of a failed upload of a staged file.",
+            default=3,
         ),
         th.Property(
             "compression_method",
             th.StringType,
             description="(Default - gzip) Compression methods have to be supported by Pyarrow, "
-            "and currently the compression modes available are - snappy, zstd, brotli and gzip.",
+            "and currently the compression modes available are - snappy, zstd, lz4, brotli and gzip. "
+            "With auto, the first batch of each stream is encoded with snappy, zstd, lz4 and gzip, "
+            "and the stream is compressed with the codec of the lowest encoding time plus transfer "
+            "time at auto_compression_bandwidth.",
             default="gzip",
         ),
+        th.Property(
+            "auto_compression_bandwidth",
+            th.IntegerType,
+            description="Bandwidth in MB/s of the destination, used to choose the codec when "
+            "compression_method is auto. A lower bandwidth favors the smaller files, a higher one "
+            "the faster codecs.",
+            default=100,
+        ),
+        th.Property(
+            "compression_level",
+            th.IntegerType,
+            description="Level of the compression method (e.g. 1 to 22 for zstd, 1 to 9 for gzip). "
+            "Defaults to the default level of the method.",
+        ),
+        th.Property(
+            "use_dictionary",
+            th.StringType,
+            description="Columns to dictionary encode. (e.g. col1,col2) "
+            "Defaults to every column without a column_encoding.",
+        ),
+        th.Property(
+            "column_encoding",
+            th.CustomType({"type": ["object", "string"]}),
+            description='Encoding of the columns (e.g. {"price": "BYTE_STREAM_SPLIT", '
+            '"id": "DELTA_BINARY_PACKED"}), among PLAIN, BYTE_STREAM_SPLIT, DELTA_BINARY_PACKED, '
+            "DELTA_LENGTH_BYTE_ARRAY, DELTA_BYTE_ARRAY and RLE. The encodings not supported by the "
+            "type of a column are ignored. Set it to auto for BYTE_STREAM_SPLIT on floats and "
+            "DELTA_BINARY_PACKED on integers and timestamps, which compress better but are not read "
+            "by every parquet reader. The other columns are dictionary encoded.",
+        ),
+        th.Property(
+            "write_statistics",
+            th.StringType,
+            description="Columns with min/max statistics. (e.g. col1,col2) "
+            "Defaults to every column.",
+        ),
+        th.Property(
+            "write_page_index",
+            th.BooleanType,
+            description="Write the page index of the columns with statistics, so readers filtering "
+            "on them (e.g. point lookups by id in a sorted file) skip the pages and not only the "
+            "row groups outside of the filter.",
+            default=False,
+        ),
+        th.Property(
+            "data_page_size",
+            th.IntegerType,
+            description="Size in KB of the data pages. Smaller pages make the page index more "
+            "selective, for some more encoding overhead. Defaults to 1024.",
+        ),
+        th.Property(
+            "stream_encoding_options",
+            th.ObjectType(),
+            description="compression_level, use_dictionary, column_encoding, write_statistics, "
+            "write_page_index and data_page_size of some streams, overriding the ones of the config "
+            '(e.g. {"users": {"compression_level": 9, "use_dictionary": "country"}}).',
+        ),
         th.Property(
             "max_pyarrow_table_size",
             th.IntegerType,
@@ -42,6 +167,30 @@ class TargetParquet(Target):
             "It can control the memory usage of the target.",
             default=10000,
         ),
+        th.Property(
+            "max_memory",
+            th.IntegerType,
+            description="Memory budget in MB of the buffered data of all the streams, e.g. the memory "
+            "limit of the container minus a margin for the interpreter. The Arrow memory and the "
+            "records waiting in the batches are checked every few records, and the streams "
+            "holding the most data are written until the usage is under the budget.",
+        ),
+        th.Property(
+            "spill_dir",
+            th.StringType,
+            description="Local directory where the batches of each stream are appended to an Arrow "
+            "IPC file until a parquet file is written, instead of being kept in memory. The file is "
+            "memory-mapped to write the parquet file, so max_pyarrow_table_size then bounds the "
+            "disk usage per stream and files larger than the memory can be written, except with "
+            "sort_by.",
+        ),
+        th.Property(
+            "schema_cache_dir",
+            th.StringType,
+            description="Local directory where the flattened and pyarrow schemas compiled from "
+            "the stream schemas are cached, one file per schema and flattening options, so the "
+            "next runs skip compiling them. Within a run, they are always cached in memory.",
+        ),
         th.Property(
             "extra_fields",
             th.StringType,
@@ -58,9 +207,307 @@ class TargetParquet(Target):
             th.StringType,
             description="Extra fields to add to the flattened record. (e.g. extra_col1,extra_col2)",
         ),
+        th.Property(
+            "native_types",
+            th.BooleanType,
+            description="Store date-time and date strings as timestamp[us, UTC] and date32, numbers "
+            "with multipleOf as decimal128, and arrays or objects with items or properties in the "
+            "schema as list and struct columns instead of strings.",
+            default=False,
+        ),
+        th.Property(
+            "fast_ingest",
+            th.BooleanType,
+            description="Read the input in large chunks and parse it with orjson when it is installed. "
+            "orjson parses the numbers with a fraction as floats instead of decimals, except for the "
+            "schemas and the records of the streams whose schema constrains numbers (e.g. multipleOf).",
+            default=False,
+        ),
+        th.Property(
+            "sort_by",
+            th.StringType,
+            description="Columns to sort the rows of each file by, so the min/max statistics of the "
+            "row groups let query engines skip most of them. (e.g. customer_id,created_at:descending) "
+            "Columns missing from a stream are ignored. Not applied in streaming mode. The sorted rows "
+            "of a file are copied in memory, so with spill_dir the files must fit in memory too.",
+        ),
+        th.Property(
+            "zorder",
+            th.BooleanType,
+            description="Sort the rows along a Z-order curve over the sort_by columns instead of "
+            "lexicographically, which clusters them by every column rather than mostly by the first one.",
+            default=False,
+        ),
+        th.Property(
+            "async_write",
+            th.BooleanType,
+            description="Write parquet files in background threads, so reading the input "
+            "stream continues while files are compressed and uploaded.",
+            default=False,
+        ),
+        th.Property(
+            "async_write_workers",
+            th.IntegerType,
+            description="Number of background threads writing parquet files when async_write is enabled.",
+            default=1,
+        ),
+        th.Property(
+            "async_write_max_queue_size",
+            th.IntegerType,
+            description="Max size in MB of the pyarrow tables waiting to be written when async_write "
+            "is enabled. Reading the input stream pauses while the queue is full.",
+            default=800,
+        ),
+        th.Property(
+            "encoding_processes",
+            th.IntegerType,
+            description="Number of worker processes converting the batches of records to Arrow, "
+            "so the flattening and conversion of the streams use several cores. The converted "
+            "batches are sent back with Arrow's serialization. Disabled by default.",
+        ),
+        th.Property(
+            "streaming_write",
+            th.BooleanType,
+            description="Write every processed batch straight to an open parquet file as a row group, "
+            "instead of accumulating a pyarrow table up to max_pyarrow_table_size. "
+            "It keeps roughly one batch per stream in memory.",
+            default=False,
+        ),
+        th.Property(
+            "target_file_size",
+            th.IntegerType,
+            description="Size in MB of the encoded parquet files. A file is written (or a new one started "
+            "in streaming mode) once it is reached, based on the actual encoded bytes in streaming mode "
+            "and on the compression ratio learned from previous files otherwise. "
+            "Defaults to 256 in streaming mode and to no limit otherwise.",
+        ),
+        th.Property(
+            "row_group_size",
+            th.IntegerType,
+            description="Size in MB of the encoded row groups, estimated with the compression ratio "
+            "learned from previous writes. Defaults to one row group per batch in streaming mode "
+            "and to the pyarrow default otherwise.",
+        ),
+        th.Property(
+            "max_open_partitions",
+            th.IntegerType,
+            description="Max number of partitions with an open parquet file when partition_cols is set. "
+            "Partitions are appended to their open file across writes, the least recently written "
+            "one is closed when the limit is reached.",
+            default=100,
+        ),
+        th.Property(
+            "partition_idle_timeout",
+            th.IntegerType,
+            description="Close the parquet file of a partition that hasn't been written for this "
+            "number of seconds. By default files are only closed by max_open_partitions, "
+            "target_file_size or at the end of the stream.",
+        ),
+        th.Property(
+            "metrics_prometheus_file",
+            th.StringType,
+            description="Path of a Prometheus text file (e.g. for the textfile collector of "
+            "node_exporter) updated with the durations of the pipeline stages, the bytes, files "
+            "and rows written and the depth of the background queues.",
+        ),
+        th.Property(
+            "metrics_statsd_address",
+            th.StringType,
+            description="host:port of a StatsD server receiving the metrics over UDP, "
+            "tagged with the stream name (DogStatsD format).",
+        ),
     ).to_dict()
 
     default_sink_class = ParquetSink
+    memory_check_interval = 1000  # Records between two checks of max_memory
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = MetricsRecorder(
+            prometheus_file=self.config.get("metrics_prometheus_file"),
+            statsd_address=self.config.get("metrics_statsd_address"),
+        )
+        self.filesystem_cache = FileSystemCache(self.config, metrics=self.metrics)
+        self.schema_cache = SchemaCache(self.config.get("schema_cache_dir"))
+        # Files written per stream, continued by the sinks replacing each other
+        self.files_saved: t.Counter[str] = Counter()
+        if self.config.get("upload_concurrency"):
+            pa.set_io_thread_count(self.config["upload_concurrency"])
+        self.background_writer = (
+            BackgroundWriter(
+                max_workers=self.config.get("async_write_workers", 1),
+                max_queued_bytes=convert_size_to_bytes(
+                    f"{self.config.get('async_write_max_queue_size', 800)}M"
+                ),
+            )
+            if self.config.get("async_write")
+            else None
+        )
+        # Each batch counts as one in the queue of the encoding processes
+        self.encoding_pool = (
+            BackgroundWriter(
+                max_workers=self.config["encoding_processes"],
+                max_queued_bytes=2 * self.config["encoding_processes"],
+                processes=True,
+                # The errors are raised when the sinks collect the batches
+                queue_errors=False,
+            )
+            if self.config.get("encoding_processes")
+            else None
+        )
+        self.max_memory = (
+            convert_size_to_bytes(f"{self.config['max_memory']}M")
+            if self.config.get("max_memory")
+            else None
+        )
+        self._records_since_memory_check = 0
+
+    def _process_lines(self, file_input: t.IO[str]) -> t.Counter[str]:
+        """Process the input lines, with the fast ingest path when it is enabled.
+
+        The fast path reads the lines in large chunks from the binary input, parses
+        them with orjson when it is installed, and dispatches each message straight
+        to its handler. The SCHEMA messages, and the RECORD messages of the streams
+        whose schema constrains numbers (e.g. multipleOf), are parsed again with
+        decimals, so they are validated exactly like on the default path.
+        """
+        if not self.config.get("fast_ingest"):
+            return super()._process_lines(file_input)
+        self.logger.info("Target '%s' is listening for input from tap.", self.name)
+        handlers = {
+            SingerMessageType.RECORD: self._process_record_message,
+            SingerMessageType.SCHEMA: self._process_schema_message,
+            SingerMessageType.STATE: self._process_state_message,
+            SingerMessageType.ACTIVATE_VERSION: self._process_activate_version_message,
+            SingerMessageType.BATCH: self._process_batch_message,
+        }
+        stats: dict[str, int] = defaultdict(int)
+        decimal_streams: set[str] = set()
+        for line in read_lines(file_input):
+            message = loads(line)
+            if "type" not in message:
+                self._assert_line_requires(message, requires={"type"})
+            record_type = message["type"]
+            if parses_floats() and (
+                record_type == SingerMessageType.SCHEMA
+                or (
+                    record_type == SingerMessageType.RECORD
+                    and message.get("stream") in decimal_streams
+                )
+            ):
+                message = loads(line, decimals=True)
+            if record_type == SingerMessageType.SCHEMA:
+                if has_number_constraints(message.get("schema")):
+                    decimal_streams.add(message.get("stream"))
+                else:
+                    decimal_streams.discard(message.get("stream"))
+            handlers.get(record_type, self._process_unknown_message)(message)
+            stats[record_type] += 1
+        counter = Counter(**stats)
+        self.logger.info(
+            "Target '%s' completed reading %d lines of input "
+            "(%d schemas, %d records, %d batch manifests, %d state messages).",
+            self.name,
+            sum(counter.values()),
+            counter[SingerMessageType.SCHEMA],
+            counter[SingerMessageType.RECORD],
+            counter[SingerMessageType.BATCH],
+            counter[SingerMessageType.STATE],
+        )
+        return counter
+
+    def get_sink(
+        self,
+        stream_name: str,
+        *,
+        record: dict | None = None,
+        schema: dict | None = None,
+        key_properties: t.Sequence[str] | None = None,
+    ) -> ParquetSink:
+        """Return the sink of a stream, evolving its schema when a new one is compatible.
+
+        The SDK replaces the sink of a stream on every schema change, which writes
+        the buffered data in a new file. Compatible changes are applied to the
+        existing sink instead, and the sinks replaced after an incompatible change
+        are written and cleaned up right away, rather than at the end of the input.
+        """
+        sink = self._sinks_active.get(stream_name) if schema is not None else None
+        if (
+            sink is not None
+            and sink.original_schema != schema
+            and list(sink.key_properties) == list(key_properties or [])
+        ):
+            self.drain_one(sink)
+            if sink.update_schema(schema):
+                self.logger.info(
+                    "Schema for '%s' stream has changed, merged with the previous one.",
+                    stream_name,
+                )
+                return sink
+        sink = super().get_sink(
+            stream_name, record=record, schema=schema, key_properties=key_properties
+        )
+        for replaced_sink in self._sinks_to_clear:
+            self.drain_one(replaced_sink)
+            replaced_sink.clean_up()
+        self._sinks_to_clear = []
+        return sink
+
+    def _process_record_message(self, message_dict: dict) -> None:
+        """Process a RECORD message, then check the memory budget every few records."""
+        super()._process_record_message(message_dict)
+        if self.max_memory:
+            self._records_since_memory_check += 1
+            if self._records_since_memory_check >= self.memory_check_interval:
+                self._records_since_memory_check = 0
+                self.enforce_memory_budget()
+
+    def memory_usage(self) -> int:
+        """Return the Arrow memory plus the memory of the records waiting in batches."""
+        return pa.total_allocated_bytes() + sum(
+            sink.buffered_record_bytes for sink in self._sinks_active.values()
+        )
+
+    def enforce_memory_budget(self) -> None:
+        """Write the data of the largest streams until the memory is under max_memory.
+
+        The pending background writes are waited for when flushing the streams
+        isn't enough.
+        """
+        sinks = sorted(
+            self._sinks_active.values(),
+            key=lambda sink: sink.buffered_bytes,
+            reverse=True,
+        )
+        for sink in sinks:
+            memory_usage = self.memory_usage()
+            if memory_usage <= self.max_memory or not sink.buffered_bytes:
+                break
+            self.logger.info(
+                f"Memory usage {memory_usage} bytes over max_memory, "
+                f"writing the data of {sink.stream_name}."
+            )
+            self.drain_one(sink)
+            sink.flush_buffers()
+        if self.background_writer and self.memory_usage() > self.max_memory:
+            self.background_writer.wait()
+
+    def _write_state_message(self, state: dict) -> None:
+        """Emit the state once the batches of the encoding processes are collected."""
+        for sink in self._sinks_active.values():
+            sink.collect_batches(wait=True)
+        super()._write_state_message(state)
+
+    def _process_endofpipe(self) -> None:
+        """Drain all sinks and wait for the background writes to finish."""
+        try:
+            super()._process_endofpipe()
+        finally:
+            if self.background_writer:
+                self.background_writer.close()
+            if self.encoding_pool:
+                self.encoding_pool.close()
+            self.metrics.close()
 
 
 if __name__ == "__main__":
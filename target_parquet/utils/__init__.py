@@ -1,4 +1,6 @@
 import re
+import sys
+import typing as t
 
 
 def bytes_to_mb(x: int) -> float:
@@ -6,6 +8,18 @@ def bytes_to_mb(x: int) -> float:
     return x / (1024 * 1024)
 
 
+def deep_sizeof(value: t.Any) -> int:  # noqa: ANN401
+    """Return the memory size of a value with the values of its dicts and lists."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(
+            sys.getsizeof(key) + deep_sizeof(item) for key, item in value.items()
+        )
+    elif isinstance(value, list):
+        size += sum(deep_sizeof(item) for item in value)
+    return size
+
+
 def convert_size_to_bytes(size_str: str) -> int:
     """Convert a size string to bytes."""
     match = re.match(r"(\d+)([KkMmGg]?)", size_str)
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import multiprocessing
+import threading
+import typing as t
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+
+class BackgroundWriter:
+    """Run write jobs on worker threads, bounded by the bytes waiting to be written.
+
+    `submit` blocks while the queued bytes exceed `max_queued_bytes`, so a slow
+    destination slows down the ingestion instead of growing the memory usage.
+    A single job is always accepted when nothing is queued, whatever its size,
+    and the queue is unbounded without `max_queued_bytes`.
+    Errors raised by a job are re-raised on the next `submit` or `wait` call, or
+    without `queue_errors` only by the futures, when their results are collected.
+    With `processes`, the jobs run in worker processes started with spawn, so the
+    functions, their arguments and their results must be picklable.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        max_workers: int = 1,
+        max_queued_bytes: int | None = None,
+        thread_name_prefix: str = "target-parquet-writer",
+        *,
+        processes: bool = False,
+        queue_errors: bool = True,
+    ) -> None:
+        self.max_queued_bytes = max_queued_bytes
+        self.queue_errors = queue_errors
+        self._executor = (
+            ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            if processes
+            else ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=thread_name_prefix
+            )
+        )
+        self._condition = threading.Condition()
+        self._queued_bytes = 0
+        self._pending: set[Future] = set()
+        self._errors: list[BaseException] = []
+
+    @property
+    def queued_bytes(self) -> int:
+        """Bytes of the jobs submitted and not finished yet."""
+        return self._queued_bytes
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of jobs submitted and not finished yet."""
+        return len(self._pending)
+
+    def submit(
+        self, fn: t.Callable[..., t.Any], *args: t.Any, nbytes: int = 0, **kwargs: t.Any
+    ) -> Future:
+        """Schedule `fn(*args, **kwargs)`, waiting for room in the queue first."""
+        self._raise_errors()
+        with self._condition:
+            self._condition.wait_for(
+                lambda: not self._pending
+                or self.max_queued_bytes is None
+                or self._queued_bytes + nbytes <= self.max_queued_bytes
+                or bool(self._errors)
+            )
+            self._raise_errors()
+            self._queued_bytes += nbytes
+            future = self._executor.submit(fn, *args, **kwargs)
+            self._pending.add(future)
+        future.add_done_callback(partial(self._on_done, nbytes))
+        return future
+
+    def _on_done(self, nbytes: int, future: Future) -> None:
+        with self._condition:
+            self._queued_bytes -= nbytes
+            self._pending.discard(future)
+            if (
+                self.queue_errors
+                and not future.cancelled()
+                and future.exception() is not None
+            ):
+                self._errors.append(future.exception())
+            self._condition.notify_all()
+
+    def _raise_errors(self) -> None:
+        if self._errors:
+            raise self._errors.pop(0)
+
+    def wait(self) -> None:
+        """Block until every submitted job is done and raise the first error."""
+        with self._condition:
+            self._condition.wait_for(lambda: not self._pending)
+        self._raise_errors()
+
+    def close(self) -> None:
+        """Drain the queue and stop the workers."""
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
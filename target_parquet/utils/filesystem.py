@@ -0,0 +1,365 @@
+from __future__ import annotations
+
+import io
+import logging
+import os
+import posixpath
+import shutil
+import threading
+import time
+import typing as t
+import uuid
+from pathlib import Path
+
+import pyarrow.fs
+
+from target_parquet.utils.background import BackgroundWriter
+from target_parquet.utils.metrics import Metric, MetricsRecorder, MetricType
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+FileSystemFactory = t.Callable[[t.Mapping[str, t.Any]], pyarrow.fs.FileSystem]
+
+FILESYSTEM_BACKENDS: dict[str, FileSystemFactory] = {}
+
+STAGING_SUFFIX = ".staging"
+SPOOL_LOCK_SUFFIX = ".lock"
+
+logger = logging.getLogger(__name__)
+
+
+def register_filesystem(
+    *schemes: str
+) -> t.Callable[[FileSystemFactory], FileSystemFactory]:
+    """Register a filesystem factory for the given URI schemes.
+
+    The factory receives the target config and returns a pyarrow filesystem whose
+    paths are the destination URIs without their `scheme://` prefix.
+    """
+
+    def decorator(factory: FileSystemFactory) -> FileSystemFactory:
+        for scheme in schemes:
+            FILESYSTEM_BACKENDS[scheme] = factory
+        return factory
+
+    return decorator
+
+
+@register_filesystem("local", "file")
+def _local_filesystem(config: t.Mapping[str, t.Any]) -> pyarrow.fs.FileSystem:  # noqa: ARG001
+    return pyarrow.fs.LocalFileSystem()
+
+
+@register_filesystem("s3")
+def _s3_filesystem(config: t.Mapping[str, t.Any]) -> pyarrow.fs.FileSystem:
+    return pyarrow.fs.S3FileSystem(**config.get("filesystem_options", {}))
+
+
+@register_filesystem("gs", "gcs")
+def _gcs_filesystem(config: t.Mapping[str, t.Any]) -> pyarrow.fs.FileSystem:
+    return pyarrow.fs.GcsFileSystem(**config.get("filesystem_options", {}))
+
+
+@register_filesystem("azure", "abfs", "abfss")
+def _azure_filesystem(config: t.Mapping[str, t.Any]) -> pyarrow.fs.FileSystem:
+    # The Azure SDK takes longer to import than the rest of the target, only load it when used
+    import azure.identity
+    import pyarrowfs_adlgen2
+
+    handler = pyarrowfs_adlgen2.AccountHandler.from_account_name(
+        config.get("azure_account"), azure.identity.DefaultAzureCredential()
+    )
+    return pyarrow.fs.PyFileSystem(handler)
+
+
+def split_destination_path(
+    destination_path: str, destination_type: str | None = None
+) -> tuple[str, str]:
+    """Split a destination path or URI in its filesystem scheme and path.
+
+    Paths without a scheme use `destination_type`, or the local filesystem.
+
+    E.g:
+        split_destination_path("s3://bucket/prefix") == ("s3", "bucket/prefix")
+        split_destination_path("output", "azure") == ("azure", "output")
+    """
+    if "://" in destination_path:
+        scheme, path = destination_path.split("://", 1)
+        return scheme.lower(), path
+    return destination_type or "local", destination_path
+
+
+def get_filesystem(
+    scheme: str, config: t.Mapping[str, t.Any] | None = None
+) -> pyarrow.fs.FileSystem:
+    """Create the filesystem registered for the scheme."""
+    if scheme not in FILESYSTEM_BACKENDS:
+        raise ValueError(
+            f"Unsupported destination filesystem: {scheme}. "
+            f"Available filesystems: {', '.join(sorted(FILESYSTEM_BACKENDS))}"
+        )
+    return FILESYSTEM_BACKENDS[scheme](config or {})
+
+
+def _lock_file(path: str, create: bool = False) -> int | None:  # noqa: FBT001, FBT002
+    """Open and lock a file, None if it is missing or locked by another process.
+
+    The lock is released when the file descriptor is closed or the process exits.
+    """
+    try:
+        fd = os.open(path, os.O_RDWR | (os.O_CREAT if create else 0))
+    except FileNotFoundError:
+        return None
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+    return fd
+
+
+class _StagedFile(io.BufferedWriter):
+    """Local spool file, moved to its final name and uploaded once closed."""
+
+    def __init__(self, local_path: str, on_close: t.Callable[[str], None]) -> None:
+        super().__init__(io.FileIO(f"{local_path}{STAGING_SUFFIX}", "wb"))
+        self.local_path = local_path
+        self.on_close = on_close
+
+    def close(self) -> None:
+        """Close the spool file, then move it to its final name to be uploaded."""
+        if self.closed:
+            return
+        super().close()
+        Path(f"{self.local_path}{STAGING_SUFFIX}").replace(self.local_path)
+        self.on_close(self.local_path)
+
+
+class StagingFileSystemHandler(pyarrow.fs.FileSystemHandler):
+    """Encode files in a local spool directory and upload them once complete.
+
+    Files are written at disk speed in a spool directory of the handler under
+    `staging_dir`, then uploaded to the destination filesystem by a pool of
+    `max_workers` threads, retrying failed uploads up to `retries` times, and
+    deleted locally once uploaded. The spool directory is locked by the process
+    while it runs, so targets can share a `staging_dir`. The complete files of the
+    spool directories of the processes that stopped are uploaded when the handler
+    is created, their partially written files are discarded.
+    Reads and other operations go straight to the destination filesystem.
+    The duration of the uploads is recorded in `metrics` when it is set.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        filesystem: pyarrow.fs.FileSystem,
+        staging_dir: str,
+        max_workers: int = 4,
+        retries: int = 3,
+        metrics: MetricsRecorder | None = None,
+    ) -> None:
+        self.filesystem = filesystem
+        self.staging_dir = staging_dir
+        self.retries = retries
+        self.metrics = metrics
+        self.local = pyarrow.fs.LocalFileSystem()
+        self.uploader = BackgroundWriter(
+            max_workers=max_workers, thread_name_prefix="target-parquet-upload"
+        )
+        Path(staging_dir).mkdir(parents=True, exist_ok=True)
+        self.spool_dir = os.path.join(
+            staging_dir, f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        )
+        self._spool_lock = _lock_file(
+            f"{self.spool_dir}{SPOOL_LOCK_SUFFIX}", create=True
+        )
+        Path(self.spool_dir).mkdir()
+        self.resume_uploads()
+
+    def _local_path(self, path: str) -> str:
+        return os.path.join(self.spool_dir, path.lstrip("/"))
+
+    def resume_uploads(self) -> None:
+        """Upload the complete files left in the spool directories of stopped processes."""
+        if fcntl is None:
+            return  # The spool directories of the running processes are not locked
+        for entry in os.listdir(self.staging_dir):
+            if not entry.endswith(SPOOL_LOCK_SUFFIX):
+                continue
+            lock_path = os.path.join(self.staging_dir, entry)
+            lock = _lock_file(lock_path)
+            if lock is None:
+                continue  # Still used by its process
+            spool_dir = lock_path[: -len(SPOOL_LOCK_SUFFIX)]
+            for root, _, files in os.walk(spool_dir):
+                for file in files:
+                    local_path = os.path.join(root, file)
+                    if local_path.endswith(STAGING_SUFFIX):
+                        continue
+                    logger.info(f"Resuming upload of {local_path}")
+                    # Moved to the spool directory of the handler, which owns it now
+                    path = self._local_path(os.path.relpath(local_path, spool_dir))
+                    Path(path).parent.mkdir(parents=True, exist_ok=True)
+                    Path(local_path).replace(path)
+                    self._submit_upload(path)
+            shutil.rmtree(spool_dir, ignore_errors=True)
+            Path(lock_path).unlink()
+            os.close(lock)
+
+    def _submit_upload(self, local_path: str) -> None:
+        self.uploader.submit(
+            self._upload, local_path, nbytes=Path(local_path).stat().st_size
+        )
+
+    def _upload(self, local_path: str) -> None:
+        path = os.path.relpath(local_path, self.spool_dir).replace(os.sep, "/")
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                self.filesystem.create_dir(posixpath.dirname(path), recursive=True)
+                pyarrow.fs.copy_files(
+                    local_path,
+                    path,
+                    source_filesystem=self.local,
+                    destination_filesystem=self.filesystem,
+                    use_threads=False,
+                )
+                break
+            except OSError:
+                if attempt == self.retries:
+                    raise
+                logger.warning(
+                    f"Upload of {local_path} failed, retrying.", exc_info=True
+                )
+                time.sleep(2**attempt)
+        if self.metrics:
+            self.metrics.record(
+                MetricType.TIMER, Metric.UPLOAD_DURATION, time.perf_counter() - start
+            )
+        Path(local_path).unlink()
+
+    def wait(self) -> None:
+        """Block until every complete file is uploaded."""
+        self.uploader.wait()
+
+    def get_type_name(self) -> str:
+        """Return the type name of the staging filesystem."""
+        return f"staging+{self.filesystem.type_name}"
+
+    def normalize_path(self, path: str) -> str:
+        """Normalize a path of the destination filesystem."""
+        return self.filesystem.normalize_path(path)
+
+    def get_file_info(self, paths: list[str]) -> list[pyarrow.fs.FileInfo]:
+        """Return the info of paths of the destination filesystem."""
+        return self.filesystem.get_file_info(paths)
+
+    def get_file_info_selector(
+        self, selector: pyarrow.fs.FileSelector
+    ) -> list[pyarrow.fs.FileInfo]:
+        """Return the info of the paths of a selector of the destination filesystem."""
+        return self.filesystem.get_file_info(selector)
+
+    def create_dir(self, path: str, recursive: bool) -> None:  # noqa: FBT001
+        """Create a directory in the spool directory."""
+        # Remote directories are created along with the uploads
+        self.local.create_dir(self._local_path(path), recursive=recursive)
+
+    def delete_dir(self, path: str) -> None:
+        """Delete a directory of the destination filesystem."""
+        self.filesystem.delete_dir(path)
+
+    def delete_dir_contents(self, path: str, missing_dir_ok: bool = False) -> None:  # noqa: FBT001, FBT002
+        """Delete the contents of a directory of the destination filesystem."""
+        self.filesystem.delete_dir_contents(path, missing_dir_ok=missing_dir_ok)
+
+    def delete_root_dir_contents(self) -> None:
+        """Delete the contents of the destination filesystem."""
+        self.filesystem.delete_dir_contents("/", accept_root_dir=True)
+
+    def delete_file(self, path: str) -> None:
+        """Delete a file of the destination filesystem."""
+        self.filesystem.delete_file(path)
+
+    def move(self, src: str, dest: str) -> None:
+        """Move a file of the destination filesystem."""
+        self.filesystem.move(src, dest)
+
+    def copy_file(self, src: str, dest: str) -> None:
+        """Copy a file of the destination filesystem."""
+        self.filesystem.copy_file(src, dest)
+
+    def open_input_stream(self, path: str) -> pyarrow.NativeFile:
+        """Open a file of the destination filesystem for reading."""
+        return self.filesystem.open_input_stream(path)
+
+    def open_input_file(self, path: str) -> pyarrow.NativeFile:
+        """Open a file of the destination filesystem for random access reading."""
+        return self.filesystem.open_input_file(path)
+
+    def open_output_stream(self, path: str, metadata: dict) -> pyarrow.NativeFile:  # noqa: ARG002
+        """Open a spool file, uploaded to the destination filesystem once closed."""
+        local_path = self._local_path(path)
+        self.local.create_dir(str(Path(local_path).parent), recursive=True)
+        return pyarrow.PythonFile(
+            _StagedFile(local_path, on_close=self._submit_upload), mode="w"
+        )
+
+    def open_append_stream(self, path: str, metadata: dict) -> pyarrow.NativeFile:
+        """Open a file of the destination filesystem for appending."""
+        return self.filesystem.open_append_stream(path, metadata=metadata)
+
+
+class FileSystemCache:
+    """Create the filesystem of each destination once and share it between writes.
+
+    Remote filesystems keep their credential (which refreshes its own tokens)
+    and connections, instead of discovering the credential again on every write.
+    """
+
+    def __init__(
+        self,
+        config: t.Mapping[str, t.Any] | None = None,
+        metrics: MetricsRecorder | None = None,
+    ) -> None:
+        self.config = config or {}
+        self.metrics = metrics
+        self._filesystems: dict[str, pyarrow.fs.FileSystem] = {}
+        self._staging_handlers: list[StagingFileSystemHandler] = []
+        self._lock = threading.Lock()
+
+    def get(self, scheme: str = "local") -> pyarrow.fs.FileSystem:
+        """Return the cached filesystem of the scheme, creating it if needed.
+
+        With `staging_dir` set, remote filesystems write through a local spool.
+        """
+        with self._lock:
+            if scheme not in self._filesystems:
+                filesystem = get_filesystem(scheme, self.config)
+                if self.config.get("staging_dir") and scheme not in ("local", "file"):
+                    handler = StagingFileSystemHandler(
+                        filesystem,
+                        os.path.join(self.config["staging_dir"], scheme),
+                        max_workers=self.config.get("staging_upload_workers", 4),
+                        retries=self.config.get("staging_upload_retries", 3),
+                        metrics=self.metrics,
+                    )
+                    self._staging_handlers.append(handler)
+                    filesystem = pyarrow.fs.PyFileSystem(handler)
+                self._filesystems[scheme] = filesystem
+            return self._filesystems[scheme]
+
+    def wait(self) -> None:
+        """Block until the staged files are uploaded."""
+        for handler in self._staging_handlers:
+            handler.wait()
+
+    def resolve(
+        self, destination_path: str, destination_type: str | None = None
+    ) -> tuple[pyarrow.fs.FileSystem, str]:
+        """Return the filesystem and the path of a destination path or URI."""
+        scheme, path = split_destination_path(destination_path, destination_type)
+        return self.get(scheme), path
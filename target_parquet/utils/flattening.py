@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import typing as t
+
+# simplejson is installed with singer-sdk, it serializes nested values like its flattening
+import simplejson as json
+from singer_sdk.helpers._flattening import DEFAULT_FLATTENING_SEPARATOR, flatten_key
+
+SCALAR_TYPES = {"string", "integer", "number", "boolean", "null"}
+CONTAINER_TYPES = frozenset((dict, list))
+
+
+class FlattenedColumn(t.NamedTuple):
+    """Key path of a flattened column in the records."""
+
+    path: tuple[str, ...]
+    serialize: bool = False  # The values can be objects or arrays, stored as JSON
+    native: bool = False  # Objects and arrays stored as structs and lists
+
+
+def flatten_schema_columns(
+    schema: dict,
+    max_level: int,
+    separator: str = DEFAULT_FLATTENING_SEPARATOR,
+    parent_keys: tuple[str, ...] = (),
+    level: int = 0,
+) -> dict[str, FlattenedColumn]:
+    """Compile the flattened columns of a schema, with the key path of their values.
+
+    The columns are the same as the ones of singer_sdk's `flatten_schema`, e.g.
+    {"a": {"type": "object", "properties": {"b": {"type": "string"}}}} gives
+    {"a__b": FlattenedColumn(("a", "b"))}.
+    """
+    columns = {}
+    for field_name, field_schema in schema.get("properties", {}).items():
+        if not field_schema:
+            continue  # Skipped by `flatten_schema` too
+        path = (*parent_keys, field_name)
+        types = field_schema.get("type", [])
+        if "object" in types and "properties" in field_schema and level < max_level:
+            columns.update(
+                flatten_schema_columns(
+                    field_schema,
+                    max_level,
+                    separator=separator,
+                    parent_keys=path,
+                    level=level + 1,
+                )
+            )
+        else:
+            types = [types] if isinstance(types, str) else types
+            serialize = not types or not SCALAR_TYPES.issuperset(types)
+            columns[
+                flatten_key(field_name, list(parent_keys), separator)
+            ] = FlattenedColumn(path, serialize)
+    return columns
+
+
+def get_leaf_schema(schema: dict, path: t.Sequence[str]) -> dict:
+    """Return the schema of the values at a key path of the records."""
+    for key in path:
+        schema = schema["properties"][key]
+    return schema
+
+
+def serialize_value(value: t.Any) -> t.Any:  # noqa: ANN401
+    """Serialize objects and arrays to JSON, like `flatten_record` does."""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, use_decimal=True, default=str)
+    return value
+
+
+def _get_parent(
+    parents: dict[tuple[str, ...], dict | None], path: tuple[str, ...]
+) -> dict | None:
+    """Return the object at a key path of a record, looked up once per record."""
+    if path not in parents:
+        parent = _get_parent(parents, path[:-1])
+        value = parent.get(path[-1]) if parent is not None else None
+        parents[path] = value if isinstance(value, dict) else None
+    return parents[path]
+
+
+class ColumnExtractor:
+    """Extract the flattened values of records into one list per column.
+
+    The values are appended as the records arrive, so the records themselves are
+    not kept. Nested objects are looked up once per record for all the columns
+    under them.
+    """
+
+    def __init__(self, columns: t.Iterable[FlattenedColumn]) -> None:
+        self.columns = list(columns)
+        self._keys = [(column.path[:-1], column.path[-1]) for column in self.columns]
+        self._values: list[list] = [[] for _ in self.columns]
+
+    def append(self, record: dict) -> None:
+        """Append the values of a record to the columns, other keys are ignored."""
+        parents: dict[tuple[str, ...], dict | None] = {(): record}
+        for (parent_path, key), values in zip(self._keys, self._values):
+            parent = (
+                parents[parent_path]
+                if parent_path in parents
+                else _get_parent(parents, parent_path)
+            )
+            values.append(parent.get(key) if parent is not None else None)
+
+    def pop_columns(self) -> list[list]:
+        """Return the values appended since the last call, column by column.
+
+        Objects and arrays are serialized to JSON like `flatten_record` does, also
+        in the columns of other types when the records are not validated.
+        """
+        columns, self._values = self._values, [[] for _ in self.columns]
+        for i, (column, values) in enumerate(zip(self.columns, columns)):
+            if not column.native and (
+                column.serialize or not CONTAINER_TYPES.isdisjoint(map(type, values))
+            ):
+                columns[i] = [serialize_value(value) for value in values]
+        return columns
+
+
+def extract_columns(
+    records: t.Iterable[dict], columns: t.Iterable[FlattenedColumn]
+) -> list[list]:
+    """Extract the flattened values of a batch of records, column by column."""
+    extractor = ColumnExtractor(columns)
+    for record in records:
+        extractor.append(record)
+    return extractor.pop_columns()
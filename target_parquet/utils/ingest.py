@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import json
+import logging
+import typing as t
+from contextlib import suppress
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+READ_CHUNK_SIZE = 1024 * 1024  # Bytes of input lines read at once
+# JSON schema keywords comparing numbers, which need them parsed as exact decimals
+NUMBER_CONSTRAINTS = frozenset(
+    {"multipleOf", "minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum"}
+)
+
+# Every digit mapped to "0", to find the runs of digits of the integers orjson
+# parses as floats (outside of -2**63 and 2**64 - 1)
+DIGITS_TO_ZERO = bytes.maketrans(b"123456789", b"000000000")
+WIDE_INTEGER_DIGITS = b"0" * 19
+
+logger = logging.getLogger(__name__)
+
+
+def _has_wide_integer(line: bytes | str) -> bool:
+    """Return whether a line may have an integer wider than the 64 bits of orjson.
+
+    Any run of 19 digits counts, also in a string or a fraction, which only
+    costs a parse by the standard library.
+    """
+    if isinstance(line, str):
+        line = line.encode()
+    return WIDE_INTEGER_DIGITS in line.translate(DIGITS_TO_ZERO)
+
+
+def loads(line: bytes | str, *, decimals: bool = False) -> dict:
+    """Deserialize a Singer message, with orjson when it is installed.
+
+    orjson parses the numbers with a fraction as floats, where the standard
+    library fallback, also used with `decimals`, parses them as `Decimal` like
+    singer_sdk. The lines orjson can't parse exactly, i.e. with NaN, Infinity or
+    integers wider than 64 bits, are parsed by the standard library too.
+    """
+    if orjson is not None and not decimals and not _has_wide_integer(line):
+        with suppress(orjson.JSONDecodeError):
+            return orjson.loads(line)
+    try:
+        return json.loads(line, parse_float=Decimal)
+    except ValueError:
+        logger.exception("Unable to parse:\n%s", line)
+        raise
+
+
+def parses_floats() -> bool:
+    """Return whether `loads` parses the numbers with a fraction as floats."""
+    return orjson is not None
+
+
+def has_number_constraints(schema: object) -> bool:
+    """Return whether a JSON schema constrains numbers, anywhere in it."""
+    if isinstance(schema, dict):
+        return any(
+            (
+                key in NUMBER_CONSTRAINTS
+                and isinstance(value, (int, float, Decimal))
+                and not isinstance(value, bool)
+            )
+            or has_number_constraints(value)
+            for key, value in schema.items()
+        )
+    if isinstance(schema, list):
+        return any(map(has_number_constraints, schema))
+    return False
+
+
+def read_lines(
+    file_input: t.IO, chunk_size: int = READ_CHUNK_SIZE
+) -> t.Iterator[bytes | str]:
+    """Yield the lines of the input, read in chunks of about `chunk_size` bytes.
+
+    The underlying binary buffer is used when there is one (e.g. stdin), so the
+    lines aren't decoded before they are deserialized.
+    """
+    file_input = getattr(file_input, "buffer", file_input)
+    while lines := file_input.readlines(chunk_size):
+        yield from lines
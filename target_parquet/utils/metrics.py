@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import enum
+import logging
+import os
+import socket
+import threading
+import time
+import typing as t
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from singer_sdk.metrics import Point, get_metrics_logger, log
+
+METRIC_PREFIX = "target_parquet"
+
+logger = logging.getLogger(__name__)
+
+
+class Metric(str, enum.Enum):
+    """Metrics of the sink pipeline."""
+
+    FLATTEN_DURATION = "flatten_duration"
+    CAST_DURATION = "cast_duration"
+    TABLE_BUILD_DURATION = "table_build_duration"
+    SORT_DURATION = "sort_duration"
+    ENCODE_DURATION = "encode_duration"
+    UPLOAD_DURATION = "upload_duration"
+    BYTES_WRITTEN = "bytes_written"
+    FILES_WRITTEN = "files_written"
+    ROWS_PER_FILE = "rows_per_file"
+    QUEUE_DEPTH = "queue_depth"
+
+
+class MetricType(str, enum.Enum):
+    """Kinds of measurement, with their StatsD type."""
+
+    TIMER = "timer"  # Durations in seconds
+    COUNTER = "counter"
+    GAUGE = "gauge"
+    HISTOGRAM = "histogram"
+
+    @property
+    def statsd_type(self) -> str:
+        """Type of the measurement in the StatsD protocol."""
+        return {"timer": "ms", "counter": "c", "gauge": "g", "histogram": "h"}[
+            self.value
+        ]
+
+
+def _prometheus_labels(tags: t.Mapping[str, t.Any]) -> str:
+    if not tags:
+        return ""
+    labels = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in sorted(tags.items())
+    )
+    return f"{{{labels}}}"
+
+
+class MetricsRecorder:
+    """Emit the metrics of the sink pipeline.
+
+    Every measurement is logged as a Singer SDK metric line, and optionally sent
+    over UDP to a StatsD server (with DogStatsD tags) at `statsd_address`
+    ("host:port"). The measurements are also aggregated by name and tags, so
+    `flush` can write them to a Prometheus text file (e.g. for the textfile
+    collector of node_exporter) at `prometheus_file`.
+    Errors sending or writing the metrics are logged and never fail the sync.
+    """
+
+    def __init__(
+        self, prometheus_file: str | None = None, statsd_address: str | None = None
+    ) -> None:
+        self.prometheus_file = prometheus_file
+        self.metrics_logger = get_metrics_logger()
+        self._statsd_address = None
+        self._socket = None
+        if statsd_address:
+            host, port = statsd_address.rsplit(":", 1)
+            self._statsd_address = (host, int(port))
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._lock = threading.Lock()
+        # Serializes the flushes of the sinks, the last snapshot replaces the file last
+        self._flush_lock = threading.Lock()
+        # (type, metric, sorted tags) -> [sum, count] or last value of the gauges
+        self._values: dict[tuple, list[float]] = defaultdict(lambda: [0.0, 0])
+
+    def record(
+        self,
+        metric_type: MetricType,
+        metric: Metric,
+        value: float,
+        tags: t.Mapping[str, t.Any] | None = None,
+    ) -> None:
+        """Record a measurement."""
+        tags = dict(tags or {})
+        log(self.metrics_logger, Point(metric_type.value, metric, value, tags))
+        if self._socket is not None:
+            self._send_statsd(metric_type, metric, value, tags)
+        with self._lock:
+            aggregate = self._values[(metric_type, metric, tuple(sorted(tags.items())))]
+            if metric_type == MetricType.GAUGE:
+                aggregate[0] = value
+            else:
+                aggregate[0] += value
+            aggregate[1] += 1
+
+    @contextmanager
+    def timer(
+        self, metric: Metric, tags: t.Mapping[str, t.Any] | None = None
+    ) -> t.Iterator[None]:
+        """Record the duration of the block."""
+        start = time.perf_counter()
+        yield
+        self.record(MetricType.TIMER, metric, time.perf_counter() - start, tags)
+
+    def _send_statsd(
+        self,
+        metric_type: MetricType,
+        metric: Metric,
+        value: float,
+        tags: t.Mapping[str, t.Any],
+    ) -> None:
+        if metric_type == MetricType.TIMER:
+            value = value * 1000
+        line = f"{METRIC_PREFIX}.{metric.value}:{value:g}|{metric_type.statsd_type}"
+        if tags:
+            line += "|#" + ",".join(f"{key}:{value}" for key, value in tags.items())
+        try:
+            self._socket.sendto(line.encode(), self._statsd_address)
+        except OSError:
+            logger.warning("Unable to send the metrics to StatsD.", exc_info=True)
+
+    def totals(self, metric_type: MetricType) -> dict[Metric, float]:
+        """Return the sum of the measurements of each metric of a type, over all tags."""
+        totals: dict[Metric, float] = defaultdict(float)
+        with self._lock:
+            for (value_type, metric, _), (total, _) in self._values.items():
+                if value_type == metric_type:
+                    totals[metric] += total
+        return dict(totals)
+
+    def prometheus_text(self) -> str:
+        """Return the aggregated metrics in the Prometheus text format."""
+        with self._lock:
+            values = dict(self._values)
+        samples: dict[str, tuple[str, list[str]]] = {}
+        for (metric_type, metric, tags), (total, count) in sorted(values.items()):
+            name = f"{METRIC_PREFIX}_{metric.value}"
+            labels = _prometheus_labels(dict(tags))
+            if metric_type == MetricType.GAUGE:
+                samples.setdefault(name, ("gauge", []))[1].append(
+                    f"{name}{labels} {total:g}"
+                )
+            elif metric_type == MetricType.COUNTER:
+                name = f"{name}_total"
+                samples.setdefault(name, ("counter", []))[1].append(
+                    f"{name}{labels} {total:g}"
+                )
+            else:
+                name = f"{name}_seconds" if metric_type == MetricType.TIMER else name
+                samples.setdefault(name, ("summary", []))[1].extend(
+                    [f"{name}_sum{labels} {total:g}", f"{name}_count{labels} {count:g}"]
+                )
+        lines = []
+        for name, (prometheus_type, metric_samples) in samples.items():
+            lines.append(f"# TYPE {name} {prometheus_type}")
+            lines.extend(metric_samples)
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> None:
+        """Write the Prometheus text file, replacing the previous one atomically."""
+        if not self.prometheus_file:
+            return
+        temp_file = f"{self.prometheus_file}.{os.getpid()}.tmp"
+        with self._flush_lock:
+            try:
+                Path(temp_file).write_text(self.prometheus_text())
+                Path(temp_file).replace(self.prometheus_file)
+            except OSError:
+                logger.warning(
+                    "Unable to write the Prometheus metrics file.", exc_info=True
+                )
+
+    def close(self) -> None:
+        """Write the last metrics and close the StatsD socket."""
+        self.flush()
+        if self._socket is not None:
+            self._socket.close()
@@ -1,17 +1,30 @@
 from __future__ import annotations
 
 import logging
+import os
+import tempfile
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+from contextlib import suppress
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from functools import cache
+from itertools import groupby
+from pathlib import Path
+from urllib.parse import quote
 
 import pyarrow as pa
-import pyarrow.parquet as pq
-
 import pyarrow.fs
-import pyarrowfs_adlgen2
-
-import azure.identity
-
+import pyarrow.parquet as pq
 
-from target_parquet.utils import bytes_to_mb
+from target_parquet.utils.filesystem import get_filesystem
+from target_parquet.utils.flattening import (
+    ColumnExtractor,
+    FlattenedColumn,
+    serialize_value,
+)
 
 FIELD_TYPE_TO_PYARROW = {
     "BOOLEAN": pa.bool_(),
@@ -23,6 +36,9 @@ FIELD_TYPE_TO_PYARROW = {
 }
 
 
+# Called with the path, number of rows and encoded bytes of every written file
+FileCallback = t.Callable[[str, int, int], None]
+
 EXTENSION_MAPPING = {
     "snappy": ".snappy",
     "gzip": ".gz",
@@ -31,12 +47,13 @@ EXTENSION_MAPPING = {
     "lz4": ".lz4",
 }
 
+AUTO_COMPRESSION_CODECS = ("snappy", "zstd", "lz4", "gzip")
+
 logger = logging.getLogger(__name__)
 
 
-def _field_type_to_pyarrow_field(
-    field_name: str, input_types: dict, required_fields: list[str]
-) -> pa.Field:
+def _field_types(input_types: dict) -> list[str]:
+    """Return the uppercase JSON types of a field schema."""
     types = input_types.get("type", [])
     # If type is not defined, check if anyOf is defined
     if not types:
@@ -47,16 +64,80 @@ def _field_type_to_pyarrow_field(
                 else:
                     types.append(t)
     types = [types] if isinstance(types, str) else types
-    types_uppercase = [item.upper() for item in types]
-    nullable = "NULL" in types_uppercase or field_name not in required_fields
-    if "NULL" in types_uppercase:
-        types_uppercase.remove("NULL")
-    input_type = next(iter(types_uppercase)) if types_uppercase else ""
-    pyarrow_type = FIELD_TYPE_TO_PYARROW.get(input_type, pa.string())
-    return pa.field(field_name, pyarrow_type, nullable)
+    return [item.upper() for item in types]
+
+
+def _decimal_type(input_types: dict) -> pa.Decimal128Type:
+    """Return the decimal type of a number with `multipleOf`, e.g. 0.01 gives scale 2.
+
+    The precision is derived from `minimum`/`maximum` when they are set.
+    """
+    scale = max(
+        0, -Decimal(str(input_types["multipleOf"])).normalize().as_tuple().exponent
+    )
+    # The exclusive bounds are booleans in draft 4 schemas
+    bounds = [
+        abs(Decimal(str(input_types[key])))
+        for key in ("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum")
+        if isinstance(input_types.get(key), (int, float, Decimal))
+        and not isinstance(input_types[key], bool)
+    ]
+    precision = 38
+    if bounds:
+        precision = len(str(int(max(bounds)))) + scale
+    return pa.decimal128(min(max(precision, scale, 1), 38), min(scale, 38))
+
+
+def _native_pyarrow_type(input_types: dict) -> pa.DataType | None:
+    """Return the native pyarrow type of a field schema.
+
+    None is returned for the fields stored with the default mapping.
+    """
+    input_type = next(
+        (item for item in _field_types(input_types) if item != "NULL"), ""
+    )
+    if input_type == "STRING" and input_types.get("format") == "date-time":
+        return pa.timestamp("us", tz="UTC")
+    if input_type == "STRING" and input_types.get("format") == "date":
+        return pa.date32()
+    if input_type == "NUMBER" and input_types.get("multipleOf"):
+        return _decimal_type(input_types)
+    if input_type == "ARRAY" and isinstance(input_types.get("items"), dict):
+        return pa.list_(_pyarrow_type(input_types["items"], native_types=True))
+    if input_type == "OBJECT" and input_types.get("properties"):
+        return pa.struct(
+            [
+                pa.field(name, _pyarrow_type(field_types, native_types=True))
+                for name, field_types in input_types["properties"].items()
+            ]
+        )
+    return None
+
+
+def _pyarrow_type(input_types: dict, *, native_types: bool = False) -> pa.DataType:
+    input_type = next(
+        (item for item in _field_types(input_types) if item != "NULL"), ""
+    )
+    native_type = _native_pyarrow_type(input_types) if native_types else None
+    return native_type or FIELD_TYPE_TO_PYARROW.get(input_type, pa.string())
+
+
+def _field_type_to_pyarrow_field(
+    field_name: str,
+    input_types: dict,
+    required_fields: list[str],
+    *,
+    native_types: bool = False,
+) -> pa.Field:
+    nullable = "NULL" in _field_types(input_types) or field_name not in required_fields
+    return pa.field(
+        field_name, _pyarrow_type(input_types, native_types=native_types), nullable
+    )
 
 
-def flatten_schema_to_pyarrow_schema(flatten_schema_dictionary: dict) -> pa.Schema:
+def flatten_schema_to_pyarrow_schema(
+    flatten_schema_dictionary: dict, *, native_types: bool = False
+) -> pa.Schema:
     """Function that converts a flatten schema to a pyarrow schema in a defined order.
 
     E.g:
@@ -76,36 +157,528 @@ def flatten_schema_to_pyarrow_schema(flatten_schema_dictionary: dict) -> pa.Sche
              pa.field('key_2__key_4__key_5', pa.int64()),
              pa.field('key_2__key_4__key_6', pa.string())
         ])
+    With `native_types`, date-time and date strings are mapped to timestamp[us, UTC]
+    and date32, numbers with `multipleOf` to decimal128, and arrays or objects with
+    a schema of their items or properties to list and struct types.
     """
     flatten_schema = flatten_schema_dictionary.get("properties", {})
     required_fields = flatten_schema_dictionary.get("required", [])
     return pa.schema(
         [
             _field_type_to_pyarrow_field(
-                field_name, field_input_types, required_fields=required_fields
+                field_name,
+                field_input_types,
+                required_fields=required_fields,
+                native_types=native_types,
             )
             for field_name, field_input_types in flatten_schema.items()
         ]
     )
 
 
-def create_pyarrow_table(list_dict: list[dict], schema: pa.Schema) -> pa.Table:
-    """Create a pyarrow Table from a python list of dict."""
-    data = {f: [row.get(f) for row in list_dict] for f in schema.names}
-    return pa.table(data).cast(schema)
+def _parse_datetime(value: str) -> datetime:
+    """Parse an ISO 8601 date-time, naive when it has no offset.
+
+    pyarrow parses the "Z" suffix and fractions of any length up to microseconds,
+    which `datetime.fromisoformat` only does from Python 3.11.
+    """
+    scalar = pa.scalar(value, pa.string())
+    for data_type in (pa.timestamp("us", tz="UTC"), pa.timestamp("us")):
+        with suppress(pa.ArrowInvalid):
+            return scalar.cast(data_type).as_py()
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _to_datetime(value: t.Any) -> datetime:  # noqa: ANN401
+    if not isinstance(value, datetime):
+        value = (
+            datetime.combine(value, datetime.min.time())
+            if isinstance(value, date)
+            else _parse_datetime(str(value))
+        )
+    # Timestamps without a timezone are in UTC
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _to_date(value: t.Any) -> date:  # noqa: ANN401
+    if isinstance(value, datetime):
+        return value.date()
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+@cache
+def _python_converter(data_type: pa.DataType) -> t.Callable[[t.Any], t.Any]:
+    """Return a function converting a JSON value to a python value of a pyarrow type."""
+    if pa.types.is_timestamp(data_type):
+        convert = _to_datetime
+    elif pa.types.is_date(data_type):
+        convert = _to_date
+    elif pa.types.is_decimal(data_type):
+        convert = lambda value: Decimal(str(value))  # noqa: E731
+    elif pa.types.is_floating(data_type):
+        convert = float
+    elif pa.types.is_integer(data_type):
+        convert = int
+    elif pa.types.is_boolean(data_type):
+        convert = bool
+    elif pa.types.is_list(data_type):
+        convert_item = _python_converter(data_type.value_type)
+        convert = lambda value: [convert_item(item) for item in value]  # noqa: E731
+    elif pa.types.is_struct(data_type):
+        fields = [(field.name, _python_converter(field.type)) for field in data_type]
+        convert = lambda value: {  # noqa: E731
+            name: convert_field(value.get(name)) for name, convert_field in fields
+        }
+    else:
+        convert = lambda value: str(serialize_value(value))  # noqa: E731
+    return lambda value: None if value is None else convert(value)
+
+
+def _to_pyarrow_array(values: list, field: pa.Field) -> pa.Array:
+    """Convert a column of python values to a pyarrow array of the field type.
+
+    Values that can't be converted directly (e.g. `Decimal` for a float column or
+    `datetime` for a string column) are inferred first and then cast. The values of
+    native temporal, decimal and nested types are converted one by one instead.
+    """
+    try:
+        return pa.array(values, type=field.type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        if pa.types.is_timestamp(field.type):
+            # Date-time strings with an offset are all parsed at once
+            with suppress(pa.ArrowInvalid, pa.ArrowTypeError):
+                return pa.array(values, pa.string()).cast(field.type)
+        if (
+            pa.types.is_temporal(field.type)
+            or pa.types.is_decimal(field.type)
+            or pa.types.is_nested(field.type)
+        ):
+            convert = _python_converter(field.type)
+            return pa.array([convert(value) for value in values], type=field.type)
+        return pa.array(values).cast(field.type)
+
+
+class ConstantColumn:
+    """A column repeating one value in every row, e.g. an extra field.
+
+    The array is built once and sliced for each batch, so the batches share the
+    same buffers instead of holding a copy of the value per row.
+    """
+
+    def __init__(self, value: t.Any, field: pa.Field) -> None:  # noqa: ANN401
+        self.field = field
+        self.scalar = _to_pyarrow_array([value], field)[0]
+        self._array = pa.array([], type=field.type)
+
+    def array(self, length: int) -> pa.Array:
+        """Return the value repeated `length` times."""
+        if len(self._array) < length:
+            self._array = pa.repeat(self.scalar, max(length, 2 * len(self._array)))
+        return self._array.slice(0, length)
+
+    def __getstate__(self) -> dict:
+        """Return the state to pickle, without the repeated array."""
+        # The array is rebuilt on demand rather than sent to the encoding processes
+        return self.__dict__ | {"_array": pa.array([], type=self.field.type)}
+
+
+class RecordBatchBuilder:
+    """Accumulate records and convert them to a RecordBatch of a pyarrow schema.
+
+    The values of each record are appended column by column as it arrives,
+    following the key paths of `columns` (by default the column names of flattened
+    records), and converted to arrays in `finish`. `constants` are the columns with
+    the same value in every row.
+    """
+
+    def __init__(
+        self,
+        schema: pa.Schema,
+        columns: t.Mapping[str, FlattenedColumn] | None = None,
+        constants: t.Mapping[str, ConstantColumn] | None = None,
+    ) -> None:
+        self.schema = schema
+        self.constants = dict(constants or {})
+        self._names = [name for name in schema.names if name not in self.constants]
+        self._extractor = ColumnExtractor(
+            (columns or {}).get(name, FlattenedColumn((name,))) for name in self._names
+        )
+        self._num_rows = 0
+        self._flatten_seconds = 0.0
+        # Seconds spent flattening and converting the records by the last `finish`
+        self.durations: dict[str, float] = {}
+
+    @property
+    def num_rows(self) -> int:
+        """Number of records appended since the last `finish`."""
+        return self._num_rows
+
+    def append(self, record: dict) -> None:
+        """Append a record, keys outside the schema are ignored."""
+        start = time.perf_counter()
+        self._extractor.append(record)
+        self._num_rows += 1
+        self._flatten_seconds += time.perf_counter() - start
+
+    def finish(self) -> pa.RecordBatch:
+        """Return the accumulated rows as a RecordBatch and reset the builder."""
+        num_rows, self._num_rows = self._num_rows, 0
+        start = time.perf_counter()
+        values = dict(zip(self._names, self._extractor.pop_columns()))
+        flattened = time.perf_counter()
+        # Each column of values is released once converted
+        arrays = [
+            _to_pyarrow_array(values.pop(field.name), field)
+            if field.name in values
+            else self.constants[field.name].array(num_rows)
+            for field in self.schema
+        ]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        self.durations = {
+            "flatten": self._flatten_seconds + flattened - start,
+            "cast": time.perf_counter() - flattened,
+        }
+        self._flatten_seconds = 0.0
+        return batch
+
+
+def _is_byte_array(type_: pa.DataType) -> bool:
+    return (
+        pa.types.is_string(type_)
+        or pa.types.is_large_string(type_)
+        or pa.types.is_binary(type_)
+        or pa.types.is_large_binary(type_)
+    )
+
+
+# The Arrow types of the columns each encoding can be written for with pyarrow,
+# the dictionary encoding being set with use_dictionary
+ENCODING_TYPES: dict[str, t.Callable[[pa.DataType], bool]] = {
+    "PLAIN": lambda _: True,
+    "BYTE_STREAM_SPLIT": lambda type_: pa.types.is_float32(type_)
+    or pa.types.is_float64(type_),
+    "DELTA_BINARY_PACKED": lambda type_: pa.types.is_integer(type_)
+    or pa.types.is_timestamp(type_)
+    or pa.types.is_date(type_)
+    or pa.types.is_time(type_),
+    "DELTA_LENGTH_BYTE_ARRAY": _is_byte_array,
+    "DELTA_BYTE_ARRAY": lambda type_: _is_byte_array(type_)
+    or pa.types.is_decimal(type_)
+    or pa.types.is_fixed_size_binary(type_),
+    "RLE": pa.types.is_boolean,
+}
+
+
+def default_column_encoding(field: pa.Field) -> str | None:
+    """Return the encoding of a column from its type, None to dictionary encode it.
+
+    Floats are byte stream split and integers and timestamps delta encoded, which
+    compress better than plain values. The other columns are dictionary encoded,
+    pyarrow falling back to plain values when the dictionary grows too large.
+    """
+    if pa.types.is_float32(field.type) or pa.types.is_float64(field.type):
+        return "BYTE_STREAM_SPLIT"
+    if pa.types.is_integer(field.type) or pa.types.is_timestamp(field.type):
+        return "DELTA_BINARY_PACKED"
+    return None
+
+
+def _parquet_columns(field: pa.Field, path: str) -> t.Iterator[tuple[str, pa.Field]]:
+    """Yield the path of the parquet leaf columns of a field, with their field."""
+    if pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+        yield from _parquet_columns(field.type.value_field, f"{path}.list.element")
+    elif pa.types.is_struct(field.type):
+        for child in field.type:
+            yield from _parquet_columns(child, f"{path}.{child.name}")
+    else:
+        yield path, field
+
+
+def _supported_encodings(
+    columns: t.Mapping[str, pa.Field], column_encoding: t.Mapping[str, str]
+) -> dict[str, str]:
+    """Return the encodings of the columns of a schema supporting their type."""
+    encodings = {}
+    for path, encoding in column_encoding.items():
+        assert (
+            encoding in ENCODING_TYPES
+        ), f"column_encoding of {path} must be one of {', '.join(ENCODING_TYPES)}"
+        if path not in columns:
+            continue  # A column of other streams
+        if ENCODING_TYPES[encoding](columns[path].type):
+            encodings[path] = encoding
+        else:
+            logger.warning(
+                f"Ignoring the {encoding} encoding of {path}, "
+                f"not supported for {columns[path].type} values."
+            )
+    return encodings
+
+
+def parquet_writer_options(  # noqa: PLR0913
+    schema: pa.Schema,
+    *,
+    compression_level: int | None = None,
+    use_dictionary: t.Iterable[str] | None = None,
+    column_encoding: t.Mapping[str, str] | str | None = None,
+    write_statistics: t.Iterable[str] | None = None,
+    write_page_index: bool = False,
+    data_page_size: int | None = None,
+) -> dict[str, t.Any]:
+    """Return the encoding options of the parquet writers for the columns of a schema.
+
+    The columns are dictionary encoded, except the ones with a `column_encoding`,
+    or only the ones of `use_dictionary` when it is set. With `column_encoding`
+    "auto", the columns not in `use_dictionary` get the encoding of their type
+    from `default_column_encoding`. The encodings of columns missing from the
+    schema are ignored, as are the ones not supporting the type of their column,
+    with a warning. Statistics are written for `write_statistics` or for every
+    column. With `write_page_index`, the min/max of each page of these columns are
+    written to the page index, so readers can skip pages and not only row
+    groups, and `data_page_size` sets the size in bytes of the pages.
+    Columns nested in lists and structs are named by their parquet path
+    (e.g. `tags.list.element` or `address.city`).
+    """
+    columns = dict(
+        column for field in schema for column in _parquet_columns(field, field.name)
+    )
+    if column_encoding == "auto":
+        column_encoding = {
+            path: encoding
+            for path, field in columns.items()
+            if path not in (use_dictionary or [])
+            and (encoding := default_column_encoding(field))
+        }
+    encodings = _supported_encodings(columns, column_encoding or {})
+    if use_dictionary is not None:
+        use_dictionary = list(use_dictionary)
+    elif encodings:
+        use_dictionary = [path for path in columns if path not in encodings]
+    options: dict[str, t.Any] = {
+        "use_dictionary": True if use_dictionary is None else use_dictionary,
+        "write_statistics": True
+        if write_statistics is None
+        else list(write_statistics),
+    }
+    if encodings:
+        options["column_encoding"] = encodings
+    if compression_level is not None:
+        options["compression_level"] = compression_level
+    if write_page_index:
+        options["write_page_index"] = True
+    if data_page_size:
+        options["data_page_size"] = data_page_size
+    return options
+
+
+def _can_cast(source: pa.DataType, target: pa.DataType) -> bool:
+    # A null value goes through the cast kernels, which an empty array skips
+    try:
+        pa.nulls(1, source).cast(target)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        return False
+    return True
+
+
+def merge_schemas(schema: pa.Schema, new_schema: pa.Schema) -> pa.Schema | None:
+    """Return a schema with the columns of both schemas, None if they are incompatible.
+
+    The columns of `schema` come first, followed by the new columns. The types of
+    the columns in both schemas are promoted to a common type (e.g. int64 and
+    double to double), to which the data of both schemas must be castable.
+    The columns missing from one of the schemas are filled with nulls for its
+    data, so they are nullable like the ones nullable in either schema.
+    """
+    try:
+        merged = pa.unify_schemas([schema, new_schema], promote_options="permissive")
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None
+    if not all(
+        _can_cast(field.type, merged.field(field.name).type)
+        for field in [*schema, *new_schema]
+    ):
+        return None
+    return pa.schema(
+        [
+            field.with_nullable(
+                field.nullable
+                or field.name not in schema.names
+                or field.name not in new_schema.names
+            )
+            for field in merged
+        ],
+        metadata=merged.metadata,
+    )
+
+
+def promote_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Return the table with the columns of the schema.
+
+    The columns are cast to the types of the schema, and the ones missing from
+    the table are filled with nulls.
+    """
+    if table.schema == schema:
+        return table
+    return pa.Table.from_arrays(
+        [
+            table.column(field.name).cast(field.type)
+            if field.name in table.column_names
+            else pa.nulls(table.num_rows, field.type)
+            for field in schema
+        ],
+        schema=schema,
+    )
 
 
-def concat_tables(
-    records: list[dict], pyarrow_table: pa.Table, pyarrow_schema: pa.Schema
+def zorder_values(table: pa.Table, columns: list[str]) -> pa.Array:
+    """Return the position of the rows on a Z-order curve over the columns.
+
+    The dense ranks of the values of each column (nulls last) are scaled to the
+    same number of bits, and the bits of the columns are interleaved, so rows
+    close in every column get close values.
+    """
+    import pyarrow.compute as pc  # Slow to import, only needed with sort_by
+
+    bits = 64 // len(columns)
+    ranks = []
+    for column in columns:
+        # Dense ranks start at 1
+        rank = pc.subtract(
+            pc.rank(
+                table.column(column),
+                sort_keys="ascending",
+                null_placement="at_end",
+                tiebreaker="dense",
+            ),
+            1,
+        )
+        max_rank = pc.max(rank).as_py()
+        if max_rank >= 2**bits:
+            rank = pc.cast(
+                pc.floor(pc.multiply(rank, (2**bits - 1) / max_rank)), pa.uint64()
+            )
+        ranks.append(rank)
+    used_bits = max(pc.max(rank).as_py().bit_length() for rank in ranks)
+    values = pa.repeat(pa.scalar(0, pa.uint64()), table.num_rows)
+    for bit in range(used_bits):
+        for position, rank in enumerate(ranks):
+            values = pc.bit_wise_or(
+                values,
+                pc.shift_left(
+                    pc.bit_wise_and(pc.shift_right(rank, bit), 1),
+                    bit * len(columns) + position,
+                ),
+            )
+    return values
+
+
+def sort_table(
+    table: pa.Table, sort_keys: list[tuple[str, str]], *, zorder: bool = False
 ) -> pa.Table:
-    """Create a dataframe from records and concatenate with the existing one."""
-    if not records:
-        return pyarrow_table
-    new_table = create_pyarrow_table(records, pyarrow_schema)
-    return pa.concat_tables([pyarrow_table, new_table]) if pyarrow_table else new_table
+    """Return the rows of the table sorted by the (column, order) keys.
+
+    With `zorder`, the rows are sorted along a Z-order curve over the columns of
+    the keys instead, which clusters them by every column rather than mostly by
+    the first one. The orders of the keys are then ignored.
+    """
+    if not sort_keys or table.num_rows <= 1:
+        return table
+    import pyarrow.compute as pc
+
+    if zorder and len(sort_keys) > 1:
+        indices = pc.sort_indices(zorder_values(table, [name for name, _ in sort_keys]))
+    else:
+        indices = pc.sort_indices(table, sort_keys=sort_keys)
+    return table.take(indices)
 
 
-def write_parquet_file(
+class RecordBatchAccumulator:
+    """Accumulate RecordBatches until they are written, counting their bytes.
+
+    The batches are only assembled into a Table (without copying them) when it is
+    taken for a write, so the cost of adding a batch doesn't grow with the number
+    of batches already accumulated.
+    With `spill_dir`, the batches are appended to an Arrow IPC file in this
+    directory instead of being kept in memory. The file is memory-mapped when the
+    table is taken, so the table is read from the page cache without a copy, and
+    deleted (the mapping stays valid until the table is released).
+    The schema can change between batches with `set_schema`, the batches of the
+    previous schemas are then promoted to the last one when the table is taken.
+    """
+
+    def __init__(self, schema: pa.Schema, spill_dir: str | None = None) -> None:
+        self.schema = schema
+        self.spill_dir = spill_dir
+        self._batches: list[pa.RecordBatch] = []
+        self._spill_paths: list[str] = []
+        self._spill_path: str | None = None
+        self._spill_writer: pa.ipc.RecordBatchFileWriter | None = None
+        self.nbytes = 0
+        self.num_rows = 0
+
+    def __len__(self) -> int:
+        """Return the number of accumulated rows."""
+        return self.num_rows
+
+    @property
+    def buffered_bytes(self) -> int:
+        """In-memory bytes of the accumulated batches, none of them when spilling."""
+        return 0 if self.spill_dir else self.nbytes
+
+    def append(self, batch: pa.RecordBatch) -> None:
+        """Add a batch, empty ones are skipped."""
+        if batch.num_rows:
+            if self.spill_dir:
+                self._spill(batch)
+            else:
+                self._batches.append(batch)
+            self.nbytes += batch.nbytes
+            self.num_rows += batch.num_rows
+
+    def set_schema(self, schema: pa.Schema) -> None:
+        """Set the schema of the next batches and of the table taken."""
+        self._close_spill_file()
+        self.schema = schema
+
+    def _close_spill_file(self) -> None:
+        if self._spill_writer is not None:
+            self._spill_writer.close()
+            self._spill_paths.append(self._spill_path)
+            self._spill_writer = None
+            self._spill_path = None
+
+    def _spill(self, batch: pa.RecordBatch) -> None:
+        if self._spill_writer is None:
+            Path(self.spill_dir).mkdir(parents=True, exist_ok=True)
+            fd, self._spill_path = tempfile.mkstemp(suffix=".arrow", dir=self.spill_dir)
+            os.close(fd)
+            self._spill_writer = pa.ipc.new_file(self._spill_path, self.schema)
+        self._spill_writer.write_batch(batch)
+
+    def pop_table(self) -> pa.Table:
+        """Return the accumulated batches as a Table and reset the accumulator."""
+        self._close_spill_file()
+        tables = []
+        for spill_path in self._spill_paths:
+            tables.append(pa.ipc.open_file(pa.memory_map(spill_path)).read_all())
+            Path(spill_path).unlink()
+        tables.extend(
+            pa.Table.from_batches(list(batches))
+            for _, batches in groupby(self._batches, key=lambda batch: batch.schema)
+        )
+        table = (
+            pa.concat_tables([promote_table(table, self.schema) for table in tables])
+            if tables
+            else self.schema.empty_table()
+        )
+        self._spill_paths = []
+        self._batches = []
+        self.nbytes = 0
+        self.num_rows = 0
+        return table
+
+
+def write_parquet_file(  # noqa: PLR0913
     table: pa.Table,
     path: str,
     destination_type: str = "local",
@@ -113,12 +686,30 @@ def write_parquet_file(
     compression_method: str = "gzip",
     basename_template: str | None = None,
     partition_cols: list[str] | None = None,
-) -> None:
-    """Write a pyarrow table to a parquet file."""
-    fs = None
-    if destination_type == 'azure':
-         handler = pyarrowfs_adlgen2.AccountHandler.from_account_name(azure_account, azure.identity.DefaultAzureCredential())
-         fs = pyarrow.fs.PyFileSystem(handler)
+    *,
+    row_group_size: int | None = None,
+    filesystem: pyarrow.fs.FileSystem | None = None,
+    file_callback: FileCallback | None = None,
+    writer_options: t.Mapping[str, t.Any] | None = None,
+) -> int:
+    """Write a pyarrow table to a parquet file.
+
+    `writer_options` are extra options of the parquet writer, such as the ones
+    returned by `parquet_writer_options`.
+    Returns the encoded size in bytes of the written files.
+    """
+    fs = filesystem or get_filesystem(
+        destination_type or "local", {"azure_account": azure_account}
+    )
+    written_files = []
+
+    def file_visitor(written_file: pyarrow.dataset.WrittenFile) -> None:
+        written_files.append(written_file)
+        if file_callback:
+            file_callback(
+                written_file.path, written_file.metadata.num_rows, written_file.size
+            )
+
     pq.write_to_dataset(
         table,
         root_path=path,
@@ -130,9 +721,345 @@ def write_parquet_file(
         basename_template=f"{basename_template}{EXTENSION_MAPPING[compression_method.lower()]}.parquet"
         if basename_template
         else None,
+        row_group_size=row_group_size,
+        min_rows_per_group=row_group_size or 0,
+        file_visitor=file_visitor,
+        **(writer_options or {}),
     )
+    return sum(written_file.size for written_file in written_files)
+
+
+class CompressionRatioEstimator:
+    """Estimate the encoded size of a stream's data from its in-memory size.
+
+    The ratio starts at 1 (no compression) and then follows an exponential moving
+    average of the ratios observed on the previous writes of the stream.
+    """
+
+    def __init__(self, initial_ratio: float = 1.0, smoothing: float = 0.5) -> None:
+        self.ratio = initial_ratio
+        self.smoothing = smoothing
+        self._observed = False
+
+    def update(self, in_memory_bytes: int, encoded_bytes: int) -> None:
+        """Learn from the encoded size of a write."""
+        if in_memory_bytes <= 0 or encoded_bytes <= 0:
+            return
+        observed_ratio = encoded_bytes / in_memory_bytes
+        if self._observed:
+            observed_ratio = (
+                self.smoothing * observed_ratio + (1 - self.smoothing) * self.ratio
+            )
+        self.ratio = observed_ratio
+        self._observed = True
+
+    def estimate(self, in_memory_bytes: int) -> int:
+        """Return the estimated encoded size of in-memory data."""
+        return int(in_memory_bytes * self.ratio)
+
+    def rows_per_row_group(self, table: pa.Table, row_group_size: int) -> int:
+        """Return the number of rows of `table` filling `row_group_size` encoded bytes."""
+        encoded_row_size = self.estimate(table.nbytes) / max(table.num_rows, 1)
+        if not encoded_row_size:
+            return max(table.num_rows, 1)
+        return max(1, int(row_group_size / encoded_row_size))
+
+
+def codec_writer_options(
+    compression_method: str, writer_options: t.Mapping[str, t.Any] | None = None
+) -> dict[str, t.Any]:
+    """Return the writer options without a compression level the codec doesn't support."""
+    options = dict(writer_options or {})
+    level = options.get("compression_level")
+    if level is not None and not (
+        pa.Codec.supports_compression_level(compression_method)
+        and pa.Codec.minimum_compression_level(compression_method)
+        <= level
+        <= pa.Codec.maximum_compression_level(compression_method)
+    ):
+        del options["compression_level"]
+    return options
+
+
+def select_compression(
+    table: pa.Table | pa.RecordBatch,
+    bandwidth: float,
+    codecs: t.Iterable[str] = AUTO_COMPRESSION_CODECS,
+    writer_options: t.Mapping[str, t.Any] | None = None,
+) -> str:
+    """Return the codec writing a sample of the data the fastest to its destination.
+
+    The sample is encoded in memory with every codec, and the chosen codec has the
+    lowest encoding time plus transfer time of the encoded bytes at `bandwidth`
+    bytes per second. A low bandwidth favors the smaller files, a high one the
+    faster codecs.
+    """
+    if isinstance(table, pa.RecordBatch):
+        table = pa.Table.from_batches([table])
+    costs = {}
+    for codec in codecs:
+        options = codec_writer_options(codec, writer_options)
+        # Best of two runs, the first one may pay the initialization of the codec
+        durations = []
+        for _ in range(2):
+            sink = pa.BufferOutputStream()
+            start = time.perf_counter()
+            pq.write_table(table, sink, compression=codec, **options)
+            durations.append(time.perf_counter() - start)
+        encoded_bytes = sink.tell()
+        costs[codec] = min(durations) + encoded_bytes / bandwidth
+        logger.debug(
+            f"Compression {codec}: {encoded_bytes} bytes in {min(durations):.4f}s"
+        )
+    return min(costs, key=costs.get)
+
+
+class RollingParquetWriter:
+    """Stream record batches to parquet files as row groups.
+
+    A parquet file stays open between writes and a new one is started once the
+    encoded bytes of the current file reach `max_file_size`.
+    Without `row_group_size` every write is a row group, otherwise writes are
+    buffered until their estimated encoded size reaches `row_group_size` bytes.
+    `basename_template` is called for the name of every new file,
+    `buffer_size` sets the size of the chunks handed to the filesystem,
+    `file_callback` is called for every file once it is closed, and
+    `writer_options` are extra options of the parquet writer.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        path: str,
+        schema: pa.Schema,
+        basename_template: t.Callable[[], str],
+        filesystem: pyarrow.fs.FileSystem | None = None,
+        compression_method: str = "gzip",
+        max_file_size: int | None = None,
+        row_group_size: int | None = None,
+        compression_ratio: CompressionRatioEstimator | None = None,
+        buffer_size: int | None = None,
+        file_callback: FileCallback | None = None,
+        writer_options: t.Mapping[str, t.Any] | None = None,
+    ) -> None:
+        self.path = path
+        self.schema = schema
+        self.basename_template = basename_template
+        self.filesystem = filesystem or pyarrow.fs.LocalFileSystem()
+        self.compression_method = compression_method
+        self.max_file_size = max_file_size
+        self.row_group_size = row_group_size
+        self.compression_ratio = compression_ratio or CompressionRatioEstimator()
+        self.buffer_size = buffer_size
+        self.file_callback = file_callback
+        self.writer_options = dict(writer_options or {})
+        self.files_written: list[str] = []
+        self._file_rows = 0
+        self._output_stream = None
+        self._writer: pq.ParquetWriter | None = None
+        self._pending: list[pa.Table] = []
+        self._pending_bytes = 0
+
+    @property
+    def bytes_written(self) -> int:
+        """Encoded bytes written to the current file."""
+        return self._output_stream.tell() if self._output_stream else 0
+
+    @property
+    def buffered_bytes(self) -> int:
+        """In-memory bytes of the data waiting for a full row group."""
+        return self._pending_bytes
+
+    def _open(self) -> None:
+        self.filesystem.create_dir(self.path, recursive=True)
+        extension = EXTENSION_MAPPING[self.compression_method.lower()]
+        file_name = f"{self.basename_template().format(i=0)}{extension}.parquet"
+        file_path = f"{self.path}/{file_name}"
+        self._output_stream = self.filesystem.open_output_stream(
+            file_path, buffer_size=self.buffer_size
+        )
+        self._writer = pq.ParquetWriter(
+            self._output_stream,
+            self.schema,
+            compression=self.compression_method,
+            **self.writer_options,
+        )
+        self.files_written.append(file_path)
+
+    def write(self, data: pa.RecordBatch | pa.Table) -> None:
+        """Write the data to the current file, buffering it up to a full row group."""
+        if not data.num_rows:
+            return
+        if isinstance(data, pa.RecordBatch):
+            data = pa.Table.from_batches([data])
+        self._pending.append(data)
+        self._pending_bytes += data.nbytes
+        if (
+            not self.row_group_size
+            or self.compression_ratio.estimate(self._pending_bytes)
+            >= self.row_group_size
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered data as one row group."""
+        if not self._pending:
+            return
+        if self._writer is None:
+            self._open()
+        table = pa.concat_tables(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        position = self.bytes_written
+        self._writer.write_table(table, row_group_size=table.num_rows)
+        self._file_rows += table.num_rows
+        self.compression_ratio.update(table.nbytes, self.bytes_written - position)
+        if self.max_file_size and self.bytes_written >= self.max_file_size:
+            self.close()
+
+    def close(self) -> None:
+        """Close the current file, the next write starts a new one."""
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            file_bytes = self.bytes_written
+            self._output_stream.close()
+            if self.file_callback:
+                self.file_callback(self.files_written[-1], self._file_rows, file_bytes)
+            self._writer = None
+            self._output_stream = None
+            self._file_rows = 0
+
+
+HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+class PartitionedParquetWriter:
+    """Append tables to hive partitions through parquet files kept open between writes.
+
+    Each partition gets its own `RollingParquetWriter`. Open writers are kept in
+    LRU order and closed when a new partition would make more than
+    `max_open_partitions` open, even within a single write, when they haven't been
+    written for `idle_timeout` seconds, or (by the rolling writer itself) when
+    their file reaches `max_file_size`.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        path: str,
+        schema: pa.Schema,
+        partition_cols: list[str],
+        basename_template: t.Callable[[], str],
+        max_open_partitions: int = 100,
+        idle_timeout: float | None = None,
+        **writer_kwargs: t.Any,
+    ) -> None:
+        self.path = path
+        self.partition_cols = partition_cols
+        self.schema = pa.schema(
+            [field for field in schema if field.name not in partition_cols]
+        )
+        self.basename_template = basename_template
+        self.max_open_partitions = max_open_partitions
+        self.idle_timeout = idle_timeout
+        self.writer_kwargs = writer_kwargs
+        self.files_written: list[str] = []
+        self._writers: OrderedDict[
+            str, tuple[RollingParquetWriter, float]
+        ] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def bytes_written(self) -> int:
+        """Encoded bytes written to the open files."""
+        with self._lock:
+            return sum(writer.bytes_written for writer, _ in self._writers.values())
+
+    @property
+    def buffered_bytes(self) -> int:
+        """In-memory bytes of the data waiting for a full row group in the open files."""
+        # The writers are added and evicted by the background writes
+        with self._lock:
+            return sum(writer.buffered_bytes for writer, _ in self._writers.values())
+
+    @property
+    def open_partitions(self) -> list[str]:
+        """Paths of the partitions with an open writer, least recently used first."""
+        with self._lock:
+            return list(self._writers)
+
+    def _partitions(self, table: pa.Table) -> t.Iterator[tuple[str, pa.Table]]:
+        """Split the table in (partition path, partition rows) pairs."""
+        groups = (
+            table.select(self.partition_cols)
+            .append_column("__row_index", pa.array(range(table.num_rows)))
+            .group_by(self.partition_cols)
+            .aggregate([("__row_index", "list")])
+        )
+        values = [
+            groups.column(col).cast(pa.string()).to_pylist()
+            for col in self.partition_cols
+        ]
+        for partition_values, row_indices in zip(
+            zip(*values), groups.column("__row_index_list")
+        ):
+            partition_path = "/".join(
+                [self.path]
+                + [
+                    f"{col}={quote(value, safe='') if value is not None else HIVE_NULL_PARTITION}"
+                    for col, value in zip(self.partition_cols, partition_values)
+                ]
+            )
+            rows = table.take(row_indices.values).drop_columns(self.partition_cols)
+            yield partition_path, rows
+
+    def _get_writer(self, partition_path: str) -> RollingParquetWriter:
+        if partition_path in self._writers:
+            writer, _ = self._writers.pop(partition_path)
+        else:
+            # Close the least recently used writers before opening one more file
+            while self._writers and len(self._writers) >= self.max_open_partitions:
+                self._close_writer(next(iter(self._writers)))
+            writer = RollingParquetWriter(
+                partition_path,
+                self.schema,
+                basename_template=self.basename_template,
+                **self.writer_kwargs,
+            )
+        self._writers[partition_path] = (writer, time.monotonic())
+        return writer
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for partition_path, (_, last_write) in list(self._writers.items()):
+            if len(self._writers) > self.max_open_partitions or (
+                self.idle_timeout is not None and now - last_write > self.idle_timeout
+            ):
+                self._close_writer(partition_path)
+
+    def _close_writer(self, partition_path: str) -> None:
+        writer, _ = self._writers.pop(partition_path)
+        writer.close()
+        self.files_written.extend(writer.files_written)
+
+    def write(self, data: pa.RecordBatch | pa.Table) -> None:
+        """Append the rows of each partition to its open file."""
+        if not data.num_rows:
+            return
+        if isinstance(data, pa.RecordBatch):
+            data = pa.Table.from_batches([data])
+        with self._lock:
+            for partition_path, rows in self._partitions(data):
+                self._get_writer(partition_path).write(rows)
+            self._evict()
 
+    def flush(self) -> None:
+        """Write the buffered data of every partition as row groups."""
+        with self._lock:
+            for writer, _ in self._writers.values():
+                writer.flush()
 
-def get_pyarrow_table_size(table: pa.Table) -> float:
-    """Return the size of a pyarrow table in MB."""
-    return bytes_to_mb(table.nbytes)
+    def close(self) -> None:
+        """Close the files of every partition."""
+        with self._lock:
+            for partition_path in list(self._writers):
+                self._close_writer(partition_path)
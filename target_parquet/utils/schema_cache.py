@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+import typing as t
+from functools import cache
+from importlib import metadata
+from pathlib import Path
+
+import pyarrow as pa
+
+# simplejson is installed with singer-sdk, it keeps the Decimal values of the schemas
+import simplejson as json
+
+from target_parquet.utils.flattening import FlattenedColumn
+
+logger = logging.getLogger(__name__)
+
+V = t.TypeVar("V")
+
+# Bumped when the compiled artifacts change, to ignore the files of previous versions
+SCHEMA_CACHE_VERSION = 2
+FLATTEN_SCHEMA_METADATA = b"target_parquet.flatten_schema"
+FLATTENED_COLUMNS_METADATA = b"target_parquet.flattened_columns"
+
+
+class SchemaArtifacts(t.NamedTuple):
+    """Compiled schema of a stream, shared between sinks and never mutated."""
+
+    flatten_schema: dict
+    flattened_columns: dict[str, FlattenedColumn] | None
+    pyarrow_schema: pa.Schema
+
+
+def _package_version(package: str) -> str | None:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+@cache
+def compiler_versions() -> tuple[str | None, ...]:
+    """Return the versions of the packages compiling the artifacts.
+
+    singer_sdk flattens the schemas and target_parquet maps them to pyarrow types,
+    so upgrading either of them, or pyarrow, invalidates the cached artifacts.
+    """
+    return (
+        pa.__version__,
+        _package_version("singer-sdk"),
+        _package_version("target-parquet"),
+    )
+
+
+def schema_cache_key(schema: dict, **options: t.Any) -> str:
+    """Return the hash of a JSON schema and the options it is compiled with."""
+    payload = json.dumps(
+        [SCHEMA_CACHE_VERSION, compiler_versions(), schema, options],
+        sort_keys=True,
+        use_decimal=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def serialize_artifacts(artifacts: SchemaArtifacts) -> bytes:
+    """Serialize the artifacts as an Arrow IPC schema, the rest in its metadata."""
+    columns = (
+        None
+        if artifacts.flattened_columns is None
+        else {
+            name: [list(column.path), column.serialize, column.native]
+            for name, column in artifacts.flattened_columns.items()
+        }
+    )
+    schema = artifacts.pyarrow_schema.with_metadata(
+        {
+            **(artifacts.pyarrow_schema.metadata or {}),
+            FLATTEN_SCHEMA_METADATA: json.dumps(
+                artifacts.flatten_schema, use_decimal=True
+            ),
+            FLATTENED_COLUMNS_METADATA: json.dumps(columns),
+        }
+    )
+    return schema.serialize().to_pybytes()
+
+
+def deserialize_artifacts(data: bytes) -> SchemaArtifacts:
+    """Read the artifacts written by `serialize_artifacts`."""
+    schema = pa.ipc.read_schema(pa.py_buffer(data))
+    metadata = dict(schema.metadata)
+    flatten_schema = json.loads(metadata.pop(FLATTEN_SCHEMA_METADATA), use_decimal=True)
+    columns = json.loads(metadata.pop(FLATTENED_COLUMNS_METADATA))
+    return SchemaArtifacts(
+        flatten_schema,
+        None
+        if columns is None
+        else {
+            name: FlattenedColumn(tuple(path), serialize, native)
+            for name, (path, serialize, native) in columns.items()
+        },
+        schema.with_metadata(metadata) if metadata else schema.remove_metadata(),
+    )
+
+
+class SchemaCache:
+    """Cache the compiled schemas of the streams, by the hash of their JSON schema.
+
+    The artifacts are kept in memory for the sinks created again during a run
+    and, with `cache_dir`, in one file per schema to be reused by the next runs.
+    The record validators are only kept in memory.
+    """
+
+    def __init__(self, cache_dir: str | None = None) -> None:
+        self.cache_dir = cache_dir
+        self._artifacts: dict[str, SchemaArtifacts] = {}
+        self._validators: dict[str, t.Any] = {}
+        self._lock = threading.Lock()
+        if cache_dir:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.arrows")
+
+    def get(self, key: str) -> SchemaArtifacts | None:
+        """Return the cached artifacts of a key, or None."""
+        with self._lock:
+            artifacts = self._artifacts.get(key)
+        if artifacts is not None or not self.cache_dir:
+            return artifacts
+        try:
+            artifacts = deserialize_artifacts(Path(self._path(key)).read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            # ArrowInvalid is a ValueError, the file is compiled again
+            logger.warning(f"Ignoring the invalid schema cache file {self._path(key)}")
+            return None
+        with self._lock:
+            self._artifacts[key] = artifacts
+        return artifacts
+
+    def put(self, key: str, artifacts: SchemaArtifacts) -> None:
+        """Cache the artifacts of a key, also on disk with `cache_dir`."""
+        with self._lock:
+            self._artifacts[key] = artifacts
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            Path(temporary_path).write_bytes(serialize_artifacts(artifacts))
+            # Concurrent runs never read a partial file
+            Path(temporary_path).replace(path)
+        except OSError:
+            logger.warning(
+                f"Unable to write the schema cache file {path}", exc_info=True
+            )
+
+    def get_validator(self, key: str, create: t.Callable[[], V]) -> V:
+        """Return the validator of a key, created once."""
+        with self._lock:
+            if key in self._validators:
+                return self._validators[key]
+        validator = create()
+        with self._lock:
+            return self._validators.setdefault(key, validator)
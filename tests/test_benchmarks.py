@@ -0,0 +1,78 @@
+import json
+
+from benchmarks.run import compare_with_baseline, main, measure_import_time, run_scenario
+from benchmarks.streams import SCENARIOS, generate_messages
+
+
+def test_generate_messages():
+    messages = [
+        json.loads(line)
+        for line in generate_messages(SCENARIOS["many_streams"], num_records=60, state_interval=30)
+    ]
+
+    assert [msg["type"] for msg in messages].count("SCHEMA") == 30
+    assert [msg["type"] for msg in messages].count("RECORD") == 60
+    assert [msg["type"] for msg in messages].count("STATE") == 2
+
+
+def test_run_scenario_stages():
+    results = run_scenario(SCENARIOS["partitioned"], num_records=200, run_whole_target=False)
+
+    assert results["records"] == 200
+    assert set(results["stages"]) == {"parse", "flatten", "to_arrow", "accumulate", "write"}
+
+
+def test_compare_with_baseline():
+    baseline = {
+        "narrow": {
+            "records": 100,
+            "stages": {"parse": 1.0, "write": 1.0},
+            "target": {"seconds": 10.0, "peak_rss_mb": 100.0},
+        }
+    }
+    results = {
+        "narrow": {
+            "records": 100,
+            "stages": {"parse": 1.1, "write": 2.0},
+            "target": {"seconds": 10.0, "peak_rss_mb": 200.0},
+        }
+    }
+
+    regressions = compare_with_baseline(results, baseline, tolerance=0.25)
+
+    assert regressions == [
+        "narrow: stage write 2.000 > 1.000 (+100%)",
+        "narrow: target peak_rss_mb 200.000 > 100.000 (+100%)",
+    ]
+
+
+def test_measure_import_time():
+    results = measure_import_time(repeat=1)
+
+    assert results["seconds"] > 0
+    assert results["lazy_modules"] == []
+
+
+def test_compare_import_with_baseline():
+    baseline = {"import": {"seconds": 1.0, "lazy_modules": []}}
+    results = {"import": {"seconds": 2.0, "lazy_modules": ["azure.identity"]}}
+
+    regressions = compare_with_baseline(results, baseline, tolerance=0.25)
+
+    assert regressions == [
+        "import: azure.identity is not imported lazily",
+        "import: seconds 2.000 > 1.000 (+100%)",
+    ]
+
+
+def test_main_smoke(tmp_path, capsys):
+    output = tmp_path / "results.json"
+
+    exit_code = main(
+        ["-s", "nested", "--records", "100", "--output", str(output), "--baseline", str(tmp_path / "baseline.json")]
+    )
+
+    assert exit_code == 0
+    results = json.loads(output.read_text())
+    assert results["nested"]["target"]["output_bytes"] > 0
+    assert "nested (100 records)" in capsys.readouterr().out
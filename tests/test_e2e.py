@@ -1,15 +1,21 @@
 import json
 import os.path
+from datetime import date, datetime, timezone
+from decimal import Decimal
 from io import StringIO
 from pathlib import Path
 from uuid import uuid4
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.fs
+import pyarrow.parquet as pq
 import pytest
 from singer_sdk import typing as th
 from singer_sdk.testing import target_sync_test
 
 from target_parquet.target import TargetParquet
+from target_parquet.utils.filesystem import FILESYSTEM_BACKENDS
 
 
 @pytest.fixture(scope="session")
@@ -102,6 +108,36 @@ def example2_schema_messages_mixed():
     }
 
 
+@pytest.fixture()
+def example3_schema_messages_many_records():
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    schema_message = {
+        "type": "SCHEMA",
+        "stream": stream_name,
+        "schema": {
+            "type": "object",
+            "properties": {"col_a": th.StringType().to_dict()},
+        },
+    }
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [schema_message]
+        + [
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_a": f"samplerow{i}"},
+            }
+            for i in range(100)
+        ]
+    )
+    return {
+        "stream_name": stream_name,
+        "schema": schema_message,
+        "messages": tap_output,
+    }
+
+
 def test_e2e_create_file(
         monkeypatch, test_output_dir, sample_config, example1_schema_messages
 ):
@@ -165,6 +201,222 @@ def test_e2e_create_file_mixed_schemas(
     assert expected.equals(result)
 
 
+@pytest.mark.parametrize(
+    "config, expected_files",
+    [({}, 1), ({"spill_dir": "spill"}, 1), ({"streaming_write": True}, 2)],
+)
+def test_e2e_schema_evolution(
+    monkeypatch, test_output_dir, sample_config, tmp_path, config, expected_files
+):
+    """Test that the target merges the compatible schemas of a stream in the same file"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    if "spill_dir" in config:
+        config = {"spill_dir": str(tmp_path / "spill")}
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [
+            # An added column and an integer widened to a number
+            {
+                "type": "SCHEMA",
+                "stream": stream_name,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "col_a": th.StringType().to_dict(),
+                        "col_b": th.IntegerType().to_dict(),
+                    },
+                },
+            },
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_a": "samplerow1", "col_b": 1},
+            },
+            {
+                "type": "SCHEMA",
+                "stream": stream_name,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "col_a": th.StringType().to_dict(),
+                        "col_b": th.NumberType().to_dict(),
+                        "col_c": th.BooleanType().to_dict(),
+                    },
+                },
+            },
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_a": "samplerow2", "col_b": 2.5, "col_c": True},
+            },
+            # A removed column, kept in the file
+            {
+                "type": "SCHEMA",
+                "stream": stream_name,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "col_b": th.NumberType().to_dict(),
+                        "col_c": th.BooleanType().to_dict(),
+                    },
+                },
+            },
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_b": 3.5, "col_c": False},
+            },
+        ]
+    )
+
+    target_sync_test(
+        TargetParquet(config=sample_config | config),
+        input=StringIO(tap_output),
+        finalize=True,
+    )
+
+    files = sorted(
+        os.listdir(test_output_dir / stream_name),
+        key=lambda file: int(file.split("-")[-2]),
+    )
+    assert len(files) == expected_files
+    # In streaming mode, the file of the first schema has fewer columns
+    result = pa.concat_tables(
+        [pq.read_table(test_output_dir / stream_name / file) for file in files],
+        promote_options="permissive",
+    )
+    assert result.to_pydict() == {
+        "col_a": ["samplerow1", "samplerow2", None],
+        "col_b": [1.0, 2.5, 3.5],
+        "col_c": [None, True, False],
+    }
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        {},
+        {"spill_dir": "spill"},
+        {"streaming_write": True},
+        {"partition_cols": "col_b"},
+    ],
+    ids=["default", "spill_dir", "streaming_write", "partition_cols"],
+)
+def test_e2e_schema_evolution_required_columns(
+    monkeypatch, test_output_dir, sample_config, tmp_path, config
+):
+    """Test that the columns missing from one of the schemas are written as nullable"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    if "spill_dir" in config:
+        config = {"spill_dir": str(tmp_path / "spill")}
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [
+            {
+                "type": "SCHEMA",
+                "stream": stream_name,
+                "schema": th.PropertiesList(
+                    th.Property("col_a", th.StringType, required=True),
+                    th.Property("col_b", th.IntegerType, required=True),
+                ).to_dict(),
+            },
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_a": "samplerow1", "col_b": 1},
+            },
+            # A required column removed and another added
+            {
+                "type": "SCHEMA",
+                "stream": stream_name,
+                "schema": th.PropertiesList(
+                    th.Property("col_b", th.IntegerType, required=True),
+                    th.Property("col_c", th.StringType, required=True),
+                ).to_dict(),
+            },
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_b": 1, "col_c": "samplerow2"},
+            },
+        ]
+    )
+
+    target_sync_test(
+        TargetParquet(config=sample_config | config),
+        input=StringIO(tap_output),
+        finalize=True,
+    )
+
+    result = pa.concat_tables(
+        [
+            pq.read_table(path)
+            for path in sorted((test_output_dir / stream_name).rglob("*.parquet"))
+        ],
+        promote_options="permissive",
+    ).select(["col_a", "col_c"])
+    assert sorted(result.to_pylist(), key=lambda row: row["col_a"] or "") == [
+        {"col_a": None, "col_c": "samplerow2"},
+        {"col_a": "samplerow1", "col_c": None},
+    ]
+
+
+def test_e2e_schema_incompatible_change(monkeypatch, test_output_dir, sample_config):
+    """Test that the target writes the data of the previous schema when the schema of a stream
+    changes incompatibly"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [
+            {
+                "type": "SCHEMA",
+                "stream": stream_name,
+                "schema": {
+                    "type": "object",
+                    "properties": {"col_a": th.StringType().to_dict()},
+                },
+            },
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_a": "samplerow1"},
+            },
+            {
+                "type": "SCHEMA",
+                "stream": stream_name,
+                "schema": {
+                    "type": "object",
+                    "properties": {"col_a": th.IntegerType().to_dict()},
+                },
+            },
+            {"type": "RECORD", "stream": stream_name, "record": {"col_a": 1}},
+        ]
+    )
+
+    target = TargetParquet(config=sample_config)
+    target_sync_test(target, input=StringIO(tap_output), finalize=False)
+
+    # The file of the previous schema is written without waiting for the end
+    files = os.listdir(test_output_dir / stream_name)
+    assert len(files) == 1
+    result = pd.read_parquet(test_output_dir / stream_name / files[0])
+    assert list(result["col_a"]) == ["samplerow1"]
+
+    # The file of the new schema doesn't overwrite it
+    target_sync_test(target, input=StringIO(""), finalize=True)
+    files = sorted(os.listdir(test_output_dir / stream_name))
+    assert len(files) == 2
+    tables = [pq.read_table(test_output_dir / stream_name / file) for file in files]
+    assert sum(table.num_rows for table in tables) == 2
+    assert sorted((table.column("col_a").to_pylist() for table in tables), key=str) == [
+        ["samplerow1"],
+        [1],
+    ]
+
+
 def test_e2e_create_file_with_null_fields(monkeypatch, test_output_dir, sample_config):
     """This tests checks if the null object fields are being correctly exploded according to the schema and
     if it doesn't replace the values if we have a conflict of the same field name in different levels of object.
@@ -351,74 +603,849 @@ def test_e2e_multiple_files(monkeypatch, test_output_dir, sample_config):
     assert len(os.listdir(test_output_dir / stream_name)) > 1
 
 
-def test_e2e_extra_fields(
-        monkeypatch, test_output_dir, sample_config, example1_schema_messages
+def test_e2e_async_write(
+    monkeypatch, test_output_dir, sample_config, example3_schema_messages_many_records
 ):
-    """Test if the target can add extra fields in the record"""
+    """Test that the target writes every file when writing in background threads"""
     monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = example3_schema_messages_many_records["stream_name"]
 
     target_sync_test(
         TargetParquet(
             config=sample_config
-                   | {
-                       "extra_fields": "field1=value1,field2=1",
-                       "extra_fields_types": "field1=string,field2=integer",
-                   }
+            | {
+                "async_write": True,
+                "async_write_workers": 2,
+                "max_batch_size": 10,
+                "max_pyarrow_table_size": 0,
+            }
         ),
-        input=StringIO(example1_schema_messages["messages"]),
+        input=StringIO(example3_schema_messages_many_records["messages"]),
         finalize=True,
     )
 
-    assert (
-            len(os.listdir(test_output_dir / example1_schema_messages["stream_name"])) == 1
-    )
-
-    expected = pd.DataFrame(
-        {
-            "col_a": ["samplerow1", "samplerow2"],
-            "field1": ["value1", "value1"],
-            "field2": [1, 1],
-        }
-    )
-    result = pd.read_parquet(test_output_dir / example1_schema_messages["stream_name"])
-    assert expected.equals(result)
+    assert len(os.listdir(test_output_dir / stream_name)) == 10
+    result = pd.read_parquet(test_output_dir / stream_name)
+    assert sorted(result["col_a"]) == sorted(f"samplerow{i}" for i in range(100))
 
 
-def test_e2e_partition_cols(
-        monkeypatch, test_output_dir, sample_config, example1_schema_messages
+@pytest.mark.parametrize("streaming_write", [False, True])
+def test_e2e_encoding_processes(
+    monkeypatch, test_output_dir, sample_config, streaming_write
 ):
-    """Test if the target can partition the data"""
+    """Test that the target converts the batches in worker processes and keeps their order"""
     monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    schema_message = {
+        "type": "SCHEMA",
+        "stream": stream_name,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "col_a": th.StringType().to_dict(),
+                "col_b": th.ObjectType(th.Property("col_c", th.IntegerType)).to_dict(),
+            },
+        },
+    }
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [schema_message]
+        + [
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_a": f"samplerow{i}", "col_b": {"col_c": i}},
+            }
+            for i in range(100)
+        ]
+    )
 
     target_sync_test(
         TargetParquet(
             config=sample_config
-                   | {
-                       "extra_fields": "field1=value1",
-                       "extra_fields_types": "field1=string",
-                       "partition_cols": "field1",
-                   }
+            | {
+                "encoding_processes": 2,
+                "max_batch_size": 10,
+                "streaming_write": streaming_write,
+            }
         ),
-        input=StringIO(example1_schema_messages["messages"]),
+        input=StringIO(tap_output),
         finalize=True,
     )
 
-    assert (
-            len(
-                os.listdir(
-                    test_output_dir
-                    / example1_schema_messages["stream_name"]
-                    / "field1=value1"
-                )
-            )
-            == 1
+    result = pd.read_parquet(test_output_dir / stream_name)
+    assert list(result["col_a"]) == [f"samplerow{i}" for i in range(100)]
+    assert list(result["col_b__col_c"]) == list(range(100))
+
+
+def test_e2e_fast_ingest(monkeypatch, test_output_dir, sample_config):
+    """Test that the target parses and dispatches the messages with the fast ingest path"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    schema_message = {
+        "type": "SCHEMA",
+        "stream": stream_name,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "col_a": th.StringType().to_dict(),
+                "col_b": th.NumberType().to_dict(),
+            },
+        },
+    }
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [schema_message]
+        + [
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_a": f"samplerow{i}", "col_b": i / 2},
+            }
+            for i in range(100)
+        ]
+        + [{"type": "STATE", "value": {"bookmarks": {stream_name: {"id": 99}}}}]
     )
 
-    expected = pd.DataFrame({"col_a": ["samplerow1", "samplerow2"]})
-    result = pd.read_parquet(
-        test_output_dir / example1_schema_messages["stream_name"] / "field1=value1"
+    stdout, _ = target_sync_test(
+        TargetParquet(config=sample_config | {"fast_ingest": True}),
+        input=StringIO(tap_output),
+        finalize=True,
     )
-    assert expected.equals(result)
+
+    assert json.loads(stdout.getvalue()) == {"bookmarks": {stream_name: {"id": 99}}}
+    result = pd.read_parquet(test_output_dir / stream_name)
+    assert list(result["col_a"]) == [f"samplerow{i}" for i in range(100)]
+    assert list(result["col_b"]) == [i / 2 for i in range(100)]
+
+
+def test_e2e_fast_ingest_number_constraints(
+    monkeypatch, test_output_dir, sample_config
+):
+    """Test that the fast ingest path validates the constrained numbers as decimals"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    schema_message = {
+        "type": "SCHEMA",
+        "stream": stream_name,
+        "schema": {
+            "type": "object",
+            "properties": {"amount": {"type": "number", "multipleOf": 0.01}},
+        },
+    }
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [
+            schema_message,
+            {"type": "RECORD", "stream": stream_name, "record": {"amount": 0.07}},
+            {"type": "RECORD", "stream": stream_name, "record": {"amount": 1.1}},
+        ]
+    )
+
+    target_sync_test(
+        TargetParquet(config=sample_config | {"fast_ingest": True}),
+        input=StringIO(tap_output),
+        finalize=True,
+    )
+
+    result = pd.read_parquet(test_output_dir / stream_name)
+    assert list(result["amount"]) == [0.07, 1.1]
+
+
+def test_e2e_streaming_write(
+    monkeypatch, test_output_dir, sample_config, example3_schema_messages_many_records
+):
+    """Test that the target writes each batch as a row group of one file in streaming mode"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = example3_schema_messages_many_records["stream_name"]
+
+    target_sync_test(
+        TargetParquet(
+            config=sample_config | {"streaming_write": True, "max_batch_size": 10}
+        ),
+        input=StringIO(example3_schema_messages_many_records["messages"]),
+        finalize=True,
+    )
+
+    files = os.listdir(test_output_dir / stream_name)
+    assert len(files) == 1
+    assert pq.ParquetFile(test_output_dir / stream_name / files[0]).num_row_groups == 10
+    result = pd.read_parquet(test_output_dir / stream_name)
+    assert list(result["col_a"]) == [f"samplerow{i}" for i in range(100)]
+
+
+@pytest.mark.parametrize("streaming_write", [False, True])
+def test_e2e_metrics(
+    monkeypatch,
+    test_output_dir,
+    sample_config,
+    example3_schema_messages_many_records,
+    tmp_path,
+    streaming_write,
+):
+    """Test that the target writes the metrics of the pipeline to a Prometheus file"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = example3_schema_messages_many_records["stream_name"]
+    prometheus_file = tmp_path / "target_parquet.prom"
+
+    target_sync_test(
+        TargetParquet(
+            config=sample_config
+            | {
+                "streaming_write": streaming_write,
+                "async_write": True,
+                "max_batch_size": 10,
+                "metrics_prometheus_file": str(prometheus_file),
+            }
+        ),
+        input=StringIO(example3_schema_messages_many_records["messages"]),
+        finalize=True,
+    )
+
+    file_size = sum(
+        os.path.getsize(test_output_dir / stream_name / file)
+        for file in os.listdir(test_output_dir / stream_name)
+    )
+    lines = prometheus_file.read_text().splitlines()
+    tags = f'{{stream="{stream_name}"}}'
+    assert f"target_parquet_files_written_total{tags} 1" in lines
+    assert f"target_parquet_bytes_written_total{tags} {file_size}" in lines
+    assert f"target_parquet_rows_per_file_sum{tags} 100" in lines
+    assert f"target_parquet_flatten_duration_seconds_count{tags} 10" in lines
+    assert f"target_parquet_cast_duration_seconds_count{tags} 10" in lines
+    assert any(
+        line.startswith(f"target_parquet_encode_duration_seconds_sum{tags}")
+        for line in lines
+    )
+    # The queue of the background writes is drained at the end
+    assert (
+        f'target_parquet_queue_depth{{queue="write",stream="{stream_name}"}} 0'
+        in lines
+    )
+
+
+@pytest.mark.parametrize("streaming_write", [False, True])
+def test_e2e_encoding_options(
+    monkeypatch, test_output_dir, sample_config, streaming_write
+):
+    """Test that the target encodes the columns with the options of the config and of the stream"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    schema_message = {
+        "type": "SCHEMA",
+        "stream": stream_name,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "col_a": th.StringType().to_dict(),
+                "col_b": th.IntegerType().to_dict(),
+                "col_c": th.NumberType().to_dict(),
+            },
+        },
+    }
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [schema_message]
+        + [
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_a": f"samplerow{i % 3}", "col_b": i, "col_c": i / 2},
+            }
+            for i in range(100)
+        ]
+    )
+
+    target_sync_test(
+        TargetParquet(
+            config=sample_config
+            | {
+                "streaming_write": streaming_write,
+                "compression_level": 5,
+                "write_statistics": "col_a",
+                "stream_encoding_options": {
+                    stream_name: {
+                        "column_encoding": {"col_b": "PLAIN"},
+                        "write_page_index": True,
+                        "data_page_size": 1,
+                    }
+                },
+            }
+        ),
+        input=StringIO(tap_output),
+        finalize=True,
+    )
+
+    files = os.listdir(test_output_dir / stream_name)
+    metadata = pq.ParquetFile(test_output_dir / stream_name / files[0]).metadata
+    columns = {
+        column.path_in_schema: column
+        for column in map(metadata.row_group(0).column, range(metadata.num_columns))
+    }
+    assert "RLE_DICTIONARY" in columns["col_a"].encodings
+    assert columns["col_a"].is_stats_set
+    assert columns["col_b"].encodings == ("RLE", "PLAIN")
+    assert not columns["col_b"].is_stats_set
+    assert "RLE_DICTIONARY" in columns["col_c"].encodings
+    # The page index covers the columns with statistics
+    assert columns["col_a"].has_column_index
+    assert not columns["col_b"].has_column_index
+    assert columns["col_b"].has_offset_index
+    result = pd.read_parquet(test_output_dir / stream_name)
+    assert list(result["col_b"]) == list(range(100))
+
+
+@pytest.mark.parametrize("streaming_write", [False, True])
+@pytest.mark.parametrize(
+    "compression_method, expected_codecs",
+    [("zstd", {"ZSTD"}), ("auto", {"SNAPPY", "ZSTD", "LZ4", "LZ4_RAW", "GZIP"})],
+)
+def test_e2e_compression_method(
+    monkeypatch,
+    test_output_dir,
+    sample_config,
+    example3_schema_messages_many_records,
+    streaming_write,
+    compression_method,
+    expected_codecs,
+):
+    """Test that the target compresses the files with the configured or chosen codec"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = example3_schema_messages_many_records["stream_name"]
+
+    target_sync_test(
+        TargetParquet(
+            config=sample_config
+            | {
+                "streaming_write": streaming_write,
+                "compression_method": compression_method,
+                "compression_level": 3,
+                "max_batch_size": 10,
+            }
+        ),
+        input=StringIO(example3_schema_messages_many_records["messages"]),
+        finalize=True,
+    )
+
+    files = os.listdir(test_output_dir / stream_name)
+    codecs = {
+        pq.ParquetFile(test_output_dir / stream_name / file)
+        .metadata.row_group(0)
+        .column(0)
+        .compression
+        for file in files
+    }
+    assert len(codecs) == 1
+    assert codecs <= expected_codecs
+    result = pd.read_parquet(test_output_dir / stream_name)
+    assert sorted(result["col_a"]) == sorted(f"samplerow{i}" for i in range(100))
+
+
+def test_e2e_max_memory(monkeypatch, test_output_dir, sample_config):
+    """Test that the target writes the buffered data of the streams once max_memory is reached"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_names = [f"test_schema_{str(uuid4()).split('-')[-1]}" for _ in range(2)]
+    schema_messages = [
+        {
+            "type": "SCHEMA",
+            "stream": stream_name,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "col_a": th.StringType().to_dict(),
+                    "col_b": th.StringType().to_dict(),
+                },
+            },
+        }
+        for stream_name in stream_names
+    ]
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in schema_messages
+        + [
+            {
+                "type": "RECORD",
+                "stream": stream_names[i % 2],
+                # About 1.5 MB of records between two checks of the budget
+                "record": {"col_a": f"samplerow{i}", "col_b": "x" * 3000},
+            }
+            for i in range(5000)
+        ]
+    )
+
+    target = TargetParquet(config=sample_config | {"max_memory": 1})
+    # Large batches and tables, only the memory budget writes files before the end
+    target.memory_check_interval = 500
+    target_sync_test(target, input=StringIO(tap_output), finalize=True)
+
+    for n, stream_name in enumerate(stream_names):
+        assert len(os.listdir(test_output_dir / stream_name)) > 1
+        result = pd.read_parquet(test_output_dir / stream_name)
+        assert sorted(result["col_a"]) == sorted(
+            f"samplerow{i}" for i in range(n, 5000, 2)
+        )
+
+
+def test_e2e_spill_dir(
+    monkeypatch,
+    test_output_dir,
+    sample_config,
+    example3_schema_messages_many_records,
+    tmp_path,
+):
+    """Test that the target writes the batches spilled to disk"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = example3_schema_messages_many_records["stream_name"]
+    spill_dir = tmp_path / "spill"
+
+    target_sync_test(
+        TargetParquet(
+            config=sample_config | {"spill_dir": str(spill_dir), "max_batch_size": 10}
+        ),
+        input=StringIO(example3_schema_messages_many_records["messages"]),
+        finalize=True,
+    )
+
+    assert len(os.listdir(test_output_dir / stream_name)) == 1
+    assert os.listdir(spill_dir) == []
+    result = pd.read_parquet(test_output_dir / stream_name)
+    assert list(result["col_a"]) == [f"samplerow{i}" for i in range(100)]
+
+
+@pytest.mark.parametrize("zorder", [False, True])
+def test_e2e_sort_by(monkeypatch, test_output_dir, sample_config, zorder):
+    """Test that the target sorts the rows of the files by the sort_by columns"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    schema_message = {
+        "type": "SCHEMA",
+        "stream": stream_name,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "col_a": th.IntegerType().to_dict(),
+                "col_b": th.IntegerType().to_dict(),
+            },
+        },
+    }
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [schema_message]
+        + [
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                # Every point of a 16x16 grid, shuffled
+                "record": {"col_a": (i * 37) % 256 // 16, "col_b": (i * 37) % 16},
+            }
+            for i in range(256)
+        ]
+    )
+
+    target_sync_test(
+        TargetParquet(
+            config=sample_config
+            | {
+                "sort_by": "col_a,col_b:descending,missing_col",
+                "zorder": zorder,
+                "max_batch_size": 50,
+                "async_write": True,
+            }
+        ),
+        input=StringIO(tap_output),
+        finalize=True,
+    )
+
+    result = pd.read_parquet(test_output_dir / stream_name)
+    rows = list(zip(result["col_a"], result["col_b"]))
+    assert sorted(rows) == [(a, b) for a in range(16) for b in range(16)]
+    if zorder:
+        # Each quarter of the rows covers a quarter of the (col_a, col_b) grid
+        for quarter in range(4):
+            quarter_rows = rows[quarter * 64 : (quarter + 1) * 64]
+            assert len({(a // 8, b // 8) for a, b in quarter_rows}) == 1
+    else:
+        assert rows == sorted(rows, key=lambda row: (row[0], -row[1]))
+
+
+def test_e2e_target_file_size(monkeypatch, test_output_dir, sample_config):
+    """Test that the target splits files on the estimated encoded size"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    schema_message = {
+        "type": "SCHEMA",
+        "stream": stream_name,
+        "schema": {
+            "type": "object",
+            "properties": {"col_a": th.StringType().to_dict()},
+        },
+    }
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [schema_message]
+        + [
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_a": str(uuid4())},
+            }
+            for _ in range(100000)
+        ]
+    )
+
+    target_sync_test(
+        TargetParquet(config=sample_config | {"target_file_size": 1}),
+        input=StringIO(tap_output),
+        finalize=True,
+    )
+
+    files = os.listdir(test_output_dir / stream_name)
+    assert len(files) > 1
+    assert all(
+        os.path.getsize(test_output_dir / stream_name / file) < 2 * 1024 * 1024
+        for file in files
+    )
+    result = pd.read_parquet(test_output_dir / stream_name)
+    assert result.shape == (100000, 1)
+
+
+def test_e2e_native_types(monkeypatch, test_output_dir, sample_config):
+    """Test that the target stores timestamps, dates, decimals and nested values natively"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    schema_message = {
+        "type": "SCHEMA",
+        "stream": stream_name,
+        "schema": th.PropertiesList(
+            th.Property("created_at", th.DateTimeType),
+            th.Property("day", th.DateType),
+            th.Property("price", th.NumberType),
+            th.Property("tags", th.ArrayType(th.StringType)),
+            th.Property(
+                "address",
+                th.ObjectType(
+                    th.Property("city", th.StringType),
+                    th.Property("updated_at", th.DateTimeType),
+                ),
+            ),
+        ).to_dict(),
+    }
+    schema_message["schema"]["properties"]["price"]["multipleOf"] = 0.01
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [
+            schema_message,
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {
+                    "created_at": "2024-01-01T10:00:00+02:00",
+                    "day": "2024-01-02",
+                    "price": 1.1,
+                    "tags": ["a", "b"],
+                    "address": {"city": "Paris", "updated_at": "2024-01-03T00:00:00Z"},
+                },
+            },
+            {"type": "RECORD", "stream": stream_name, "record": {"tags": None}},
+        ]
+    )
+
+    target_sync_test(
+        TargetParquet(config=sample_config | {"native_types": True}),
+        input=StringIO(tap_output),
+        finalize=True,
+    )
+
+    result = pq.read_table(test_output_dir / stream_name)
+    assert result.schema.field("created_at").type == pa.timestamp("us", tz="UTC")
+    assert result.schema.field("day").type == pa.date32()
+    assert result.schema.field("price").type == pa.decimal128(38, 2)
+    assert result.schema.field("tags").type == pa.list_(pa.string())
+    assert result.schema.field("address__updated_at").type == pa.timestamp(
+        "us", tz="UTC"
+    )
+    assert result.to_pylist() == [
+        {
+            "created_at": datetime(2024, 1, 1, 8, tzinfo=timezone.utc),
+            "day": date(2024, 1, 2),
+            "price": Decimal("1.10"),
+            "tags": ["a", "b"],
+            "address__city": "Paris",
+            "address__updated_at": datetime(2024, 1, 3, tzinfo=timezone.utc),
+        },
+        {
+            "created_at": None,
+            "day": None,
+            "price": None,
+            "tags": None,
+            "address__city": None,
+            "address__updated_at": None,
+        },
+    ]
+
+
+def test_e2e_schema_cache_dir(monkeypatch, test_output_dir, sample_config, tmp_path):
+    """Test that the compiled schemas are reused from schema_cache_dir by the next runs"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    schema_message = {
+        "type": "SCHEMA",
+        "stream": stream_name,
+        "schema": th.PropertiesList(
+            th.Property("price", th.NumberType),
+            th.Property("tags", th.ArrayType(th.StringType)),
+            th.Property("address", th.ObjectType(th.Property("city", th.StringType))),
+        ).to_dict(),
+    }
+    schema_message["schema"]["properties"]["price"]["multipleOf"] = 0.01
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [
+            schema_message,
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {
+                    "price": 1.1,
+                    "tags": ["a", "b"],
+                    "address": {"city": "Paris"},
+                },
+            },
+        ]
+    )
+    config = sample_config | {
+        "native_types": True,
+        "schema_cache_dir": str(tmp_path / "schemas"),
+    }
+
+    target_sync_test(
+        TargetParquet(config=config), input=StringIO(tap_output), finalize=True
+    )
+    assert len(os.listdir(tmp_path / "schemas")) == 1
+
+    def fail(self):
+        raise AssertionError("The schema is compiled again")
+
+    monkeypatch.setattr("target_parquet.sinks.ParquetSink.get_flatten_schema", fail)
+    target_sync_test(
+        TargetParquet(config=config | {"destination_path": str(tmp_path / "output")}),
+        input=StringIO(tap_output),
+        finalize=True,
+    )
+
+    expected = pq.read_table(test_output_dir / stream_name)
+    result = pq.read_table(tmp_path / "output" / stream_name)
+    assert result.schema == expected.schema
+    assert (
+        result.to_pylist()
+        == expected.to_pylist()
+        == [{"price": Decimal("1.10"), "tags": ["a", "b"], "address__city": "Paris"}]
+    )
+
+
+def test_e2e_validate_records_disabled(monkeypatch, test_output_dir, sample_config):
+    """Test that objects in the string columns of records not validated are stored as JSON"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [
+            {
+                "type": "SCHEMA",
+                "stream": stream_name,
+                "schema": th.PropertiesList(
+                    th.Property("col_a", th.StringType)
+                ).to_dict(),
+            },
+            {"type": "RECORD", "stream": stream_name, "record": {"col_a": {"b": 1}}},
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_a": "samplerow2"},
+            },
+        ]
+    )
+
+    target_sync_test(
+        TargetParquet(config=sample_config | {"validate_records": False}),
+        input=StringIO(tap_output),
+        finalize=True,
+    )
+
+    result = pq.read_table(test_output_dir / stream_name)
+    assert result.column("col_a").to_pylist() == ['{"b": 1}', "samplerow2"]
+
+
+def test_e2e_destination_uri(
+    monkeypatch, test_output_dir, sample_config, example1_schema_messages
+):
+    """Test that the target resolves the filesystem from a destination URI"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+
+    target_sync_test(
+        TargetParquet(
+            config=sample_config
+            | {"destination_path": f"file://{test_output_dir.absolute()}"}
+        ),
+        input=StringIO(example1_schema_messages["messages"]),
+        finalize=True,
+    )
+
+    expected = pd.DataFrame({"col_a": ["samplerow1", "samplerow2"]})
+    result = pd.read_parquet(test_output_dir / example1_schema_messages["stream_name"])
+    assert expected.equals(result)
+
+
+def test_e2e_staging_dir(
+    monkeypatch, tmpdir, test_output_dir, sample_config, example1_schema_messages
+):
+    """Test that the target encodes files in the staging directory before uploading them"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    test_output_dir.mkdir(parents=True, exist_ok=True)
+    # Local directory standing in for a remote filesystem
+    monkeypatch.setitem(
+        FILESYSTEM_BACKENDS,
+        "test",
+        lambda config: pyarrow.fs.SubTreeFileSystem(
+            str(test_output_dir.absolute()), pyarrow.fs.LocalFileSystem()
+        ),
+    )
+
+    target_sync_test(
+        TargetParquet(
+            config=sample_config
+            | {"destination_path": "test://", "staging_dir": str(tmpdir)}
+        ),
+        input=StringIO(example1_schema_messages["messages"]),
+        finalize=True,
+    )
+
+    expected = pd.DataFrame({"col_a": ["samplerow1", "samplerow2"]})
+    result = pd.read_parquet(test_output_dir / example1_schema_messages["stream_name"])
+    assert expected.equals(result)
+    # The spool files are deleted once uploaded
+    assert not list(Path(tmpdir).rglob("*.parquet"))
+
+
+def test_e2e_extra_fields(
+        monkeypatch, test_output_dir, sample_config, example1_schema_messages
+):
+    """Test if the target can add extra fields in the record"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+
+    target_sync_test(
+        TargetParquet(
+            config=sample_config
+                   | {
+                       "extra_fields": "field1=value1,field2=1",
+                       "extra_fields_types": "field1=string,field2=integer",
+                   }
+        ),
+        input=StringIO(example1_schema_messages["messages"]),
+        finalize=True,
+    )
+
+    assert (
+            len(os.listdir(test_output_dir / example1_schema_messages["stream_name"])) == 1
+    )
+
+    expected = pd.DataFrame(
+        {
+            "col_a": ["samplerow1", "samplerow2"],
+            "field1": ["value1", "value1"],
+            "field2": [1, 1],
+        }
+    )
+    result = pd.read_parquet(test_output_dir / example1_schema_messages["stream_name"])
+    assert expected.equals(result)
+
+
+def test_e2e_partition_cols(
+        monkeypatch, test_output_dir, sample_config, example1_schema_messages
+):
+    """Test if the target can partition the data"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+
+    target_sync_test(
+        TargetParquet(
+            config=sample_config
+                   | {
+                       "extra_fields": "field1=value1",
+                       "extra_fields_types": "field1=string",
+                       "partition_cols": "field1",
+                   }
+        ),
+        input=StringIO(example1_schema_messages["messages"]),
+        finalize=True,
+    )
+
+    assert (
+            len(
+                os.listdir(
+                    test_output_dir
+                    / example1_schema_messages["stream_name"]
+                    / "field1=value1"
+                )
+            )
+            == 1
+    )
+
+    expected = pd.DataFrame({"col_a": ["samplerow1", "samplerow2"]})
+    result = pd.read_parquet(
+        test_output_dir / example1_schema_messages["stream_name"] / "field1=value1"
+    )
+    assert expected.equals(result)
+
+
+def test_e2e_partition_cols_multiple_writes(
+    monkeypatch, test_output_dir, sample_config
+):
+    """Test that partitions are appended to the same file across writes"""
+    monkeypatch.setattr("time.time", lambda: 1700000000)
+    stream_name = f"test_schema_{str(uuid4()).split('-')[-1]}"
+    schema_message = {
+        "type": "SCHEMA",
+        "stream": stream_name,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "col_a": th.StringType().to_dict(),
+                "col_b": th.StringType().to_dict(),
+            },
+        },
+    }
+    tap_output = "\n".join(
+        json.dumps(msg)
+        for msg in [schema_message]
+        + [
+            {
+                "type": "RECORD",
+                "stream": stream_name,
+                "record": {"col_a": f"samplerow{i}", "col_b": f"value{i % 5}"},
+            }
+            for i in range(100)
+        ]
+    )
+
+    target_sync_test(
+        TargetParquet(
+            config=sample_config
+            | {
+                "partition_cols": "col_b",
+                "max_batch_size": 10,
+                "max_pyarrow_table_size": 0,
+            }
+        ),
+        input=StringIO(tap_output),
+        finalize=True,
+    )
+
+    partitions = sorted(os.listdir(test_output_dir / stream_name))
+    assert partitions == [f"col_b=value{i}" for i in range(5)]
+    for partition in partitions:
+        assert len(os.listdir(test_output_dir / stream_name / partition)) == 1
+    result = pd.read_parquet(test_output_dir / stream_name)
+    assert result.shape == (100, 2)
 
 
 def test_e2e_extra_fields_validation(
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from target_parquet.utils.background import BackgroundWriter
+
+
+def test_background_writer_runs_jobs():
+    writer = BackgroundWriter(max_workers=2, max_queued_bytes=100)
+    results = []
+
+    for i in range(5):
+        writer.submit(results.append, i, nbytes=10)
+    writer.close()
+
+    assert sorted(results) == [0, 1, 2, 3, 4]
+    assert writer.queued_bytes == 0
+    assert writer.queue_depth == 0
+
+
+def test_background_writer_backpressure():
+    writer = BackgroundWriter(max_workers=1, max_queued_bytes=10)
+    release = threading.Event()
+    writer.submit(release.wait, nbytes=10)
+
+    submitted = threading.Event()
+
+    def submit_second_job():
+        writer.submit(lambda: None, nbytes=10)
+        submitted.set()
+
+    thread = threading.Thread(target=submit_second_job)
+    thread.start()
+    # The queue is full, so the second job waits for the first one to finish
+    assert not submitted.wait(0.2)
+    assert writer.queued_bytes == 10
+
+    release.set()
+    assert submitted.wait(5)
+    thread.join()
+    writer.close()
+
+
+def test_background_writer_propagates_errors():
+    writer = BackgroundWriter()
+
+    def fail():
+        raise ValueError("upload failed")
+
+    writer.submit(fail)
+    with pytest.raises(ValueError, match="upload failed"):
+        writer.wait()
+
+    writer.submit(fail)
+    time.sleep(0.1)
+    with pytest.raises(ValueError, match="upload failed"):
+        writer.submit(lambda: None)
+    writer.close()
+
+
+def test_background_writer_without_queue_errors():
+    writer = BackgroundWriter(queue_errors=False)
+
+    def fail():
+        raise ValueError("encoding failed")
+
+    future = writer.submit(fail)
+    with pytest.raises(ValueError, match="encoding failed"):
+        future.result()
+    writer.submit(lambda: None)
+    writer.close()
+
+
+def test_background_writer_processes():
+    writer = BackgroundWriter(max_workers=2, processes=True)
+
+    futures = [writer.submit(sum, [i, i], nbytes=1) for i in range(4)]
+    writer.close()
+
+    assert [future.result() for future in futures] == [0, 2, 4, 6]
@@ -0,0 +1,223 @@
+import os
+from contextlib import contextmanager
+
+import pyarrow as pa
+import pyarrow.fs
+import pyarrow.parquet as pq
+import pytest
+
+from target_parquet.utils.filesystem import (
+    FILESYSTEM_BACKENDS,
+    SPOOL_LOCK_SUFFIX,
+    STAGING_SUFFIX,
+    FileSystemCache,
+    StagingFileSystemHandler,
+    get_filesystem,
+    register_filesystem,
+    split_destination_path,
+)
+from target_parquet.utils.parquet import write_parquet_file
+
+
+@contextmanager
+def register_test_filesystem(filesystem):
+    register_filesystem("test")(lambda config: filesystem)
+    try:
+        yield
+    finally:
+        FILESYSTEM_BACKENDS.pop("test")
+
+
+@pytest.fixture()
+def sample_table():
+    return pa.table({"id": [1, 2, 3], "name": ["Alice", "Bob", "Charlie"]})
+
+
+@pytest.mark.parametrize(
+    "destination_path, destination_type, expected_result",
+    [
+        pytest.param("output/stream", None, ("local", "output/stream"), id="local"),
+        pytest.param("file:///tmp/stream", None, ("file", "/tmp/stream"), id="file"),
+        pytest.param("S3://bucket/prefix", None, ("s3", "bucket/prefix"), id="s3"),
+        pytest.param("gs://bucket/prefix", "azure", ("gs", "bucket/prefix"), id="gcs"),
+        pytest.param("container/prefix", "azure", ("azure", "container/prefix"), id="azure"),
+    ],
+)
+def test_split_destination_path(destination_path, destination_type, expected_result):
+    assert split_destination_path(destination_path, destination_type) == expected_result
+
+
+@pytest.mark.parametrize(
+    "scheme, config, expected_type_name",
+    [
+        ("local", {}, "local"),
+        (
+            "s3",
+            {
+                "filesystem_options": {
+                    "anonymous": True,
+                    "endpoint_override": "localhost:9000",
+                    "scheme": "http",
+                    "region": "us-east-1",
+                }
+            },
+            "s3",
+        ),
+        ("gs", {"filesystem_options": {"anonymous": True}}, "gcs"),
+    ],
+)
+def test_get_filesystem(scheme, config, expected_type_name):
+    assert get_filesystem(scheme, config).type_name == expected_type_name
+
+
+def test_get_filesystem_unsupported():
+    with pytest.raises(ValueError, match="Unsupported destination filesystem: ftp"):
+        get_filesystem("ftp")
+
+
+def test_register_filesystem(tmpdir):
+    @register_filesystem("test")
+    def _test_filesystem(config):
+        return pyarrow.fs.SubTreeFileSystem(config["root"], pyarrow.fs.LocalFileSystem())
+
+    try:
+        filesystem, path = FileSystemCache({"root": str(tmpdir)}).resolve("test://stream")
+        assert path == "stream"
+        filesystem.create_dir(path)
+        assert tmpdir.join("stream").check(dir=True)
+    finally:
+        FILESYSTEM_BACKENDS.pop("test")
+
+
+def test_filesystem_cache(monkeypatch):
+    credentials = []
+    monkeypatch.setattr(
+        "azure.identity.DefaultAzureCredential", lambda: credentials.append(1) or object()
+    )
+    monkeypatch.setattr(
+        "pyarrowfs_adlgen2.AccountHandler.from_account_name",
+        lambda account, credential: (account, credential),
+    )
+    monkeypatch.setattr("pyarrow.fs.PyFileSystem", lambda handler: handler)
+    cache = FileSystemCache({"azure_account": "account1"})
+
+    filesystem, path = cache.resolve("container/stream", "azure")
+    assert path == "container/stream"
+    assert filesystem[0] == "account1"
+    assert cache.resolve("abfs://container/other_stream")[0] is cache.get("abfs")
+    assert cache.resolve("container/other_stream", "azure")[0] is filesystem
+    assert isinstance(cache.get("local"), pyarrow.fs.LocalFileSystem)
+    # The credential is created once per filesystem
+    assert len(credentials) == 2
+
+
+@pytest.fixture()
+def remote_filesystem(tmpdir):
+    """Local directory standing in for a remote filesystem."""
+    tmpdir.mkdir("remote")
+    return pyarrow.fs.SubTreeFileSystem(
+        str(tmpdir.join("remote")), pyarrow.fs.LocalFileSystem()
+    )
+
+
+def test_staging_filesystem(tmpdir, remote_filesystem, sample_table):
+    staging_dir = str(tmpdir.join("staging"))
+    handler = StagingFileSystemHandler(remote_filesystem, staging_dir)
+    filesystem = pyarrow.fs.PyFileSystem(handler)
+
+    write_parquet_file(
+        sample_table,
+        "bucket/stream",
+        basename_template="test_parquet_file-{i}",
+        filesystem=filesystem,
+    )
+    handler.wait()
+
+    assert tmpdir.join("remote/bucket/stream/test_parquet_file-0.gz.parquet").check()
+    assert pq.read_table(
+        "bucket/stream", filesystem=remote_filesystem
+    ).equals(sample_table)
+    # The spool files are deleted once uploaded
+    assert not os.listdir(os.path.join(handler.spool_dir, "bucket/stream"))
+
+
+def test_staging_filesystem_retries(monkeypatch, tmpdir, remote_filesystem):
+    copy_files = pyarrow.fs.copy_files
+    attempts = []
+
+    def flaky_copy_files(*args, **kwargs):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise OSError("connection reset")
+        copy_files(*args, **kwargs)
+
+    monkeypatch.setattr("pyarrow.fs.copy_files", flaky_copy_files)
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    handler = StagingFileSystemHandler(
+        remote_filesystem, str(tmpdir.join("staging")), retries=2
+    )
+
+    with pyarrow.fs.PyFileSystem(handler).open_output_stream("bucket/file") as f:
+        f.write(b"content")
+    handler.wait()
+    assert len(attempts) == 3
+    assert tmpdir.join("remote/bucket/file").read() == "content"
+
+    attempts.clear()
+    handler.retries = 1
+    with pyarrow.fs.PyFileSystem(handler).open_output_stream("bucket/file2") as f:
+        f.write(b"content")
+    with pytest.raises(OSError, match="connection reset"):
+        handler.wait()
+    # The file stays in the spool directory to be uploaded later
+    assert os.path.exists(os.path.join(handler.spool_dir, "bucket/file2"))
+
+
+def test_staging_filesystem_resume_uploads(tmpdir, remote_filesystem):
+    staging_dir = tmpdir.mkdir("staging")
+    # The spool directory of a stopped process, whose lock is released
+    staging_dir.join(f"stopped{SPOOL_LOCK_SUFFIX}").write("")
+    staging_dir.mkdir("stopped").mkdir("bucket").join("complete").write("content")
+    staging_dir.join("stopped", "bucket", f"partial{STAGING_SUFFIX}").write("cont")
+
+    handler = StagingFileSystemHandler(remote_filesystem, str(staging_dir))
+    handler.wait()
+
+    assert tmpdir.join("remote/bucket/complete").read() == "content"
+    assert not tmpdir.join("remote/bucket/partial").check()
+    assert sorted(staging_dir.listdir()) == [
+        staging_dir.join(os.path.basename(handler.spool_dir)),
+        staging_dir.join(f"{os.path.basename(handler.spool_dir)}{SPOOL_LOCK_SUFFIX}"),
+    ]
+
+
+def test_staging_filesystem_shared_staging_dir(tmpdir, remote_filesystem):
+    staging_dir = str(tmpdir.join("staging"))
+    handler = StagingFileSystemHandler(remote_filesystem, staging_dir)
+    filesystem = pyarrow.fs.PyFileSystem(handler)
+
+    with filesystem.open_output_stream("bucket/file") as f:
+        f.write(b"cont")
+        # The files of a running process are left to it
+        other_handler = StagingFileSystemHandler(remote_filesystem, staging_dir)
+        other_handler.wait()
+        assert os.path.exists(
+            os.path.join(handler.spool_dir, f"bucket/file{STAGING_SUFFIX}")
+        )
+        f.write(b"ent")
+    handler.wait()
+
+    assert tmpdir.join("remote/bucket/file").read() == "content"
+
+
+def test_filesystem_cache_staging(tmpdir, remote_filesystem):
+    cache = FileSystemCache({"staging_dir": str(tmpdir.join("staging"))})
+    assert isinstance(cache.get("local"), pyarrow.fs.LocalFileSystem)
+    with register_test_filesystem(remote_filesystem):
+        filesystem, path = cache.resolve("test://bucket/stream")
+    assert filesystem.type_name == "py::staging+subtree"
+
+    with filesystem.open_output_stream(f"{path}/file") as f:
+        f.write(b"content")
+    cache.wait()
+    assert tmpdir.join("remote/bucket/stream/file").read() == "content"
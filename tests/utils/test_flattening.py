@@ -0,0 +1,114 @@
+from decimal import Decimal
+
+import pytest
+from singer_sdk.helpers._flattening import flatten_record, flatten_schema
+
+from target_parquet.utils.flattening import (
+    FlattenedColumn,
+    extract_columns,
+    flatten_schema_columns,
+)
+
+
+@pytest.fixture()
+def nested_schema():
+    return {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer"},
+            "price": {"type": ["number", "null"]},
+            "tags": {"type": ["array", "null"], "items": {"type": "string"}},
+            "payload": {"type": ["object", "null"]},
+            "address": {
+                "type": ["object", "null"],
+                "properties": {
+                    "city": {"type": ["string", "null"]},
+                    "geo": {
+                        "type": ["object", "null"],
+                        "properties": {
+                            "lat": {"type": ["number", "null"]},
+                            "lng": {"type": ["number", "null"]},
+                        },
+                    },
+                },
+            },
+        },
+    }
+
+
+@pytest.fixture()
+def nested_records():
+    return [
+        {
+            "id": 1,
+            "price": Decimal("1.10"),
+            "tags": ["a", "b"],
+            "payload": {"key": Decimal("2.5")},
+            "address": {"city": "Paris", "geo": {"lat": 48.8, "lng": 2.3}},
+        },
+        {"id": 2, "address": None},
+        {"id": 3, "address": {"city": "Lyon"}, "payload": None},
+        {"id": 4, "address": {"geo": {"lat": 45.7}}, "extra": "ignored"},
+    ]
+
+
+def test_flatten_schema_columns(nested_schema):
+    columns = flatten_schema_columns(nested_schema, max_level=100)
+
+    assert columns == {
+        "id": FlattenedColumn(("id",), False),
+        "price": FlattenedColumn(("price",), False),
+        "tags": FlattenedColumn(("tags",), True),
+        "payload": FlattenedColumn(("payload",), True),
+        "address__city": FlattenedColumn(("address", "city"), False),
+        "address__geo__lat": FlattenedColumn(("address", "geo", "lat"), False),
+        "address__geo__lng": FlattenedColumn(("address", "geo", "lng"), False),
+    }
+    assert list(columns) == list(
+        flatten_schema(nested_schema, max_level=100)["properties"]
+    )
+
+
+def test_flatten_schema_columns_max_level(nested_schema):
+    columns = flatten_schema_columns(nested_schema, max_level=1)
+
+    assert columns["address__geo"] == FlattenedColumn(("address", "geo"), True)
+    assert list(columns) == list(
+        flatten_schema(nested_schema, max_level=1)["properties"]
+    )
+
+
+@pytest.mark.parametrize("max_level", [1, 100])
+def test_extract_columns_matches_flatten_record(
+    nested_schema, nested_records, max_level
+):
+    flattened_schema = flatten_schema(nested_schema, max_level=max_level)
+    columns = flatten_schema_columns(nested_schema, max_level=max_level)
+
+    values = extract_columns(nested_records, columns.values())
+
+    expected = [
+        flatten_record(record, flattened_schema=flattened_schema, max_level=max_level)
+        for record in nested_records
+    ]
+    assert values == [
+        [record.get(name) for record in expected] for name in columns
+    ]
+
+
+def test_extract_columns_serializes_invalid_values():
+    """Objects and arrays of records not validated are serialized in scalar columns too"""
+    schema = {
+        "type": "object",
+        "properties": {"name": {"type": ["string"]}, "tags": {"type": ["array"]}},
+    }
+    records = [{"name": {"first": "a"}, "tags": ["x"]}, {"name": "b", "tags": None}]
+    columns = flatten_schema_columns(schema, max_level=10)
+
+    assert extract_columns(records, columns.values()) == [
+        ['{"first": "a"}', "b"],
+        ['["x"]', None],
+    ]
+    assert extract_columns(
+        records, [columns["tags"]._replace(serialize=False, native=True)]
+    ) == [[["x"], None]]
@@ -0,0 +1,75 @@
+import math
+from decimal import Decimal
+from io import BytesIO, StringIO, TextIOWrapper
+
+import pytest
+
+from target_parquet.utils import ingest
+from target_parquet.utils.ingest import has_number_constraints, loads, read_lines
+
+
+@pytest.mark.parametrize("line", ['{"type": "RECORD", "n": 1}\n', b'{"type": "RECORD", "n": 1}\n'])
+def test_loads(line):
+    assert loads(line) == {"type": "RECORD", "n": 1}
+
+
+def test_loads_standard_library(monkeypatch):
+    monkeypatch.setattr(ingest, "orjson", None)
+
+    assert loads(b'{"n": 1.10}') == {"n": Decimal("1.10")}
+
+
+def test_loads_decimals():
+    assert loads(b'{"n": 1.10}', decimals=True) == {"n": Decimal("1.10")}
+
+
+@pytest.mark.parametrize("number", [123456789012345678901234567890, -(2**63) - 1])
+def test_loads_wide_integers(number):
+    """Integers wider than 64 bits are parsed exactly, not as floats"""
+    assert loads(f'{{"n": {number}}}'.encode()) == {"n": number}
+
+
+def test_loads_nan_and_infinity():
+    message = loads(b'{"nan": NaN, "inf": Infinity, "n": 1}')
+
+    assert math.isnan(message["nan"])
+    assert message["inf"] == math.inf
+    assert message["n"] == 1
+
+
+@pytest.mark.parametrize(
+    "schema, expected",
+    [
+        pytest.param({"type": "number"}, False, id="unconstrained"),
+        pytest.param({"type": "number", "multipleOf": 0.01}, True, id="multipleOf"),
+        pytest.param({"type": "number", "multipleOf": Decimal("0.01")}, True, id="decimal"),
+        pytest.param(
+            {"properties": {"a": {"type": "array", "items": {"type": "integer", "minimum": 0}}}},
+            True,
+            id="nested",
+        ),
+        pytest.param(
+            {"properties": {"minimum": {"type": "string"}}}, False, id="property_name"
+        ),
+    ],
+)
+def test_has_number_constraints(schema, expected):
+    assert has_number_constraints(schema) is expected
+
+
+def test_loads_invalid_json():
+    with pytest.raises(ValueError):
+        loads(b'{"type": ')
+
+
+@pytest.mark.parametrize(
+    "file_input, expected",
+    [
+        pytest.param(StringIO("a\nb\nc"), ["a\n", "b\n", "c"], id="text"),
+        pytest.param(
+            TextIOWrapper(BytesIO(b"a\nb\nc")), [b"a\n", b"b\n", b"c"], id="binary_buffer"
+        ),
+    ],
+)
+def test_read_lines(file_input, expected):
+    assert list(read_lines(file_input, chunk_size=2)) == expected
@@ -0,0 +1,72 @@
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+from target_parquet.utils.metrics import Metric, MetricsRecorder, MetricType
+
+
+def test_metrics_recorder_prometheus_file(tmp_path):
+    prometheus_file = tmp_path / "target_parquet.prom"
+    metrics = MetricsRecorder(prometheus_file=str(prometheus_file))
+
+    with metrics.timer(Metric.ENCODE_DURATION, {"stream": "users"}):
+        pass
+    metrics.record(MetricType.COUNTER, Metric.BYTES_WRITTEN, 100, {"stream": "users"})
+    metrics.record(MetricType.COUNTER, Metric.BYTES_WRITTEN, 50, {"stream": "users"})
+    metrics.record(MetricType.HISTOGRAM, Metric.ROWS_PER_FILE, 10, {"stream": "users"})
+    metrics.record(MetricType.GAUGE, Metric.QUEUE_DEPTH, 3, {"queue": "write"})
+    metrics.record(MetricType.GAUGE, Metric.QUEUE_DEPTH, 1, {"queue": "write"})
+    metrics.close()
+
+    lines = prometheus_file.read_text().splitlines()
+    assert "# TYPE target_parquet_bytes_written_total counter" in lines
+    assert 'target_parquet_bytes_written_total{stream="users"} 150' in lines
+    assert "# TYPE target_parquet_encode_duration_seconds summary" in lines
+    assert 'target_parquet_encode_duration_seconds_count{stream="users"} 1' in lines
+    assert 'target_parquet_rows_per_file_sum{stream="users"} 10' in lines
+    assert 'target_parquet_queue_depth{queue="write"} 1' in lines
+
+
+def test_metrics_recorder_totals():
+    metrics = MetricsRecorder()
+
+    metrics.record(MetricType.TIMER, Metric.ENCODE_DURATION, 1.5, {"stream": "users"})
+    metrics.record(MetricType.TIMER, Metric.ENCODE_DURATION, 0.5, {"stream": "orders"})
+    metrics.record(MetricType.TIMER, Metric.FLATTEN_DURATION, 0.25, {"stream": "users"})
+    metrics.record(MetricType.COUNTER, Metric.BYTES_WRITTEN, 100, {"stream": "users"})
+
+    assert metrics.totals(MetricType.TIMER) == {
+        Metric.ENCODE_DURATION: 2.0,
+        Metric.FLATTEN_DURATION: 0.25,
+    }
+    assert metrics.totals(MetricType.COUNTER) == {Metric.BYTES_WRITTEN: 100}
+
+
+def test_metrics_recorder_concurrent_flush(tmp_path, caplog):
+    prometheus_file = tmp_path / "target_parquet.prom"
+    metrics = MetricsRecorder(prometheus_file=str(prometheus_file))
+
+    def flush(value):
+        metrics.record(MetricType.COUNTER, Metric.FILES_WRITTEN, value)
+        metrics.flush()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(flush, [1] * 200))
+
+    assert "Unable to write the Prometheus metrics file." not in caplog.text
+    assert "target_parquet_files_written_total 200" in prometheus_file.read_text()
+    assert [path.name for path in tmp_path.iterdir()] == ["target_parquet.prom"]
+
+
+def test_metrics_recorder_statsd():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(5)
+    metrics = MetricsRecorder(statsd_address=f"127.0.0.1:{server.getsockname()[1]}")
+
+    metrics.record(MetricType.COUNTER, Metric.FILES_WRITTEN, 1, {"stream": "users"})
+    metrics.record(MetricType.TIMER, Metric.UPLOAD_DURATION, 0.5)
+    metrics.close()
+
+    assert server.recv(1024) == b"target_parquet.files_written:1|c|#stream:users"
+    assert server.recv(1024) == b"target_parquet.upload_duration:500|ms"
+    server.close()
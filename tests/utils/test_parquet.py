@@ -1,4 +1,8 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from uuid import uuid4
 
 import pandas as pd
 import pyarrow as pa
@@ -6,14 +10,26 @@ import pyarrow.parquet as pq
 import pytest
 from singer_sdk.helpers._flattening import flatten_schema
 
+from target_parquet.utils.flattening import FlattenedColumn
 from target_parquet.utils.parquet import (
     EXTENSION_MAPPING,
+    CompressionRatioEstimator,
+    ConstantColumn,
+    PartitionedParquetWriter,
+    RecordBatchAccumulator,
+    RecordBatchBuilder,
+    RollingParquetWriter,
     _field_type_to_pyarrow_field,
-    concat_tables,
-    create_pyarrow_table,
+    _to_pyarrow_array,
+    codec_writer_options,
     flatten_schema_to_pyarrow_schema,
-    get_pyarrow_table_size,
+    merge_schemas,
+    parquet_writer_options,
+    promote_table,
+    select_compression,
+    sort_table,
     write_parquet_file,
+    zorder_values,
 )
 
 
@@ -66,6 +82,105 @@ def test_flatten_schema_to_pyarrow_schema():
     assert pyarrow_schema == expected_pyarrow_schema
 
 
+def test_flatten_schema_to_pyarrow_schema_native_types():
+    schema = {
+        "type": "object",
+        "properties": {
+            "datetime": {"type": ["null", "string"], "format": "date-time"},
+            "date": {"type": ["null", "string"], "format": "date"},
+            "amount": {"type": ["null", "number"], "multipleOf": 0.01},
+            "bounded": {"type": "number", "multipleOf": 0.5, "maximum": 1000},
+            "draft4": {
+                "type": "number",
+                "multipleOf": 0.01,
+                "maximum": 100,
+                "exclusiveMaximum": True,
+            },
+            "tags": {"type": ["null", "array"], "items": {"type": "integer"}},
+            "user": {
+                "type": ["null", "object"],
+                "properties": {
+                    "name": {"type": "string"},
+                    "seen_at": {"type": "string", "format": "date-time"},
+                },
+            },
+            "payload": {"type": ["null", "object"]},
+        },
+    }
+    pyarrow_schema = flatten_schema_to_pyarrow_schema(schema, native_types=True)
+    expected_pyarrow_schema = pa.schema(
+        [
+            pa.field("datetime", pa.timestamp("us", tz="UTC")),
+            pa.field("date", pa.date32()),
+            pa.field("amount", pa.decimal128(38, 2)),
+            pa.field("bounded", pa.decimal128(5, 1)),
+            pa.field("draft4", pa.decimal128(5, 2)),
+            pa.field("tags", pa.list_(pa.int64())),
+            pa.field(
+                "user",
+                pa.struct(
+                    [("name", pa.string()), ("seen_at", pa.timestamp("us", tz="UTC"))]
+                ),
+            ),
+            pa.field("payload", pa.string()),
+        ]
+    )
+    assert pyarrow_schema == expected_pyarrow_schema
+
+
+@pytest.mark.parametrize(
+    "values, data_type, expected",
+    [
+        pytest.param(
+            ["2024-01-01T10:00:00+02:00", "2024-01-01T10:00:00", None],
+            pa.timestamp("us", tz="UTC"),
+            [
+                datetime(2024, 1, 1, 8, tzinfo=timezone.utc),
+                datetime(2024, 1, 1, 10, tzinfo=timezone.utc),
+                None,
+            ],
+            id="timestamp",
+        ),
+        pytest.param(
+            ["2024-01-01T00:00:00Z", "2024-01-01T00:00:00.1234Z"],
+            pa.timestamp("us", tz="UTC"),
+            [
+                datetime(2024, 1, 1, tzinfo=timezone.utc),
+                datetime(2024, 1, 1, 0, 0, 0, 123400, tzinfo=timezone.utc),
+            ],
+            id="timestamp_utc",
+        ),
+        pytest.param(
+            ["2024-01-01T00:00:00Z", "2024-01-01T10:00:00.5", datetime(2024, 1, 2)],
+            pa.timestamp("us", tz="UTC"),
+            [
+                datetime(2024, 1, 1, tzinfo=timezone.utc),
+                datetime(2024, 1, 1, 10, 0, 0, 500000, tzinfo=timezone.utc),
+                datetime(2024, 1, 2, tzinfo=timezone.utc),
+            ],
+            id="timestamp_mixed",
+        ),
+        pytest.param(
+            ["2024-01-02", datetime(2024, 1, 3, 10)],
+            pa.date32(),
+            [date(2024, 1, 2), date(2024, 1, 3)],
+            id="date",
+        ),
+        pytest.param(
+            [{"amount": Decimal("1.5"), "at": "2024-01-01T00:00:00Z"}, None],
+            pa.struct([("at", pa.timestamp("us", tz="UTC")), ("amount", pa.float64())]),
+            [{"at": datetime(2024, 1, 1, tzinfo=timezone.utc), "amount": 1.5}, None],
+            id="struct",
+        ),
+    ],
+)
+def test_to_pyarrow_array_native_types(values, data_type, expected):
+    array = _to_pyarrow_array(values, pa.field("col", data_type))
+
+    assert array.type == data_type
+    assert array.to_pylist() == expected
+
+
 @pytest.mark.parametrize(
     "field_name, input_types, expected_result",
     [
@@ -96,35 +211,217 @@ def test_field_type_to_pyarrow_field(field_name, input_types, expected_result):
     assert result == expected_result
 
 
-def test_create_pyarrow_table(sample_schema):
-    data = [
+def test_record_batch_builder(sample_schema):
+    builder = RecordBatchBuilder(sample_schema)
+    builder.append({"id": 1, "name": "Alice", "age": 25, "unknown": "x"})
+    builder.append({"id": 2, "name": "Bob"})
+    assert builder.num_rows == 2
+
+    batch = builder.finish()
+
+    assert batch.schema.equals(sample_schema)
+    assert batch.to_pylist() == [
         {"id": 1, "name": "Alice", "age": 25},
-        {"id": 2, "name": "Bob"},
-        {"id": 3, "age": 22},
+        {"id": 2, "name": "Bob", "age": None},
+    ]
+    # The builder is reset after finishing a batch
+    assert builder.num_rows == 0
+    assert builder.finish().num_rows == 0
+
+
+def test_record_batch_builder_casts_mixed_values():
+    schema = pa.schema([("amount", pa.float64()), ("created_at", pa.string())])
+    builder = RecordBatchBuilder(schema)
+    builder.append({"amount": Decimal("1.5"), "created_at": 20240101})
+
+    batch = builder.finish()
+
+    assert batch.schema.equals(schema)
+    assert batch.to_pylist() == [{"amount": 1.5, "created_at": "20240101"}]
+
+
+def test_record_batch_builder_flattens_columns():
+    schema = pa.schema(
+        [("id", pa.int64()), ("user__name", pa.string()), ("source", pa.string())]
+    )
+    builder = RecordBatchBuilder(
+        schema,
+        columns={"user__name": FlattenedColumn(("user", "name"))},
+        constants={"source": ConstantColumn("api", schema.field("source"))},
+    )
+    builder.append({"id": 1, "user": {"name": "Alice"}})
+    builder.append({"id": 2, "user": None})
+
+    batch = builder.finish()
+
+    assert batch.to_pylist() == [
+        {"id": 1, "user__name": "Alice", "source": "api"},
+        {"id": 2, "user__name": None, "source": "api"},
+    ]
+
+
+def test_record_batch_builder_does_not_keep_records(sample_schema):
+    builder = RecordBatchBuilder(sample_schema)
+    record = {"id": 1, "name": "Alice", "age": 25}
+    builder.append(record)
+    # The values are extracted when the record is appended
+    record["name"] = "Bob"
+
+    assert builder.finish().to_pylist() == [{"id": 1, "name": "Alice", "age": 25}]
+
+
+def test_constant_column():
+    column = ConstantColumn("2024", pa.field("year", pa.int64()))
+
+    assert column.array(3).to_pylist() == [2024] * 3
+    first = column.array(2)
+    # Smaller batches are slices of the array already built
+    assert column.array(1).buffers()[1].address == first.buffers()[1].address
+    assert column.array(10).to_pylist() == [2024] * 10
+
+
+def test_sort_table():
+    table = pa.table({"x": [2, 1, None, 1], "y": ["a", "b", "c", "a"]})
+
+    assert sort_table(table, [("x", "ascending"), ("y", "ascending")]).to_pydict() == {
+        "x": [1, 1, 2, None],
+        "y": ["a", "b", "a", "c"],
+    }
+    assert sort_table(table, [("y", "descending")]).column("y").to_pylist() == [
+        "c",
+        "b",
+        "a",
+        "a",
     ]
-    expected_table = pd.DataFrame(data)
-    result_table = create_pyarrow_table(data, sample_schema)
+    assert sort_table(table, []) is table
+
+
+def test_zorder_values():
+    # A 4x2 grid, the Z-order curve visits each 2x2 square before the next one
+    table = pa.table({"x": [3, 2, 1, 0, 3, 2, 1, 0], "y": [1, 1, 1, 1, 0, 0, 0, 0]})
 
-    # Check if the result has the expected schema
-    assert result_table.schema.equals(sample_schema)
-    # Check if the result has the expected number of rows
-    assert len(result_table) == len(data)
-    # Check if the result has the expected data
-    assert result_table.to_pandas().equals(expected_table)
+    assert zorder_values(table, ["x", "y"]).to_pylist() == [7, 6, 3, 2, 5, 4, 1, 0]
+    assert sort_table(
+        table, [("x", "ascending"), ("y", "ascending")], zorder=True
+    ).to_pydict() == {"x": [0, 1, 0, 1, 2, 3, 2, 3], "y": [0, 0, 1, 1, 0, 0, 1, 1]}
 
 
-def test_concat_tables(sample_data, sample_schema):
-    # Define the initial PyArrow schema and table
-    initial_table = create_pyarrow_table(sample_data, sample_schema)
+def test_zorder_values_scales_ranks():
+    # The values are ranked, nulls last
+    table = pa.table({"x": [0, 2**40, 2**20], "y": [0.5, 0.1, None]})
+    assert zorder_values(table, ["x", "y"]).to_pylist() == [2, 4, 9]
 
-    # Call concat_tables with sample data
-    result_table = concat_tables(sample_data, initial_table, sample_schema)
+    # With 64 columns, each one has a single bit, so the 3 ranks are scaled to 0, 0, 1
+    table = pa.table({f"col_{i}": [0, 1, 2] if i == 0 else [0, 0, 0] for i in range(64)})
+    assert zorder_values(table, table.column_names).to_pylist() == [0, 0, 1]
 
-    # Create the expected PyArrow table using create_pyarrow_table
-    expected_table = create_pyarrow_table(sample_data * 2, sample_schema)
 
-    # Check if the resulting PyArrow table is equal to the expected table
-    assert result_table.equals(expected_table)
+def test_record_batch_accumulator(sample_data, sample_schema):
+    accumulator = RecordBatchAccumulator(sample_schema)
+    batch = pa.Table.from_pylist(sample_data, sample_schema).to_batches()[0]
+    accumulator.append(batch)
+    accumulator.append(batch.slice(0, 0))
+    accumulator.append(batch)
+
+    assert len(accumulator) == 6
+    assert accumulator.nbytes == 2 * batch.nbytes
+
+    table = accumulator.pop_table()
+
+    assert table.equals(pa.Table.from_pylist(sample_data * 2, sample_schema))
+    # The batches are not copied, and the accumulator is reset
+    assert table.column("id").num_chunks == 2
+    assert not accumulator
+    assert accumulator.pop_table().num_rows == 0
+
+
+def test_merge_schemas():
+    schema = pa.schema([("id", pa.int64()), ("name", pa.string())])
+
+    assert merge_schemas(
+        schema, pa.schema([("id", pa.float64()), ("age", pa.int64())])
+    ) == pa.schema([("id", pa.float64()), ("name", pa.string()), ("age", pa.int64())])
+    assert merge_schemas(schema, pa.schema([("id", pa.int64())])) == schema
+    assert merge_schemas(schema, pa.schema([("name", pa.int64())])) is None
+    # Structs with other fields can't be cast to each other
+    assert (
+        merge_schemas(
+            pa.schema([("address", pa.struct([("city", pa.string())]))]),
+            pa.schema([("address", pa.struct([("zip", pa.string())]))]),
+        )
+        is None
+    )
+
+
+def test_merge_schemas_nullable():
+    schema = pa.schema(
+        [pa.field("id", pa.int64(), False), pa.field("name", pa.string(), False)]
+    )
+
+    merged = merge_schemas(
+        schema, pa.schema([pa.field("id", pa.int64(), False), pa.field("age", pa.int64(), False)])
+    )
+
+    # The columns missing from one of the schemas are filled with nulls
+    assert [field.nullable for field in merged] == [False, True, True]
+
+
+def test_promote_table():
+    table = pa.table({"id": [1, 2], "name": ["a", "b"]})
+    schema = pa.schema([("id", pa.float64()), ("name", pa.string()), ("age", pa.int64())])
+
+    assert promote_table(table, schema).to_pydict() == {
+        "id": [1.0, 2.0],
+        "name": ["a", "b"],
+        "age": [None, None],
+    }
+    assert promote_table(table, table.schema) is table
+
+
+@pytest.mark.parametrize("spill", [False, True])
+def test_record_batch_accumulator_set_schema(tmpdir, sample_data, sample_schema, spill):
+    accumulator = RecordBatchAccumulator(
+        sample_schema, spill_dir=str(tmpdir.join("spill")) if spill else None
+    )
+    accumulator.append(pa.Table.from_pylist(sample_data, sample_schema).to_batches()[0])
+    schema = sample_schema.append(pa.field("city", pa.string()))
+    accumulator.set_schema(schema)
+    accumulator.append(
+        pa.Table.from_pylist([{"id": 4, "name": "Dan", "age": 40, "city": "Paris"}], schema)
+        .to_batches()[0]
+    )
+
+    table = accumulator.pop_table()
+
+    assert table.schema == schema
+    assert table.column("id").to_pylist() == [1, 2, 3, 4]
+    assert table.column("city").to_pylist() == [None, None, None, "Paris"]
+
+
+def test_record_batch_accumulator_spill(tmpdir, sample_data, sample_schema):
+    spill_dir = str(tmpdir.join("spill"))
+    accumulator = RecordBatchAccumulator(sample_schema, spill_dir=spill_dir)
+    batch = pa.Table.from_pylist(sample_data, sample_schema).to_batches()[0]
+    accumulator.append(batch)
+    accumulator.append(batch)
+
+    assert len(accumulator) == 6
+    assert accumulator.nbytes == 2 * batch.nbytes
+    assert accumulator.buffered_bytes == 0
+    assert len(os.listdir(spill_dir)) == 1
+
+    allocated_bytes = pa.total_allocated_bytes()
+    table = accumulator.pop_table()
+
+    assert table.equals(pa.Table.from_pylist(sample_data * 2, sample_schema))
+    # The table is memory-mapped, and the spill file is deleted
+    assert pa.total_allocated_bytes() == allocated_bytes
+    assert os.listdir(spill_dir) == []
+    assert not accumulator
+
+    # The next batches are spilled to a new file
+    accumulator.append(batch)
+    assert accumulator.pop_table().equals(pa.Table.from_batches([batch]))
 
 
 @pytest.mark.parametrize("compression_method", ["gzip", "snappy"])
@@ -133,7 +430,7 @@ def test_write_parquet_file(
     tmpdir, sample_data, sample_schema, compression_method, partition_cols
 ):
     # Create a PyArrow table from sample data
-    table = create_pyarrow_table(sample_data, sample_schema)
+    table = pa.Table.from_pylist(sample_data, sample_schema)
 
     # Define the path for the Parquet file within the temporary directory
     parquet_path = tmpdir.mkdir("test_parquet_file")
@@ -162,13 +459,360 @@ def test_write_parquet_file(
     assert read_table.to_pandas().equals(expected_table)
 
 
-def test_get_pyarrow_table_size(sample_data, sample_schema):
-    # Create a PyArrow table with sample data
-    table = create_pyarrow_table(sample_data * 100000, sample_schema)
+def test_parquet_writer_options():
+    schema = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("name", pa.string()),
+            ("price", pa.float64()),
+            ("created_at", pa.timestamp("us", tz="UTC")),
+            ("tags", pa.list_(pa.int64())),
+            ("address", pa.struct([("city", pa.string())])),
+        ]
+    )
+
+    # Every column is dictionary encoded by default
+    assert parquet_writer_options(schema) == {
+        "use_dictionary": True,
+        "write_statistics": True,
+    }
+    assert parquet_writer_options(schema, column_encoding="auto") == {
+        "use_dictionary": ["name", "address.city"],
+        "column_encoding": {
+            "id": "DELTA_BINARY_PACKED",
+            "price": "BYTE_STREAM_SPLIT",
+            "created_at": "DELTA_BINARY_PACKED",
+            "tags.list.element": "DELTA_BINARY_PACKED",
+        },
+        "write_statistics": True,
+    }
+    assert parquet_writer_options(
+        schema,
+        compression_level=9,
+        use_dictionary=["id"],
+        column_encoding="auto",
+        write_statistics=["id"],
+    ) == {
+        "use_dictionary": ["id"],
+        "column_encoding": {
+            "price": "BYTE_STREAM_SPLIT",
+            "created_at": "DELTA_BINARY_PACKED",
+            "tags.list.element": "DELTA_BINARY_PACKED",
+        },
+        "write_statistics": ["id"],
+        "compression_level": 9,
+    }
+    assert parquet_writer_options(
+        schema, column_encoding={}, write_page_index=True, data_page_size=65536
+    ) == {
+        "use_dictionary": True,
+        "write_statistics": True,
+        "write_page_index": True,
+        "data_page_size": 65536,
+    }
+
+
+def test_parquet_writer_options_column_encoding(caplog):
+    schema = pa.schema([("name", pa.string()), ("price", pa.float64())])
+    table = pa.table({"name": ["a", "b"], "price": [1.5, 2.5]}, schema=schema)
+
+    options = parquet_writer_options(
+        schema,
+        column_encoding={
+            "name": "BYTE_STREAM_SPLIT",
+            "price": "BYTE_STREAM_SPLIT",
+            "other_stream_column": "PLAIN",
+        },
+    )
+
+    # The encodings not supported by the column types are ignored
+    assert options == {
+        "use_dictionary": ["name"],
+        "column_encoding": {"price": "BYTE_STREAM_SPLIT"},
+        "write_statistics": True,
+    }
+    assert "Ignoring the BYTE_STREAM_SPLIT encoding of name" in caplog.text
+    pq.write_table(table, pa.BufferOutputStream(), **options)
+    with pytest.raises(AssertionError, match="column_encoding of name must be one of"):
+        parquet_writer_options(schema, column_encoding={"name": "RLE_DICTIONARY"})
+
+
+@pytest.mark.parametrize("partition_cols", [None, ["name"]])
+def test_write_parquet_file_writer_options(
+    tmpdir, sample_data, sample_schema, partition_cols
+):
+    table = pa.Table.from_pylist(sample_data, sample_schema)
+    parquet_path = str(tmpdir.mkdir("test_parquet_file"))
+
+    write_parquet_file(
+        table,
+        parquet_path,
+        compression_method="zstd",
+        partition_cols=partition_cols,
+        writer_options=parquet_writer_options(
+            sample_schema,
+            compression_level=9,
+            column_encoding="auto",
+            write_statistics=["age"],
+        ),
+    )
+
+    parquet_file = pq.ParquetFile(
+        next(
+            os.path.join(root, file)
+            for root, _, files in os.walk(parquet_path)
+            for file in files
+        )
+    )
+    columns = {
+        column.path_in_schema: column
+        for column in map(
+            parquet_file.metadata.row_group(0).column,
+            range(parquet_file.metadata.num_columns),
+        )
+    }
+    assert "DELTA_BINARY_PACKED" in columns["id"].encodings
+    assert not columns["id"].is_stats_set
+    assert columns["age"].is_stats_set
+    if not partition_cols:
+        assert "RLE_DICTIONARY" in columns["name"].encodings
+    assert pq.read_table(parquet_path).num_rows == len(sample_data)
+
+
+@pytest.mark.parametrize("max_file_size, expected_files", [(None, 1), (1, 3)])
+def test_rolling_parquet_writer(
+    tmpdir, sample_data, sample_schema, max_file_size, expected_files
+):
+    parquet_path = str(tmpdir.mkdir("test_rolling_parquet_writer"))
+    file_names = iter(f"test_parquet_file-{n}-{{i}}" for n in range(10))
+    writer = RollingParquetWriter(
+        parquet_path,
+        sample_schema,
+        basename_template=lambda: next(file_names),
+        max_file_size=max_file_size,
+    )
+    table = pa.Table.from_pylist(sample_data, sample_schema)
+
+    for batch in [*table.to_batches(), *table.to_batches(), *table.to_batches()]:
+        writer.write(batch)
+        assert writer.bytes_written < (max_file_size or float("inf"))
+    writer.close()
+
+    assert len(writer.files_written) == expected_files
+    assert sorted(os.listdir(parquet_path)) == [
+        f"test_parquet_file-{n}-0.gz.parquet" for n in range(expected_files)
+    ]
+    result = pq.read_table(parquet_path)
+    assert result.num_rows == 3 * len(sample_data)
+    if not max_file_size:
+        # One row group per write
+        assert pq.ParquetFile(writer.files_written[0]).num_row_groups == 3
+
+
+def test_codec_writer_options():
+    options = {"compression_level": 15, "use_dictionary": ["name"]}
+
+    assert codec_writer_options("zstd", options) == options
+    assert codec_writer_options("gzip", options) == {"use_dictionary": ["name"]}
+    assert codec_writer_options("snappy", options) == {"use_dictionary": ["name"]}
+
+
+def test_select_compression():
+    table = pa.table(
+        {
+            "id": pa.array(range(10000)),
+            "name": pa.array([f"name{i % 100}" for i in range(10000)]),
+        }
+    )
+    codecs = ["snappy", "gzip"]
+
+    # The transfer time dominates at a low bandwidth, the encoding time at a high one
+    assert select_compression(table, bandwidth=1, codecs=codecs) == "gzip"
+    assert select_compression(table, bandwidth=10**15, codecs=codecs) == "snappy"
+
+
+def test_compression_ratio_estimator(sample_data, sample_schema):
+    estimator = CompressionRatioEstimator(smoothing=0.5)
+    assert estimator.estimate(1000) == 1000
+
+    estimator.update(1000, 100)
+    assert estimator.estimate(1000) == 100
+    estimator.update(1000, 300)
+    assert estimator.estimate(1000) == 200
+    # Empty writes are ignored
+    estimator.update(0, 0)
+    assert estimator.ratio == pytest.approx(0.2)
 
-    # Test the get_pyarrow_table_size function
-    size_in_mb = get_pyarrow_table_size(table)
+    table = pa.Table.from_pylist(sample_data * 100, sample_schema)
+    rows = estimator.rows_per_row_group(table, table.nbytes)
+    assert rows == pytest.approx(len(table) / 0.2, rel=0.01)
+
+
+def test_write_parquet_file_row_group_size(tmpdir, sample_data, sample_schema):
+    table = pa.Table.from_pylist(sample_data * 10, sample_schema)
+    parquet_path = tmpdir.mkdir("test_parquet_file")
+
+    encoded_bytes = write_parquet_file(
+        table,
+        str(parquet_path),
+        basename_template="test_parquet_file-{i}",
+        row_group_size=7,
+    )
+
+    file_path = parquet_path.join("test_parquet_file-0.gz.parquet")
+    assert encoded_bytes == os.path.getsize(file_path)
+    metadata = pq.ParquetFile(str(file_path)).metadata
+    assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [
+        7,
+        7,
+        7,
+        7,
+        2,
+    ]
+
+
+def test_rolling_parquet_writer_row_group_size(tmpdir, sample_data, sample_schema):
+    parquet_path = str(tmpdir.mkdir("test_rolling_parquet_writer"))
+    table = pa.Table.from_pylist(sample_data, sample_schema)
+    writer = RollingParquetWriter(
+        parquet_path,
+        sample_schema,
+        basename_template=lambda: "test_parquet_file-{i}",
+        row_group_size=table.nbytes * 2,
+    )
+
+    for _ in range(5):
+        writer.write(table)
+    writer.close()
+
+    # Without compression ratio learned yet, two writes fill a row group
+    metadata = pq.ParquetFile(writer.files_written[0]).metadata
+    assert metadata.num_rows == 5 * len(sample_data)
+    assert metadata.row_group(0).num_rows == 2 * len(sample_data)
+    assert writer.compression_ratio.ratio != 1
+
+
+def test_partitioned_parquet_writer(tmpdir, sample_schema):
+    parquet_path = str(tmpdir.mkdir("test_partitioned_parquet_writer"))
+    file_names = iter(f"test_parquet_file-{n}-{{i}}" for n in range(10))
+    writer = PartitionedParquetWriter(
+        parquet_path,
+        sample_schema,
+        ["name"],
+        basename_template=lambda: next(file_names),
+    )
+    data = [
+        {"id": 1, "name": "Alice", "age": 25},
+        {"id": 2, "name": "Bob", "age": 30},
+        {"id": 3, "name": None, "age": 22},
+        {"id": 4, "name": "Alice", "age": 40},
+    ]
+
+    for _ in range(3):
+        writer.write(pa.Table.from_pylist(data, sample_schema))
+    assert len(writer.open_partitions) == 3
+    writer.close()
+
+    # One file per partition across all the writes
+    assert sorted(os.listdir(parquet_path)) == [
+        "name=Alice",
+        "name=Bob",
+        "name=__HIVE_DEFAULT_PARTITION__",
+    ]
+    assert len(writer.files_written) == 3
+    alice = pq.read_table(os.path.join(parquet_path, "name=Alice"))
+    assert alice.column_names == ["id", "age"]
+    assert alice.to_pydict() == {"id": [1, 4] * 3, "age": [25, 40] * 3}
+    assert pq.read_table(parquet_path).num_rows == 12
+
+
+def test_partitioned_parquet_writer_eviction(tmpdir, sample_schema):
+    parquet_path = str(tmpdir.mkdir("test_partitioned_parquet_writer"))
+    file_names = iter(f"test_parquet_file-{n}-{{i}}" for n in range(10))
+    writer = PartitionedParquetWriter(
+        parquet_path,
+        sample_schema,
+        ["name"],
+        basename_template=lambda: next(file_names),
+        max_open_partitions=1,
+    )
+
+    writer.write(pa.Table.from_pylist([{"id": 1, "name": "Alice"}], sample_schema))
+    writer.write(pa.Table.from_pylist([{"id": 2, "name": "Bob"}], sample_schema))
+    assert [os.path.basename(p) for p in writer.open_partitions] == ["name=Bob"]
+    writer.write(pa.Table.from_pylist([{"id": 3, "name": "Alice"}], sample_schema))
+    writer.close()
+
+    # Alice's writer was evicted, so the next write started a new file
+    assert len(os.listdir(os.path.join(parquet_path, "name=Alice"))) == 2
+
+    writer.idle_timeout = 0
+    writer.write(pa.Table.from_pylist([{"id": 4, "name": "Carol"}], sample_schema))
+    assert writer.open_partitions == []
+
+
+def test_partitioned_parquet_writer_max_open_partitions(
+    monkeypatch, tmpdir, sample_schema
+):
+    """A single write of more partitions than max_open_partitions keeps the limit"""
+    parquet_path = str(tmpdir.mkdir("test_partitioned_parquet_writer"))
+    open_writers = set()
+    max_open_writers = 0
+    rolling_open = RollingParquetWriter._open
+    rolling_close = RollingParquetWriter.close
+
+    def _open(self):
+        nonlocal max_open_writers
+        rolling_open(self)
+        open_writers.add(self)
+        max_open_writers = max(max_open_writers, len(open_writers))
+
+    def close(self):
+        rolling_close(self)
+        open_writers.discard(self)
+
+    monkeypatch.setattr(RollingParquetWriter, "_open", _open)
+    monkeypatch.setattr(RollingParquetWriter, "close", close)
+    writer = PartitionedParquetWriter(
+        parquet_path,
+        sample_schema,
+        ["name"],
+        basename_template=lambda: f"test_parquet_file-{uuid4()}-{{i}}",
+        max_open_partitions=5,
+    )
+
+    writer.write(
+        pa.Table.from_pylist(
+            [{"id": n, "name": f"name{n}"} for n in range(50)], sample_schema
+        )
+    )
+    assert max_open_writers == 5
+    assert len(writer.open_partitions) == 5
+    writer.close()
+
+    assert not open_writers
+    assert len(os.listdir(parquet_path)) == 50
+    assert len(writer.files_written) == 50
+
+
+def test_partitioned_parquet_writer_concurrent_sizes(tmpdir, sample_schema):
+    """The sizes are read by the main thread while background writes evict writers"""
+    writer = PartitionedParquetWriter(
+        str(tmpdir.mkdir("test_partitioned_parquet_writer")),
+        sample_schema,
+        ["name"],
+        basename_template=lambda: f"test_parquet_file-{uuid4()}-{{i}}",
+        max_open_partitions=1,
+    )
+    tables = [
+        pa.Table.from_pylist([{"id": n, "name": f"name{n}"}], sample_schema)
+        for n in range(200)
+    ]
 
-    # Check if the result is a non-negative float
-    assert isinstance(size_in_mb, float)
-    assert pytest.approx(size_in_mb, 0.1) == 7.15
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(lambda: [writer.write(table) for table in tables])
+        while not future.done():
+            assert writer.buffered_bytes >= 0
+            assert writer.bytes_written >= 0
+        future.result()
+    writer.close()
@@ -0,0 +1,110 @@
+from decimal import Decimal
+from importlib import metadata
+
+import pyarrow as pa
+import pytest
+
+from target_parquet.utils import schema_cache
+from target_parquet.utils.flattening import FlattenedColumn
+from target_parquet.utils.schema_cache import (
+    SchemaArtifacts,
+    SchemaCache,
+    deserialize_artifacts,
+    schema_cache_key,
+    serialize_artifacts,
+)
+
+
+@pytest.fixture()
+def artifacts():
+    return SchemaArtifacts(
+        {
+            "type": "object",
+            "properties": {
+                "price": {"type": ["number"], "multipleOf": Decimal("0.01")},
+                "tags": {"type": ["array"], "items": {"type": ["string"]}},
+            },
+        },
+        {
+            "price": FlattenedColumn(("price",)),
+            "tags": FlattenedColumn(("tags",), serialize=True),
+        },
+        pa.schema(
+            [("price", pa.decimal128(38, 2)), ("tags", pa.list_(pa.string()))],
+            metadata={"origin": "test"},
+        ),
+    )
+
+
+@pytest.mark.parametrize("flattened_columns", [True, False], ids=["columns", "no_columns"])
+def test_serialize_artifacts(artifacts, flattened_columns):
+    if not flattened_columns:
+        artifacts = artifacts._replace(flattened_columns=None)
+
+    result = deserialize_artifacts(serialize_artifacts(artifacts))
+
+    assert result.flatten_schema == artifacts.flatten_schema
+    assert isinstance(result.flatten_schema["properties"]["price"]["multipleOf"], Decimal)
+    assert result.flattened_columns == artifacts.flattened_columns
+    assert result.pyarrow_schema.equals(artifacts.pyarrow_schema, check_metadata=True)
+
+
+def test_schema_cache_key():
+    schema = {"type": "object", "properties": {"a": {"type": ["string"]}}}
+
+    key = schema_cache_key(schema, flatten_max_level=100, native_types=False)
+
+    assert key == schema_cache_key(
+        {"properties": {"a": {"type": ["string"]}}, "type": "object"},
+        native_types=False,
+        flatten_max_level=100,
+    )
+    assert key != schema_cache_key(schema, flatten_max_level=100, native_types=True)
+    assert key != schema_cache_key(
+        {"type": "object", "properties": {"a": {"type": ["integer"]}}},
+        flatten_max_level=100,
+        native_types=False,
+    )
+
+
+def test_schema_cache_key_versions(monkeypatch):
+    schema = {"type": "object", "properties": {"a": {"type": ["string"]}}}
+    key = schema_cache_key(schema)
+
+    assert schema_cache.compiler_versions() == (
+        pa.__version__,
+        metadata.version("singer-sdk"),
+        metadata.version("target-parquet"),
+    )
+    # Upgrading singer_sdk or target_parquet invalidates the cached artifacts
+    monkeypatch.setattr(
+        schema_cache,
+        "compiler_versions",
+        lambda: (pa.__version__, "0.0.0", "0.0.0"),
+    )
+    assert key != schema_cache_key(schema)
+
+
+def test_schema_cache(artifacts):
+    cache = SchemaCache()
+
+    assert cache.get("key") is None
+    cache.put("key", artifacts)
+    assert cache.get("key") is artifacts
+
+
+def test_schema_cache_dir(artifacts, tmp_path):
+    SchemaCache(str(tmp_path)).put("key", artifacts)
+
+    result = SchemaCache(str(tmp_path)).get("key")
+
+    assert result.flatten_schema == artifacts.flatten_schema
+    assert result.flattened_columns == artifacts.flattened_columns
+    assert result.pyarrow_schema == artifacts.pyarrow_schema
+    assert [path.name for path in tmp_path.iterdir()] == ["key.arrows"]
+
+
+def test_schema_cache_dir_invalid_file(tmp_path):
+    (tmp_path / "key.arrows").write_bytes(b"invalid")
+
+    assert SchemaCache(str(tmp_path)).get("key") is None